@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+# Классы приоритета: меньше — важнее
+INTERACTIVE = 0
+REFRESH = 1
+BULK = 2
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', REFRESH: 'refresh', BULK: 'bulk'}
+
+class RequestDropped(requests.exceptions.RequestException):
+    """Запрос не дождался своей очереди до дедлайна"""
+
+class ApiRequestScheduler:
+    """
+    Общая очередь запросов к Clash Royale API.
+
+    Все запросы делят один бюджет (корзина токенов rate в секунду, burst подряд).
+    Освободившийся токен получает самый приоритетный ожидающий запрос, фоновые
+    классы не трогают последние reserve токенов, чтобы команды пользователей
+    не ждали, пока фон выбирает квоту. У каждого класса свой лимит одновременных
+    запросов и свое максимальное ожидание: устаревшая фоновая работа
+    отбрасывается (RequestDropped), а не копится.
+    Потокобезопасна: запросы выполняются из asyncio.to_thread.
+    """
+    
+    def __init__(self, rate, burst, limits, timeouts, reserve=2):
+        # limits / timeouts: {INTERACTIVE: ..., REFRESH: ..., BULK: ...}
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits
+        self.timeouts = timeouts
+        self.reserve = reserve
+        
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.active = {priority: 0 for priority in PRIORITY_NAMES}
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.dropped = {priority: 0 for priority in PRIORITY_NAMES}
+    
+    @contextmanager
+    def slot(self, priority=INTERACTIVE):
+        """Дождаться права на запрос; RequestDropped, если дедлайн класса истек"""
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active[priority] -= 1
+                self.condition.notify_all()
+    
+    def acquire(self, priority):
+        deadline = time.monotonic() + self.timeouts[priority]
+        entry = (priority, next(self.sequence))
+        
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            
+            while True:
+                self.refill()
+                wait = self.wait_time(entry)
+                if wait == 0:
+                    break
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                    self.dropped[priority] += 1
+                    self.condition.notify_all()
+                    raise RequestDropped(f'{PRIORITY_NAMES[priority]} request waited over {self.timeouts[priority]}s')
+                
+                self.condition.wait(min(wait, remaining))
+            
+            self.waiting.remove(entry)
+            heapq.heapify(self.waiting)
+            self.tokens -= 1
+            self.active[priority] += 1
+            self.condition.notify_all()
+    
+    def set_rate(self, rate):
+        """Изменить общий бюджет (например, когда часть токенов выведена из ротации)"""
+        with self.condition:
+            if rate == self.rate:
+                return
+            self.refill()
+            self.rate = rate
+            self.condition.notify_all()
+    
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, entry):
+        """0 — можно выполнять сейчас, иначе через сколько секунд проверить снова"""
+        priority = entry[0]
+        
+        # Первым идет самый приоритетный ожидающий запрос среди классов, не упершихся в лимит
+        runnable = [e for e in self.waiting if self.active[e[0]] < self.limits[e[0]]]
+        if not runnable or min(runnable) != entry:
+            return 1.0
+        
+        needed = 1 if priority == INTERACTIVE else 1 + self.reserve
+        if self.tokens >= needed:
+            return 0
+        return (needed - self.tokens) / self.rate
+    
+    def stats(self):
+        with self.condition:
+            return {
+                PRIORITY_NAMES[priority]: {
+                    'active': self.active[priority],
+                    'waiting': sum(1 for e in self.waiting if e[0] == priority),
+                    'dropped': self.dropped[priority]
+                }
+                for priority in PRIORITY_NAMES
+            }
+
+class NoHealthyToken(requests.exceptions.RequestException):
+    """Все токены API временно выведены из ротации"""
+
+class ApiTokenPool:
+    """
+    Пул токенов Clash Royale API.
+
+    Лимит API считается на ключ, поэтому у каждого токена своя корзина
+    (rate в секунду, burst подряд). Запрос получает наименее загруженный
+    исправный токен: меньше запросов в полете, затем больше остаток корзины.
+    Токен, получивший 429, отдыхает Retry-After (или RATE_LIMITED_COOLDOWN)
+    секунд; 403 — неверный ключ или не тот IP, такой токен выводится
+    на FORBIDDEN_COOLDOWN.
+    """
+    
+    RATE_LIMITED_COOLDOWN = 10
+    FORBIDDEN_COOLDOWN = 600
+    
+    def __init__(self, tokens, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        
+        now = time.monotonic()
+        self.tokens = [
+            {
+                'token': token,
+                'available': float(burst),
+                'updated': now,
+                'active': 0,
+                'sidelined_until': 0,
+                'requests': 0,
+                'rejected': 0
+            }
+            for token in tokens
+        ]
+    
+    def acquire(self):
+        """Выбрать токен для запроса; NoHealthyToken, если исправных нет"""
+        with self.lock:
+            now = time.monotonic()
+            healthy = [entry for entry in self.tokens if entry['sidelined_until'] <= now]
+            if not healthy:
+                raise NoHealthyToken('all API tokens are sidelined')
+            
+            for entry in healthy:
+                entry['available'] = min(self.burst, entry['available'] + (now - entry['updated']) * self.rate)
+                entry['updated'] = now
+            
+            entry = min(healthy, key=lambda e: (e['active'], -e['available']))
+            entry['available'] -= 1
+            entry['active'] += 1
+            entry['requests'] += 1
+            return entry
+    
+    def release(self, entry, status=None, retry_after=None):
+        """Вернуть токен после запроса; 403 и 429 выводят его из ротации"""
+        with self.lock:
+            entry['active'] -= 1
+            
+            if status == 429:
+                try:
+                    cooldown = float(retry_after)
+                except (TypeError, ValueError):
+                    cooldown = self.RATE_LIMITED_COOLDOWN
+                entry['sidelined_until'] = time.monotonic() + cooldown
+                entry['available'] = 0
+                entry['rejected'] += 1
+            elif status == 403:
+                entry['sidelined_until'] = time.monotonic() + self.FORBIDDEN_COOLDOWN
+                entry['rejected'] += 1
+    
+    def capacity(self):
+        """Суммарный лимит исправных токенов, запросов в секунду"""
+        with self.lock:
+            now = time.monotonic()
+            return self.rate * sum(1 for entry in self.tokens if entry['sidelined_until'] <= now)
+    
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return [
+                {
+                    'token': entry['token'][-6:],
+                    'active': entry['active'],
+                    'requests': entry['requests'],
+                    'rejected': entry['rejected'],
+                    'sidelined': max(0, entry['sidelined_until'] - now)
+                }
+                for entry in self.tokens
+            ]
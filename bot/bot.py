@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher, F, Router
-from aiogram.filters import Command, CommandStart
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -10,8 +10,12 @@ import json
 import base64
 
 import config
-from database import Database
-from royale_api import ClashRoyaleAPI
+import handlers
+from meta import build_meta
+from profiler import SlowUpdateProfiler
+from scheduler import Scheduler
+from services import db, cr_api, matchmaking, game_writes
+from throttling import ReplyCaptureMiddleware, ThrottlingMiddleware
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -22,19 +26,21 @@ bot = Bot(token=config.BOT_TOKEN)
 dp = Dispatcher()
 router = Router()
 
-db = Database(config.DATABASE_PATH)
-cr_api = ClashRoyaleAPI(config.CLASH_ROYALE_API_TOKEN)
-
 # FSM States
 class Registration(StatesGroup):
     waiting_for_tag = State()
 
 # Команды
 @router.message(CommandStart())
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, command: CommandObject):
     """Обработка /start"""
     logger.info(f"User {message.from_user.id} started bot")
     
+    # Ссылка из Mini App: t.me/<bot>?start=find
+    if command.args == 'find':
+        await handlers.cmd_find(message)
+        return
+    
     user = db.get_user(message.from_user.id)
     
     # Базовый URL Mini App
@@ -53,10 +59,8 @@ async def cmd_start(message: Message):
     
     if user:
         # Получаем позицию в рейтинге
-        leaderboard = db.get_leaderboard(limit=1000)
-        position = next((i for i, p in enumerate(leaderboard, 1) if p['user_id'] == message.from_user.id), None)
-        if position is None:
-            position = '-'
+        rank = db.get_user_rank(message.from_user.id)
+        position = rank['position'] if rank else '-'
         
         # Получаем статистику
         games = db.get_user_games(message.from_user.id, limit=1000)
@@ -95,8 +99,8 @@ async def cmd_sync(message: Message):
         return
     
     # Получаем статистику
-    leaderboard = db.get_leaderboard(limit=1000)
-    position = next((i for i, p in enumerate(leaderboard, 1) if p['user_id'] == message.from_user.id), None)
+    rank = db.get_user_rank(message.from_user.id)
+    position = rank['position'] if rank else None
     
     games = db.get_user_games(message.from_user.id, limit=1000)
     wins = sum(1 for g in games if g['result'] == 'win')
@@ -113,7 +117,12 @@ async def cmd_sync(message: Message):
         'wins': wins,
         'losses': losses,
         'registered': True,
-        'first_name': message.from_user.first_name
+        'first_name': message.from_user.first_name,
+        'bot_username': (await message.bot.me()).username,
+        'meta': [
+            {'name': card['name'], 'usage': round(card['usage'], 1), 'winrate': round(card['winrate'], 1)}
+            for card in build_meta(db, limit=5)['cards']
+        ]
     }
     
     # Кодируем данные в base64
@@ -186,7 +195,7 @@ async def process_registration(message: Message, state: FSMContext):
     if not player_tag.startswith('#TEST'):
         msg = await message.answer("⏳ Проверяю тег через Clash Royale API...")
         
-        player_data = cr_api.get_player(player_tag)
+        player_data = await asyncio.to_thread(cr_api.get_player, player_tag)
         
         if not player_data:
             await msg.edit_text(
@@ -225,6 +234,10 @@ async def process_registration(message: Message, state: FSMContext):
             parse_mode="HTML"
         )
         
+        # Сохраняем профиль, чтобы /profile сразу отвечал из БД
+        if not player_tag.startswith('#TEST'):
+            db.save_player_snapshot(player_tag, message.from_user.id, player_data)
+        
         logger.info(f"User {message.from_user.id} registered with tag {player_tag}")
     else:
         await msg.edit_text("❌ Ошибка регистрации. Попробуй позже.")
@@ -242,7 +255,7 @@ async def cmd_verify(message: Message):
     
     msg = await message.answer("⏳ Проверяю последнюю игру...")
     
-    battle_data = cr_api.verify_battle(user['player_tag'])
+    battle_data = await asyncio.to_thread(cr_api.verify_battle, user['player_tag'])
     
     if not battle_data:
         await msg.edit_text("❌ Не найдено недавних боев (последние 30 минут)")
@@ -255,8 +268,10 @@ async def cmd_verify(message: Message):
     # Подсчитываем очки
     points = cr_api.calculate_points(battle_data)
     
-    # Сохраняем игру
-    db.add_game(message.from_user.id, battle_data, points)
+    # Сохраняем игру (один бой засчитывается пользователю один раз)
+    if not await game_writes.add_game(message.from_user.id, battle_data, points):
+        await msg.edit_text("⚠️ Этот бой уже засчитан! Сыграй новый и попробуй снова.")
+        return
     
     result_emoji = {
         'win': '🏆 Победа',
@@ -339,6 +354,10 @@ async def cmd_help(message: Message):
 /verify - Проверить последнюю игру
 /stats - Твоя статистика
 /leaderboard - Топ-10 игроков
+/find - Найти соперника
+/tjoin - Записаться на турнир
+/meta - Популярные карты и колоды
+/rating - Рейтинг силы (Glicko-2)
 /help - Эта справка
 
 <b>Как начать:</b>
@@ -380,9 +399,37 @@ async def callback_leaderboard(callback: CallbackQuery):
     await callback.answer()
     await cmd_leaderboard(callback.message)
 
+def setup_dispatcher(tg_bot=None):
+    """Подключение роутеров и middleware к диспетчеру"""
+    tg_bot = tg_bot or bot
+    
+    if config.PROFILE_SLOW_UPDATES:
+        dp.update.outer_middleware(SlowUpdateProfiler(
+            config.PROFILE_THRESHOLD_MS,
+            config.PROFILE_DIR,
+            interval_ms=config.PROFILE_INTERVAL_MS,
+            max_files=config.PROFILE_MAX_FILES
+        ))
+    
+    # Лимиты на дорогие команды с повтором последнего ответа
+    dp.message.outer_middleware(ThrottlingMiddleware(config.THROTTLE_RULES))
+    tg_bot.session.middleware(ReplyCaptureMiddleware())
+    
+    dp.include_router(router)
+    dp.include_router(handlers.router)
+
 async def main():
     """Запуск бота"""
-    dp.include_router(router)
+    setup_dispatcher()
+    
+    # Рейтинг в памяти загружаем до первых апдейтов, а не в обработчике
+    if db.ranking is not None:
+        await asyncio.to_thread(db.get_ranking)
+    
+    # Фоновые задачи: сброс очков, награды, архив, профили игроков
+    scheduler = Scheduler(db, bot, cr_api)
+    scheduler_task = asyncio.create_task(scheduler.start())
+    matchmaking_task = asyncio.create_task(matchmaking.run(bot))
     
     logger.info("✅ Bot started successfully!")
     logger.info(f"Mini App URL: {config.MINI_APP_URL}")
@@ -9,12 +9,68 @@ BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 # Clash Royale API Token от https://developer.clashroyale.com
 CLASH_ROYALE_API_TOKEN = os.getenv('CLASH_ROYALE_API_TOKEN', 'YOUR_API_TOKEN_HERE')
 
+# Пул токенов через запятую (каждый ключ со своим лимитом), по умолчанию один CLASH_ROYALE_API_TOKEN
+CLASH_ROYALE_API_TOKENS = [
+    x.strip() for x in os.getenv('CLASH_ROYALE_API_TOKENS', CLASH_ROYALE_API_TOKEN).split(',') if x.strip()
+]
+
+# Лимит одного токена Clash Royale API: запросов в секунду и сколько можно подряд
+# (общий бюджет бота — лимит, умноженный на число исправных токенов)
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '10'))
+API_BURST = int(os.getenv('API_BURST', '10'))
+
+# Сколько токенов бюджета фоновые задачи оставляют командам пользователей
+API_INTERACTIVE_RESERVE = int(os.getenv('API_INTERACTIVE_RESERVE', '2'))
+
+# По классам приоритета (0 — команды пользователей, 1 — обновление профилей, 2 — автосбор боев):
+# одновременных запросов на токен и сколько секунд запрос может ждать очереди
+API_CONCURRENCY = {0: 8, 1: 2, 2: 4}
+API_QUEUE_TIMEOUT = {0: 10, 1: 60, 2: 120}
+
 # URL твоего Mini App (после деплоя на GitHub Pages)
 MINI_APP_URL = os.getenv('MINI_APP_URL', 'https://yourusername.github.io/clash-royale-tournament-bot')
 
+# Telegram ID администраторов через запятую
+ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()]
+
 # База данных
 DATABASE_PATH = 'tournament.db'
 
+# Архив игр прошлых месяцев (горячая таблица games хранит только текущий месяц)
+ARCHIVE_DATABASE_PATH = 'tournament_archive.db'
+
+# Реплика БД в памяти для тяжелого чтения (таблицы лидеров, статистика):
+# допустимая устаревшость в секундах (0 — читать из основной БД) и период обновления
+READ_REPLICA_MAX_AGE = float(os.getenv('READ_REPLICA_MAX_AGE', '0'))
+READ_REPLICA_REFRESH_INTERVAL = float(os.getenv('READ_REPLICA_REFRESH_INTERVAL', '2'))
+
+# Рейтинг месяца в памяти процесса (RANKING_ENGINE=1 чтобы включить): топ, место и соседи
+# по рейтингу считаются в типизированных массивах без запросов к БД, ~24 байта на игрока
+RANKING_ENGINE = os.getenv('RANKING_ENGINE', '0') == '1'
+
+# Профили игроков: через сколько минут профиль считается устаревшим,
+# как часто фоновая задача обновляет профили и пауза между запросами к API
+SNAPSHOT_MAX_AGE_MINUTES = int(os.getenv('SNAPSHOT_MAX_AGE_MINUTES', '60'))
+SNAPSHOT_REFRESH_INTERVAL = int(os.getenv('SNAPSHOT_REFRESH_INTERVAL', '300'))
+SNAPSHOT_REFRESH_BATCH = int(os.getenv('SNAPSHOT_REFRESH_BATCH', '50'))
+SNAPSHOT_REFRESH_DELAY = float(os.getenv('SNAPSHOT_REFRESH_DELAY', '1.0'))
+
+# Автосбор боев без /verify (AUTO_INGEST=1 чтобы включить): раз в INGEST_INTERVAL секунд
+# опрашиваются кланы игроков, battlelog запрашивается только у тех, кто играл с прошлого опроса
+AUTO_INGEST = os.getenv('AUTO_INGEST', '0') == '1'
+INGEST_INTERVAL = int(os.getenv('INGEST_INTERVAL', '300'))
+
+# Рейтинг силы Glicko-2 (rating.py): длина рейтингового периода в часах
+# и сколько рейтинговых боев нужно для места в таблице
+RATING_PERIOD_HOURS = int(os.getenv('RATING_PERIOD_HOURS', '24'))
+RATING_MIN_GAMES = int(os.getenv('RATING_MIN_GAMES', '10'))
+
+# Больше стольких боев одной пары игроков за день — бои помечаются как подозрительные
+FARMING_MAX_BATTLES_PER_DAY = int(os.getenv('FARMING_MAX_BATTLES_PER_DAY', '5'))
+
+# Канал или чат для ежедневной сводки (@channel или числовой id), пусто — не отправлять
+STATS_CHANNEL_ID = os.getenv('STATS_CHANNEL_ID', '')
+
 # Режимы игры Clash Royale
 GAME_MODES = {
     'ladder': 'Ladder',
@@ -24,6 +80,15 @@ GAME_MODES = {
     'tournament': 'Tournament'
 }
 
+# Ограничение частоты дорогих команд: (запросов подряд, за сколько секунд восстанавливаются).
+# Ключ — команда или состояние FSM: тег при регистрации проверяется через Clash Royale API
+THROTTLE_RULES = {
+    'verify': (2, 60),
+    'profile': (2, 60),
+    'register': (3, 60),
+    'Registration:waiting_for_tag': (3, 60)
+}
+
 # Награды по местам
 REWARDS = {
     1: {'gems': 1000, 'gold': 50000, 'title': '🥇 Champion'},
@@ -31,3 +96,24 @@ REWARDS = {
     3: {'gems': 250, 'gold': 10000, 'title': '🥉 Third Place'},
     'top10': {'gems': 100, 'gold': 5000, 'title': '⭐ Top 10'}
 }
+
+# Уровни наград по итоговой таблице месяца (см. rewards.py): проверяются по порядку,
+# max_place — места с 1 по N, top_percent — лучшие N% игроков, например
+# {'top_percent': 5, 'gems': 50, 'gold': 2000, 'title': '🎖 Top 5%'}
+REWARD_TIERS = [
+    {'max_place': 1, **REWARDS[1]},
+    {'max_place': 2, **REWARDS[2]},
+    {'max_place': 3, **REWARDS[3]},
+    {'max_place': 10, **REWARDS['top10']}
+]
+
+# Уведомления о наградах: сколько раз пытаться доставить и пауза между сообщениями (лимиты Telegram)
+REWARD_MAX_ATTEMPTS = int(os.getenv('REWARD_MAX_ATTEMPTS', '5'))
+REWARD_SEND_DELAY = float(os.getenv('REWARD_SEND_DELAY', '0.05'))
+
+# Профилирование медленных апдейтов (PROFILE_SLOW_UPDATES=1 чтобы включить)
+PROFILE_SLOW_UPDATES = os.getenv('PROFILE_SLOW_UPDATES', '0') == '1'
+PROFILE_THRESHOLD_MS = int(os.getenv('PROFILE_THRESHOLD_MS', '1000'))
+PROFILE_INTERVAL_MS = int(os.getenv('PROFILE_INTERVAL_MS', '5'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
@@ -1,22 +1,144 @@
+import itertools
+import os
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 import json
+import config
+from ledger import EVENT_GAME, EVENT_OPENING, SCORES_PROJECTION
+from meta import pack_deck
+from ranking import RankingEngine
+from rating import RESULT_SCORES, rating_pair
+from rewards import max_rewarded_place, reward_for_place
+
+def month_bounds(month):
+    """Границы месяца 'YYYY-MM' для сравнения с battle_time: [начало, начало следующего)"""
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        end = datetime(start.year + 1, 1, 1)
+    else:
+        end = datetime(start.year, start.month + 1, 1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+# Ключ режима в daily_stats для итогов по всем режимам
+ALL_MODES = '*'
+
+# Сколько дней хранить daily_active_users (для подсчета уникальных игроков за день)
+DAILY_USERS_KEEP_DAYS = 3
 
 class Database:
-    def __init__(self, db_path):
+    def __init__(self, db_path, archive_path=None, replica_max_age=0, ranking=False):
         self.db_path = db_path
+        self.archive_path = archive_path
+        
+        # Реплика для тяжелого чтения: копия основной БД в памяти, обновляется через backup API.
+        # replica_max_age — допустимая устаревшость в секундах, 0 — реплика выключена
+        self.replica_max_age = replica_max_age
+        self.replica_name = None
+        self.replica_updated = 0
+        self.replica_keepers = []
+        self.replica_ids = itertools.count()
+        self.replica_lock = threading.Lock()
+        
+        # Рейтинг месяца в типизированных массивах (ranking.py), загружается при первом запросе
+        self.ranking = RankingEngine() if ranking else None
+        
         self.init_db()
     
-    def get_connection(self):
+    def get_connection(self, with_archive=False):
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
+        if with_archive:
+            self.attach_archive(conn)
+        return conn
+    
+    def get_read_connection(self, with_archive=False):
+        """
+        Соединение для тяжелого чтения (таблицы лидеров, статистика).
+        Читает из реплики, если она включена и не старше replica_max_age, иначе из основной БД
+        """
+        name = self.replica_name
+        if not name or time.monotonic() - self.replica_updated > self.replica_max_age:
+            return self.get_connection(with_archive)
+        
+        conn = sqlite3.connect(name, uri=True)
+        conn.row_factory = sqlite3.Row
+        if with_archive:
+            self.attach_archive(conn)
         return conn
     
+    def refresh_replica(self):
+        """
+        Скопировать основную БД в новую реплику в памяти и переключить чтение на нее.
+        Читатели старой реплики дочитывают свои запросы, запись в основную БД не блокируется (WAL)
+        """
+        if not self.replica_max_age:
+            return
+        
+        with self.replica_lock:
+            name = f'file:replica_{id(self)}_{next(self.replica_ids)}?mode=memory&cache=shared'
+            # Пока открыто хотя бы одно соединение, БД в памяти существует
+            keeper = sqlite3.connect(name, uri=True, check_same_thread=False)
+            
+            source = self.get_connection()
+            try:
+                source.backup(keeper)
+            finally:
+                source.close()
+            
+            self.replica_name = name
+            self.replica_updated = time.monotonic()
+            self.replica_keepers.append(keeper)
+            
+            # Предыдущую реплику держим еще один цикл: читатель мог только что взять ее имя
+            while len(self.replica_keepers) > 2:
+                self.replica_keepers.pop(0).close()
+    
+    def attach_archive(self, conn):
+        """
+        Подключить архив игр как схему archive и создать temp view all_games
+        (горячая таблица + архив). Без архива all_games смотрит только на main.games
+        """
+        columns = [row[1] for row in conn.execute('PRAGMA main.table_info(games)')]
+        column_list = ', '.join(columns)
+        
+        if not self.archive_path:
+            conn.execute(f'CREATE TEMP VIEW IF NOT EXISTS all_games AS SELECT {column_list} FROM main.games')
+            return
+        
+        conn.execute('ATTACH DATABASE ? AS archive', (self.archive_path,))
+        
+        # Схема архива повторяет main.games, новые колонки докидываем по имени
+        conn.execute('CREATE TABLE IF NOT EXISTS archive.games AS SELECT * FROM main.games WHERE 0')
+        archived = {row[1] for row in conn.execute('PRAGMA archive.table_info(games)')}
+        for row in conn.execute('PRAGMA main.table_info(games)').fetchall():
+            if row[1] not in archived:
+                conn.execute(f'ALTER TABLE archive.games ADD COLUMN {row[1]} {row[2]}')
+        
+        conn.execute('CREATE INDEX IF NOT EXISTS archive.idx_games_user_time ON games(user_id, battle_time)')
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS all_games AS
+            SELECT {column_list} FROM main.games
+            UNION ALL
+            SELECT {column_list} FROM archive.games
+        ''')
+    
+    def ensure_column(self, cursor, table, column, definition):
+        """Добавить колонку в существующую таблицу, если ее еще нет"""
+        columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()}
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
     def init_db(self):
         """Инициализация базы данных"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # С репликой основная БД работает в WAL, чтобы копирование не блокировало запись
+        if self.replica_max_age:
+            cursor.execute('PRAGMA journal_mode = WAL')
+        
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -49,6 +171,15 @@ class Database:
             )
         ''')
         
+        self.ensure_column(cursor, 'games', 'battle_fingerprint', 'TEXT')
+        self.ensure_column(cursor, 'games', 'opponent_tag', 'TEXT')
+        # Колода: отсортированные id карт, 8 × uint32 (см. meta.pack_deck)
+        self.ensure_column(cursor, 'games', 'deck', 'BLOB')
+        
+        # Индексы для выборок по пользователю и по месяцу
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_games_user_time ON games(user_id, battle_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_games_battle_time ON games(battle_time)')
+        
         # Таблица месячных наград
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS monthly_rewards (
@@ -75,8 +206,313 @@ class Database:
             )
         ''')
         
+        # Последний загруженный профиль игрока из Clash Royale API
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS player_snapshots (
+                player_tag TEXT PRIMARY KEY,
+                user_id INTEGER,
+                name TEXT,
+                trophies INTEGER,
+                best_trophies INTEGER,
+                exp_level INTEGER,
+                wins INTEGER,
+                losses INTEGER,
+                arena TEXT,
+                clan_tag TEXT,
+                clan_name TEXT,
+                fetched_at TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_snapshots_fetched ON player_snapshots(fetched_at)')
+        
+        # История трофеев: одна строка на игрока в день
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS trophy_history (
+                player_tag TEXT,
+                day TEXT,
+                trophies INTEGER,
+                PRIMARY KEY (player_tag, day)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Уникальные бои по отпечатку (время + теги участников), не архивируются
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS battles (
+                fingerprint TEXT PRIMARY KEY,
+                battle_time TIMESTAMP,
+                pair_key TEXT,
+                flagged BOOLEAN DEFAULT 0
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_battles_flagged ON battles(battle_time) WHERE flagged = 1')
+        
+        # Кто какой бой засчитал: обе стороны одного боя связаны общим отпечатком
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS battle_claims (
+                fingerprint TEXT,
+                user_id INTEGER,
+                game_id INTEGER,
+                PRIMARY KEY (fingerprint, user_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Сколько боев сыграла одна и та же пара игроков за день
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS opponent_pairs (
+                pair_key TEXT,
+                day TEXT,
+                battles INTEGER DEFAULT 0,
+                PRIMARY KEY (pair_key, day)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Матчи, подобранные серверным поиском соперника
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS matches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user1_id INTEGER,
+                user2_id INTEGER,
+                tag1 TEXT,
+                tag2 TEXT,
+                trophies1 INTEGER,
+                trophies2 INTEGER,
+                status TEXT DEFAULT 'pending',
+                winner_id INTEGER,
+                battle_fingerprint TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_user1 ON matches(user1_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches(user2_id, status)')
+        
+        # Турниры с сеткой на выбывание или по швейцарской системе
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournaments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                format TEXT,
+                status TEXT DEFAULT 'registration',
+                rounds INTEGER DEFAULT 0,
+                current_round INTEGER DEFAULT 0,
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Турнир группового чата: у каждого свой список участников, множитель очков и таблица
+        self.ensure_column(cursor, 'tournaments', 'chat_id', 'INTEGER')
+        self.ensure_column(cursor, 'tournaments', 'multiplier', 'REAL DEFAULT 1')
+        self.ensure_column(cursor, 'tournaments', 'game_mode', 'TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tournaments_chat ON tournaments(chat_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tournaments_status ON tournaments(status, format)')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournament_entrants (
+                tournament_id INTEGER,
+                user_id INTEGER,
+                player_tag TEXT,
+                seed INTEGER,
+                slot INTEGER,
+                score REAL DEFAULT 0,
+                buchholz REAL DEFAULT 0,
+                wins INTEGER DEFAULT 0,
+                losses INTEGER DEFAULT 0,
+                draws INTEGER DEFAULT 0,
+                byes INTEGER DEFAULT 0,
+                eliminated_round INTEGER,
+                PRIMARY KEY (tournament_id, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_entrants_standings
+            ON tournament_entrants(tournament_id, score DESC, buchholz DESC)
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_entrants_user ON tournament_entrants(user_id)')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tournament_pairings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tournament_id INTEGER,
+                round INTEGER,
+                bracket TEXT,
+                user1_id INTEGER,
+                user2_id INTEGER,
+                winner_id INTEGER,
+                status TEXT DEFAULT 'pending',
+                battle_fingerprint TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pairings_round ON tournament_pairings(tournament_id, round, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pairings_user1 ON tournament_pairings(tournament_id, user1_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_pairings_user2 ON tournament_pairings(tournament_id, user2_id)')
+        
+        # Справочник карт: id -> название
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cards (
+                id INTEGER PRIMARY KEY,
+                name TEXT
+            )
+        ''')
+        
+        # Помесячные агрегаты для /meta: игры и победы по картам и по колодам
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS card_stats (
+                month TEXT,
+                card_id INTEGER,
+                games INTEGER DEFAULT 0,
+                wins INTEGER DEFAULT 0,
+                PRIMARY KEY (month, card_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS deck_stats (
+                month TEXT,
+                deck BLOB,
+                games INTEGER DEFAULT 0,
+                wins INTEGER DEFAULT 0,
+                PRIMARY KEY (month, deck)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Дневные агрегаты по режимам (game_mode = '*' — все режимы вместе)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day TEXT,
+                game_mode TEXT,
+                games INTEGER DEFAULT 0,
+                wins INTEGER DEFAULT 0,
+                points INTEGER DEFAULT 0,
+                active_users INTEGER DEFAULT 0,
+                PRIMARY KEY (day, game_mode)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Кто играл в этот день: нужно только для подсчета active_users, старые дни удаляются
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_active_users (
+                day TEXT,
+                game_mode TEXT,
+                user_id INTEGER,
+                PRIMARY KEY (day, game_mode, user_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Состояние автосбора боев: что видели у игрока в прошлый опрос
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingest_state (
+                player_tag TEXT PRIMARY KEY,
+                last_seen TEXT,
+                decks_used INTEGER,
+                last_battle_time TEXT,
+                polled_at TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        
+        # Итоговые таблицы завершенных месяцев, замораживаются при сбросе очков
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS monthly_standings (
+                month TEXT,
+                place INTEGER,
+                user_id INTEGER,
+                username TEXT,
+                first_name TEXT,
+                player_tag TEXT,
+                points INTEGER,
+                PRIMARY KEY (month, place)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_monthly_standings_user ON monthly_standings(user_id, month)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_monthly_rewards_user ON monthly_rewards(user_id, month)')
+        
+        # Выплаты наград: строка на награжденного, статус уведомления pending / sent / failed
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reward_payouts (
+                month TEXT,
+                user_id INTEGER,
+                place INTEGER,
+                points INTEGER,
+                reward_data TEXT,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (month, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reward_payouts_status ON reward_payouts(status, month, place)')
+        
+        # Рейтинг Glicko-2 по тегам игроков (см. rating.py) и бои, ждущие конца рейтингового периода
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS player_ratings (
+                player_tag TEXT PRIMARY KEY,
+                rating REAL,
+                rd REAL,
+                volatility REAL,
+                games INTEGER,
+                period INTEGER
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_ratings_rating ON player_ratings(rating)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rating_queue (
+                fingerprint TEXT PRIMARY KEY,
+                period INTEGER,
+                player_tag TEXT,
+                opponent_tag TEXT,
+                score REAL
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_rating_queue_period ON rating_queue(period)')
+        
+        # Журнал очков (см. ledger.py): источник правды, из него строятся users.*_points и monthly_points
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS score_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                user_id INTEGER,
+                kind TEXT,
+                points INTEGER,
+                month TEXT,
+                game_id INTEGER,
+                reason TEXT,
+                actor_id INTEGER
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_score_events_user ON score_events(user_id, month)')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS monthly_points (
+                month TEXT,
+                user_id INTEGER,
+                points INTEGER,
+                PRIMARY KEY (month, user_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS projection_state (
+                name TEXT PRIMARY KEY,
+                event_id INTEGER
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO projection_state (name, event_id) VALUES (?, 0)', (SCORES_PROJECTION,))
+        
+        backfill_daily = cursor.execute('SELECT 1 FROM daily_stats LIMIT 1').fetchone() is None
+        backfill_standings = cursor.execute('SELECT 1 FROM monthly_standings LIMIT 1').fetchone() is None
+        backfill_ledger = cursor.execute('SELECT 1 FROM score_events LIMIT 1').fetchone() is None
+        
         conn.commit()
         conn.close()
+        
+        # Первый запуск с агрегатами: посчитать их по уже сыгранным играм
+        if backfill_daily:
+            self.rebuild_daily_stats()
+        if backfill_standings:
+            self.backfill_monthly_standings()
+        if backfill_ledger:
+            self.backfill_score_events()
+        
+        # Проекции отстали от журнала (например, после восстановления из копии) — догоняем
+        self.catch_up_scores()
     
     def register_user(self, user_id, username, first_name, player_tag):
         """Регистрация пользователя"""
@@ -89,6 +525,8 @@ class Database:
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, username, first_name, player_tag, datetime.now().strftime('%Y-%m')))
             conn.commit()
+            if self.ranking is not None and self.ranking.month == datetime.now().strftime('%Y-%m'):
+                self.ranking.add_user(user_id)
             return True
         except sqlite3.IntegrityError:
             return False
@@ -114,14 +552,79 @@ class Database:
         return dict(user) if user else None
     
     def add_game(self, user_id, battle_data, points_earned):
-        """Добавить игру"""
+        """
+        Добавить игру
+        Returns: False, если пользователь уже засчитал этот бой
+        """
+        return self.add_games([(user_id, battle_data, points_earned)])[0]
+    
+    def add_games(self, games):
+        """
+        Добавить пачку игр [(user_id, battle_data, points_earned)] одной транзакцией (один fsync).
+        Каждая игра пишется в своей точке сохранения, поэтому повтор одного боя не откатывает остальные
+        Returns: список True/False для каждой игры, как у add_game
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
+        results = []
+        credited = []
+        
+        try:
+            # Без открытой транзакции SAVEPOINT начинает свою, и каждый RELEASE коммитит игру отдельно
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            for user_id, battle_data, points_earned in games:
+                cursor.execute('SAVEPOINT add_game')
+                try:
+                    applied = self.insert_game(cursor, user_id, battle_data, points_earned)
+                except sqlite3.IntegrityError:
+                    cursor.execute('ROLLBACK TO add_game')
+                    results.append(False)
+                else:
+                    results.append(True)
+                    if applied:
+                        credited.append((user_id, points_earned))
+                cursor.execute('RELEASE add_game')
+            
+            self.commit_points(conn, credited)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return results
+    
+    def commit_points(self, conn, credited):
+        """
+        Зафиксировать транзакцию и начислить очки [(user_id, points)] в рейтинге в памяти.
+        Коммит идет под блокировкой рейтинга: перезагрузка рейтинга видит очки
+        либо уже в БД, либо еще нет, но тогда получает их через add_points.
+        credited — только очки, примененные к проекциям (очки, отложенные до
+        catch_up_scores, попадут в рейтинг при его перезагрузке)
+        """
+        if self.ranking is None:
+            conn.commit()
+            return
+        
+        with self.ranking.lock:
+            conn.commit()
+            for user_id, points in credited:
+                self.ranking.add_points(user_id, points)
+    
+    def insert_game(self, cursor, user_id, battle_data, points_earned):
+        """
+        Запись игры и всех агрегатов; IntegrityError, если пользователь уже засчитал этот бой
+        Returns: True, если очки сразу применены к проекциям (см. append_score_event)
+        """
+        fingerprint = battle_data.get('fingerprint')
+        deck = pack_deck(battle_data.get('deck_ids', []))
         
         cursor.execute('''
             INSERT INTO games (user_id, battle_time, game_mode, result, crowns, 
-                             opponent_crowns, trophies_change, verified, points_earned)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                             opponent_crowns, trophies_change, verified, points_earned,
+                             battle_fingerprint, opponent_tag, deck)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             user_id,
             battle_data['battle_time'],
@@ -131,23 +634,381 @@ class Database:
             battle_data['opponent_crowns'],
             battle_data.get('trophies_change', 0),
             True,
-            points_earned
+            points_earned,
+            fingerprint,
+            battle_data.get('opponent_tag'),
+            deck
+        ))
+        game_id = cursor.lastrowid
+        
+        if fingerprint:
+            # Первичный ключ (fingerprint, user_id) — проверка "уже засчитан" без сканирования games
+            cursor.execute(
+                'INSERT INTO battle_claims (fingerprint, user_id, game_id) VALUES (?, ?, ?)',
+                (fingerprint, user_id, game_id)
+            )
+            
+            cursor.execute(
+                'INSERT OR IGNORE INTO battles (fingerprint, battle_time, pair_key) VALUES (?, ?, ?)',
+                (fingerprint, battle_data['battle_time'], battle_data.get('pair_key'))
+            )
+            
+            # Новый бой (а не вторая сторона уже известного) — учитываем пару соперников
+            if cursor.rowcount == 1 and battle_data.get('pair_key'):
+                self.track_opponent_pair(cursor, fingerprint, battle_data)
+                self.track_rating(cursor, fingerprint, battle_data)
+        
+        if deck:
+            self.track_deck(cursor, battle_data, deck)
+        
+        self.track_daily(cursor, user_id, battle_data, points_earned)
+        self.track_tournament_points(cursor, user_id, battle_data, points_earned)
+        
+        # Очки пользователя — через журнал очков
+        _, applied = self.append_score_event(cursor, user_id, EVENT_GAME, points_earned, game_id=game_id)
+        return applied
+    
+    def track_tournament_points(self, cursor, user_id, battle_data, points_earned):
+        """Начислить очки игры во все идущие турниры на очки, где участвует пользователь"""
+        result = battle_data['result']
+        cursor.execute('''
+            UPDATE tournament_entrants
+            SET score = score + ? * (SELECT multiplier FROM tournaments t WHERE t.id = tournament_entrants.tournament_id),
+                wins = wins + ?,
+                losses = losses + ?,
+                draws = draws + ?
+            WHERE user_id = ? AND tournament_id IN (
+                SELECT id FROM tournaments
+                WHERE status = 'running' AND format = 'points' AND (game_mode IS NULL OR game_mode = ?)
+            )
+        ''', (
+            points_earned, result == 'win', result == 'loss', result == 'draw',
+            user_id, battle_data['game_mode']
         ))
+    
+    def track_daily(self, cursor, user_id, battle_data, points_earned):
+        """Обновить дневные агрегаты: по режиму игры и по всем режимам вместе (день — дата боя в UTC)"""
+        day = str(battle_data['battle_time'])[:10]
+        won = 1 if battle_data['result'] == 'win' else 0
+        
+        for game_mode in (ALL_MODES, battle_data['game_mode']):
+            cursor.execute(
+                'INSERT OR IGNORE INTO daily_active_users (day, game_mode, user_id) VALUES (?, ?, ?)',
+                (day, game_mode, user_id)
+            )
+            new_user = cursor.rowcount
+            cursor.execute('''
+                INSERT INTO daily_stats (day, game_mode, games, wins, points, active_users)
+                VALUES (?, ?, 1, ?, ?, ?)
+                ON CONFLICT(day, game_mode) DO UPDATE SET
+                    games = games + 1,
+                    wins = wins + excluded.wins,
+                    points = points + excluded.points,
+                    active_users = active_users + excluded.active_users
+            ''', (day, game_mode, won, points_earned, new_user))
+    
+    def track_deck(self, cursor, battle_data, deck):
+        """Справочник карт и агрегаты card_stats / deck_stats месяца боя"""
+        month = str(battle_data['battle_time'])[:7]
+        won = 1 if battle_data['result'] == 'win' else 0
         
-        # Обновить очки пользователя
+        cursor.executemany(
+            'INSERT OR IGNORE INTO cards (id, name) VALUES (?, ?)',
+            zip(battle_data['deck_ids'], battle_data.get('deck', []))
+        )
+        cursor.executemany('''
+            INSERT INTO card_stats (month, card_id, games, wins) VALUES (?, ?, 1, ?)
+            ON CONFLICT(month, card_id) DO UPDATE SET games = games + 1, wins = wins + excluded.wins
+        ''', [(month, card_id, won) for card_id in battle_data['deck_ids']])
         cursor.execute('''
-            UPDATE users 
-            SET current_month_points = current_month_points + ?,
-                total_points = total_points + ?
+            INSERT INTO deck_stats (month, deck, games, wins) VALUES (?, ?, 1, ?)
+            ON CONFLICT(month, deck) DO UPDATE SET games = games + 1, wins = wins + excluded.wins
+        ''', (month, deck, won))
+    
+    def track_opponent_pair(self, cursor, fingerprint, battle_data):
+        """Счетчик боев пары за день; бой помечается подозрительным при превышении лимита"""
+        day = str(battle_data['battle_time'])[:10]
+        
+        cursor.execute('''
+            INSERT INTO opponent_pairs (pair_key, day, battles) VALUES (?, ?, 1)
+            ON CONFLICT(pair_key, day) DO UPDATE SET battles = battles + 1
+        ''', (battle_data['pair_key'], day))
+        
+        battles = cursor.execute(
+            'SELECT battles FROM opponent_pairs WHERE pair_key = ? AND day = ?',
+            (battle_data['pair_key'], day)
+        ).fetchone()[0]
+        
+        if battles > config.FARMING_MAX_BATTLES_PER_DAY:
+            cursor.execute('UPDATE battles SET flagged = 1 WHERE fingerprint = ?', (fingerprint,))
+    
+    def track_rating(self, cursor, fingerprint, battle_data):
+        """Бой 1 на 1 — в очередь рейтинга, она обрабатывается пачкой в конце периода"""
+        players = rating_pair(battle_data['pair_key'], battle_data.get('opponent_tag'))
+        if not players or battle_data['result'] not in RESULT_SCORES:
+            return
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO rating_queue (fingerprint, period, player_tag, opponent_tag, score)
+            VALUES (?, CAST((julianday(?) - 2440587.5) * 24 / ? AS INTEGER), ?, ?, ?)
+        ''', (
+            fingerprint,
+            battle_data['battle_time'],
+            config.RATING_PERIOD_HOURS,
+            *players,
+            RESULT_SCORES[battle_data['result']]
+        ))
+    
+    def append_score_event(self, cursor, user_id, kind, points, game_id=None, reason=None, actor_id=None):
+        """
+        Записать событие в журнал очков и применить его к проекциям в той же транзакции.
+        Если проекции отстают от журнала, событие применится при catch_up_scores
+        Returns: (id события, применено ли оно к проекциям сразу)
+        """
+        month = datetime.now().strftime('%Y-%m')
+        
+        cursor.execute('''
+            INSERT INTO score_events (user_id, kind, points, month, game_id, reason, actor_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, kind, points, month, game_id, reason, actor_id))
+        event_id = cursor.lastrowid
+        
+        checkpoint = cursor.execute(
+            'SELECT event_id FROM projection_state WHERE name = ?', (SCORES_PROJECTION,)
+        ).fetchone()[0]
+        previous = cursor.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM score_events WHERE id < ?', (event_id,)
+        ).fetchone()[0]
+        
+        if checkpoint != previous:
+            return event_id, False
+        
+        self.apply_scores(cursor, user_id, month, points)
+        cursor.execute(
+            'UPDATE projection_state SET event_id = ? WHERE name = ?', (event_id, SCORES_PROJECTION)
+        )
+        return event_id, True
+    
+    def apply_scores(self, cursor, user_id, month, points):
+        """Применить очки к проекциям: monthly_points и итоги в users"""
+        if month:
+            cursor.execute('''
+                INSERT INTO monthly_points (month, user_id, points) VALUES (?, ?, ?)
+                ON CONFLICT(month, user_id) DO UPDATE SET points = points + excluded.points
+            ''', (month, user_id, points))
+        
+        # Очки другого месяца попадут в current_month_points при сбросе (reset_monthly_points)
+        cursor.execute('''
+            UPDATE users
+            SET total_points = total_points + ?,
+                current_month_points = current_month_points + (CASE WHEN last_reset_month = ? THEN ? ELSE 0 END)
             WHERE user_id = ?
-        ''', (points_earned, points_earned, user_id))
+        ''', (points, month, points, user_id))
+    
+    def add_score_event(self, user_id, kind, points, reason=None, actor_id=None):
+        """
+        Событие журнала вне игр (ручная правка и т.п.)
+        Returns: id события
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
         
-        conn.commit()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            event_id, applied = self.append_score_event(
+                cursor, user_id, kind, points, reason=reason, actor_id=actor_id
+            )
+            self.commit_points(conn, [(user_id, points)] if applied else [])
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return event_id
+    
+    def catch_up_scores(self):
+        """
+        Применить к проекциям события журнала после отметки projection_state
+        Returns: количество примененных событий
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            checkpoint = cursor.execute(
+                'SELECT event_id FROM projection_state WHERE name = ?', (SCORES_PROJECTION,)
+            ).fetchone()[0]
+            last, count = cursor.execute(
+                'SELECT MAX(id), COUNT(*) FROM score_events WHERE id > ?', (checkpoint,)
+            ).fetchone()
+            
+            if not count:
+                conn.rollback()
+                return 0
+            
+            # Сначала сворачиваем события до одной дельты на (игрок, месяц)
+            cursor.execute('''
+                SELECT user_id, month, SUM(points) AS points
+                FROM score_events
+                WHERE id > ? AND id <= ?
+                GROUP BY user_id, month
+            ''', (checkpoint, last))
+            for row in cursor.fetchall():
+                self.apply_scores(cursor, row['user_id'], row['month'], row['points'])
+            
+            cursor.execute('UPDATE projection_state SET event_id = ? WHERE name = ?', (last, SCORES_PROJECTION))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if self.ranking is not None:
+            self.ranking.month = None
+        return count
+    
+    def rebuild_score_projections(self):
+        """
+        Пересобрать проекции очков целиком по журналу (агрегатами SQL, одной транзакцией)
+        Returns: количество событий в журнале
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            last, count = cursor.execute('SELECT COALESCE(MAX(id), 0), COUNT(*) FROM score_events').fetchone()
+            
+            cursor.execute('DELETE FROM monthly_points')
+            cursor.execute('''
+                INSERT INTO monthly_points (month, user_id, points)
+                SELECT month, user_id, SUM(points)
+                FROM score_events
+                WHERE month IS NOT NULL AND id <= ?
+                GROUP BY month, user_id
+            ''', (last,))
+            cursor.execute('''
+                UPDATE users
+                SET total_points = COALESCE((
+                        SELECT SUM(points) FROM score_events e
+                        WHERE e.user_id = users.user_id AND e.id <= ?
+                    ), 0),
+                    current_month_points = COALESCE((
+                        SELECT points FROM monthly_points m
+                        WHERE m.month = users.last_reset_month AND m.user_id = users.user_id
+                    ), 0)
+            ''', (last,))
+            cursor.execute('UPDATE projection_state SET event_id = ? WHERE name = ?', (last, SCORES_PROJECTION))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        if self.ranking is not None:
+            self.ranking.month = None
+        return count
+    
+    def backfill_score_events(self):
+        """
+        Журнал для данных до его появления: событие на каждую игру с очками (горячую и архивную)
+        и начальные остатки, чтобы журнал сходился с текущими очками в users
+        """
+        conn = self.get_connection(with_archive=True)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            if cursor.execute('SELECT 1 FROM score_events LIMIT 1').fetchone():
+                conn.rollback()
+                return
+            
+            cursor.execute('''
+                INSERT INTO score_events (created_at, user_id, kind, points, month, game_id)
+                SELECT created_at, user_id, ?, points_earned, strftime('%Y-%m', created_at), id
+                FROM all_games
+                WHERE points_earned != 0
+                ORDER BY id
+            ''', (EVENT_GAME,))
+            
+            # Остаток текущего месяца игрока, затем остаток итога без привязки к месяцу
+            cursor.execute('''
+                INSERT INTO score_events (user_id, kind, points, month, reason)
+                SELECT u.user_id, ?, u.current_month_points - COALESCE(SUM(e.points), 0), u.last_reset_month, ?
+                FROM users u
+                LEFT JOIN score_events e ON e.user_id = u.user_id AND e.month = u.last_reset_month
+                GROUP BY u.user_id
+                HAVING u.current_month_points != COALESCE(SUM(e.points), 0)
+            ''', (EVENT_OPENING, 'Остаток месяца при переходе на журнал очков'))
+            cursor.execute('''
+                INSERT INTO score_events (user_id, kind, points, month, reason)
+                SELECT u.user_id, ?, u.total_points - COALESCE(SUM(e.points), 0), NULL, ?
+                FROM users u
+                LEFT JOIN score_events e ON e.user_id = u.user_id
+                GROUP BY u.user_id
+                HAVING u.total_points != COALESCE(SUM(e.points), 0)
+            ''', (EVENT_OPENING, 'Остаток итога при переходе на журнал очков'))
+            
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        self.rebuild_score_projections()
+    
+    def get_score_mismatches(self, limit=100):
+        """Игроки, у которых проекции очков не сходятся с журналом"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM (
+                SELECT u.user_id, u.total_points, u.current_month_points,
+                       COALESCE((SELECT SUM(points) FROM score_events e WHERE e.user_id = u.user_id), 0) AS ledger_total,
+                       COALESCE((
+                           SELECT SUM(points) FROM score_events e
+                           WHERE e.user_id = u.user_id AND e.month = u.last_reset_month
+                       ), 0) AS ledger_month
+                FROM users u
+            )
+            WHERE total_points != ledger_total OR current_month_points != ledger_month
+            LIMIT ?
+        ''', (limit,))
+        mismatches = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return mismatches
+    
+    def get_flagged_battles(self, limit=20):
+        """Последние подозрительные бои и кто их засчитал"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT b.fingerprint, b.battle_time, b.pair_key,
+                   GROUP_CONCAT(c.user_id) AS claimed_by
+            FROM battles b
+            LEFT JOIN battle_claims c ON c.fingerprint = b.fingerprint
+            WHERE b.flagged = 1
+            GROUP BY b.fingerprint
+            ORDER BY b.battle_time DESC
+            LIMIT ?
+        ''', (limit,))
+        
+        battles = [dict(row) for row in cursor.fetchall()]
         conn.close()
+        return battles
     
     def get_leaderboard(self, limit=100):
         """Получить таблицу лидеров"""
-        conn = self.get_connection()
+        if self.ranking is not None:
+            return self.get_ranked_users(self.get_ranking().top(limit))
+        
+        conn = self.get_read_connection()
         cursor = conn.cursor()
         
         current_month = datetime.now().strftime('%Y-%m')
@@ -157,7 +1018,7 @@ class Database:
                    current_month_points, total_points
             FROM users
             WHERE last_reset_month = ?
-            ORDER BY current_month_points DESC
+            ORDER BY current_month_points DESC, user_id
             LIMIT ?
         ''', (current_month, limit))
         
@@ -165,35 +1026,1170 @@ class Database:
         conn.close()
         return leaderboard
     
-    def reset_monthly_points(self):
-        """Сброс очков в начале месяца"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+    def get_ranking(self):
+        """Рейтинг в памяти за текущий месяц (перезагружается со сменой месяца)"""
         current_month = datetime.now().strftime('%Y-%m')
         
-        cursor.execute('''
-            UPDATE users 
-            SET current_month_points = 0,
-                last_reset_month = ?
-            WHERE last_reset_month != ?
-        ''', (current_month, current_month))
+        with self.ranking.lock:
+            if self.ranking.month != current_month:
+                conn = self.get_connection()
+                rows = conn.execute('''
+                    SELECT user_id, current_month_points
+                    FROM users
+                    WHERE last_reset_month = ?
+                    ORDER BY current_month_points DESC, user_id
+                ''', (current_month,))
+                self.ranking.load(current_month, rows)
+                conn.close()
         
-        conn.commit()
+        return self.ranking
+    
+    def get_ranked_users(self, ranked):
+        """Профили для [(user_id, points)] из рейтинга в памяти, в том же порядке"""
+        if not ranked:
+            return []
+        
+        conn = self.get_read_connection()
+        users = {}
+        ids = [user_id for user_id, _ in ranked]
+        
+        # Порциями, чтобы не упереться в лимит параметров SQLite
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = conn.execute(f'''
+                SELECT user_id, username, first_name, player_tag, total_points
+                FROM users
+                WHERE user_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            users.update((row['user_id'], dict(row)) for row in rows)
         conn.close()
+        
+        return [
+            {**users[user_id], 'current_month_points': points}
+            for user_id, points in ranked
+            if user_id in users
+        ]
     
-    def get_user_games(self, user_id, limit=10):
-        """Получить последние игры пользователя"""
-        conn = self.get_connection()
+    def get_user_rank(self, user_id):
+        """
+        Место игрока в рейтинге месяца
+        Returns: dict с position, players, points и percentile (доля игроков ниже, %) или None
+        """
+        if self.ranking is not None:
+            return self.get_ranking().rank(user_id)
+        
+        conn = self.get_read_connection()
         cursor = conn.cursor()
+        current_month = datetime.now().strftime('%Y-%m')
+        
+        cursor.execute(
+            'SELECT current_month_points FROM users WHERE user_id = ? AND last_reset_month = ?',
+            (user_id, current_month)
+        )
+        user = cursor.fetchone()
+        if not user:
+            conn.close()
+            return None
         
+        points = user['current_month_points']
         cursor.execute('''
-            SELECT * FROM games
-            WHERE user_id = ?
+            SELECT COUNT(*) AS players,
+                   SUM(current_month_points > ? OR (current_month_points = ? AND user_id < ?)) AS above
+            FROM users
+            WHERE last_reset_month = ?
+        ''', (points, points, user_id, current_month))
+        counts = cursor.fetchone()
+        conn.close()
+        
+        return {
+            'position': counts['above'] + 1,
+            'players': counts['players'],
+            'points': points,
+            'percentile': (counts['players'] - counts['above'] - 1) / counts['players'] * 100
+        }
+    
+    def get_rank_window(self, user_id, radius=2):
+        """Игрок и по radius соседей сверху и снизу: профили с полем position"""
+        if self.ranking is not None:
+            window = self.get_ranking().around(user_id, radius)
+            users = self.get_ranked_users([(other, points) for _, other, points in window])
+            positions = {other: position for position, other, _ in window}
+            return [{**user, 'position': positions[user['user_id']]} for user in users]
+        
+        rank = self.get_user_rank(user_id)
+        if not rank:
+            return []
+        
+        start = max(0, rank['position'] - 1 - radius)
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, username, first_name, player_tag,
+                   current_month_points, total_points
+            FROM users
+            WHERE last_reset_month = ?
+            ORDER BY current_month_points DESC, user_id
+            LIMIT ? OFFSET ?
+        ''', (datetime.now().strftime('%Y-%m'), 2 * radius + 1, start))
+        
+        window = [
+            {**dict(row), 'position': start + offset + 1}
+            for offset, row in enumerate(cursor.fetchall())
+        ]
+        conn.close()
+        return window
+    
+    def reset_monthly_points(self):
+        """Сброс очков в начале месяца"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        current_month = datetime.now().strftime('%Y-%m')
+        
+        # Заморозить итоговую таблицу прошедшего месяца до обнуления очков
+        cursor.execute('''
+            INSERT OR IGNORE INTO monthly_standings
+                (month, place, user_id, username, first_name, player_tag, points)
+            SELECT last_reset_month,
+                   ROW_NUMBER() OVER (PARTITION BY last_reset_month ORDER BY current_month_points DESC, user_id),
+                   user_id, username, first_name, player_tag, current_month_points
+            FROM users
+            WHERE last_reset_month != ? AND current_month_points > 0
+        ''', (current_month,))
+        
+        # Очки нового месяца — из проекции журнала (игры между полуночью и сбросом не теряются)
+        cursor.execute('''
+            UPDATE users 
+            SET current_month_points = COALESCE((
+                    SELECT points FROM monthly_points m
+                    WHERE m.month = ? AND m.user_id = users.user_id
+                ), 0),
+                last_reset_month = ?
+            WHERE last_reset_month != ?
+        ''', (current_month, current_month, current_month))
+        
+        conn.commit()
+        conn.close()
+        
+        # Рейтинг в памяти перечитается при следующем запросе
+        if self.ranking is not None:
+            self.ranking.month = None
+    
+    def backfill_monthly_standings(self):
+        """Итоговые таблицы прошедших месяцев по сыгранным играм (для данных до появления снимков)"""
+        conn = self.get_connection(with_archive=True)
+        cursor = conn.cursor()
+        
+        current_month = datetime.now().strftime('%Y-%m')
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO monthly_standings
+                (month, place, user_id, username, first_name, player_tag, points)
+            SELECT s.month,
+                   ROW_NUMBER() OVER (PARTITION BY s.month ORDER BY s.points DESC, s.user_id),
+                   s.user_id, u.username, u.first_name, u.player_tag, s.points
+            FROM (
+                SELECT substr(battle_time, 1, 7) AS month, user_id, SUM(points_earned) AS points
+                FROM all_games
+                WHERE battle_time < ?
+                GROUP BY month, user_id
+            ) s
+            LEFT JOIN users u ON u.user_id = s.user_id
+        ''', (current_month,))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_standings(self, month, limit=100):
+        """Замороженная итоговая таблица месяца"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM monthly_standings
+            WHERE month = ?
+            ORDER BY place
+            LIMIT ?
+        ''', (month, limit))
+        standings = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return standings
+    
+    def get_user_standings(self, user_id, limit=12):
+        """Места пользователя в прошедших месяцах, от новых к старым"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT month, place, points FROM monthly_standings
+            WHERE user_id = ?
+            ORDER BY month DESC
+            LIMIT ?
+        ''', (user_id, limit))
+        standings = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return standings
+    
+    def get_user_games(self, user_id, limit=10):
+        """Получить последние игры пользователя (с добором из архива)"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM games
+            WHERE user_id = ?
             ORDER BY battle_time DESC
             LIMIT ?
         ''', (user_id, limit))
         
         games = [dict(row) for row in cursor.fetchall()]
+        
+        # Горячая таблица хранит только текущий месяц — старые игры добираем из архива
+        if len(games) < limit and self.archive_path and os.path.exists(self.archive_path):
+            self.attach_archive(conn)
+            cursor.execute('''
+                SELECT * FROM archive.games
+                WHERE user_id = ?
+                ORDER BY battle_time DESC
+                LIMIT ?
+            ''', (user_id, limit - len(games)))
+            games += [dict(row) for row in cursor.fetchall()]
+        
         conn.close()
         return games
+    
+    def archive_games(self):
+        """
+        Перенести игры завершенных месяцев в архивную БД.
+        Returns: количество перенесенных игр
+        """
+        if not self.archive_path:
+            return 0
+        
+        conn = self.get_connection(with_archive=True)
+        cursor = conn.cursor()
+        
+        # battle_time хранится в UTC: граница — начало текущего месяца по UTC
+        cutoff = datetime.utcnow().strftime('%Y-%m-01')
+        columns = ', '.join(row[1] for row in cursor.execute('PRAGMA main.table_info(games)').fetchall())
+        
+        try:
+            # Перенос и удаление в одной транзакции: игра либо в горячей таблице, либо в архиве
+            cursor.execute(f'''
+                INSERT INTO archive.games ({columns})
+                SELECT {columns} FROM main.games WHERE battle_time < ?
+            ''', (cutoff,))
+            moved = cursor.rowcount
+            cursor.execute('DELETE FROM main.games WHERE battle_time < ?', (cutoff,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        
+        return moved
+    
+    def freeze_reward_payouts(self, month, tiers):
+        """
+        Один раз за месяц: награды по замороженной итоговой таблице.
+        В одной транзакции пишутся выданные награды (monthly_rewards) и очередь
+        уведомлений (reward_payouts), поэтому повторный вызов ничего не делает.
+        Returns: количество новых выплат
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Уже заморожен (или награды выданы до появления выплат)
+            if cursor.execute('''
+                SELECT 1 FROM reward_payouts WHERE month = ?
+                UNION ALL
+                SELECT 1 FROM monthly_rewards WHERE month = ?
+                LIMIT 1
+            ''', (month, month)).fetchone():
+                conn.rollback()
+                return 0
+            
+            players = cursor.execute(
+                'SELECT COUNT(*) FROM monthly_standings WHERE month = ?', (month,)
+            ).fetchone()[0]
+            
+            cursor.execute('''
+                SELECT place, user_id, points FROM monthly_standings
+                WHERE month = ?
+                ORDER BY place
+                LIMIT ?
+            ''', (month, max_rewarded_place(tiers, players)))
+            
+            payouts = []
+            for row in cursor.fetchall():
+                reward = reward_for_place(tiers, row['place'], players)
+                if reward:
+                    payouts.append((row['user_id'], month, row['place'], row['points'], json.dumps(reward)))
+            
+            cursor.executemany('''
+                INSERT INTO monthly_rewards (user_id, month, place, points, reward_data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', payouts)
+            cursor.executemany('''
+                INSERT INTO reward_payouts (user_id, month, place, points, reward_data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', payouts)
+            
+            conn.commit()
+            return len(payouts)
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def get_due_payouts(self, max_attempts, limit=100):
+        """Неотправленные уведомления о наградах: сначала новые, затем упавшие, у которых остались попытки"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM reward_payouts
+            WHERE status = 'pending' OR (status = 'failed' AND attempts < ?)
+            ORDER BY status = 'failed', month, place
+            LIMIT ?
+        ''', (max_attempts, limit))
+        payouts = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return payouts
+    
+    def claim_payout(self, month, user_id):
+        """
+        Отметить уведомление отправленным до отправки (не больше одного сообщения,
+        даже если процесс упадет сразу после нее)
+        Returns: False, если выплату уже забрал другой проход
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE reward_payouts
+            SET status = 'sent', attempts = attempts + 1, error = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE month = ? AND user_id = ? AND status != 'sent'
+        ''', (month, user_id))
+        claimed = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        return claimed
+    
+    def fail_payout(self, month, user_id, error):
+        """Уведомление не доставлено — выплата вернется в очередь, пока есть попытки"""
+        conn = self.get_connection()
+        conn.execute('''
+            UPDATE reward_payouts
+            SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE month = ? AND user_id = ?
+        ''', (error, month, user_id))
+        conn.commit()
+        conn.close()
+    
+    def get_payout_summary(self, month):
+        """{status: количество} выплат месяца"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT status, COUNT(*) AS count FROM reward_payouts WHERE month = ? GROUP BY status',
+            (month,)
+        )
+        summary = {row['status']: row['count'] for row in cursor.fetchall()}
+        conn.close()
+        return summary
+    
+    def get_user_rewards(self, user_id, limit=12):
+        """Награды пользователя, от новых к старым"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM monthly_rewards
+            WHERE user_id = ?
+            ORDER BY month DESC
+            LIMIT ?
+        ''', (user_id, limit))
+        rewards = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rewards
+    
+    def stream_rows(self, query, params=(), batch_size=1000, with_archive=False):
+        """Генератор строк запроса: читает курсор пачками, не загружая результат целиком"""
+        conn = self.get_connection(with_archive=with_archive)
+        try:
+            cursor = conn.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+        finally:
+            conn.close()
+    
+    def iter_games(self, month=None):
+        """Все игры (горячие и архивные), опционально за месяц"""
+        if month:
+            start, end = month_bounds(month)
+            return self.stream_rows(
+                'SELECT * FROM all_games WHERE battle_time >= ? AND battle_time < ?',
+                (start, end), with_archive=True
+            )
+        return self.stream_rows('SELECT * FROM all_games', with_archive=True)
+    
+    def iter_users(self):
+        """Все пользователи"""
+        return self.stream_rows('SELECT * FROM users ORDER BY user_id')
+    
+    def iter_monthly_rewards(self, month=None):
+        """Выданные награды, опционально за месяц"""
+        if month:
+            return self.stream_rows('SELECT * FROM monthly_rewards WHERE month = ? ORDER BY place', (month,))
+        return self.stream_rows('SELECT * FROM monthly_rewards ORDER BY month, place')
+    
+    def iter_score_events(self, month=None):
+        """Журнал очков, опционально за месяц"""
+        if month:
+            return self.stream_rows('SELECT * FROM score_events WHERE month = ? ORDER BY id', (month,))
+        return self.stream_rows('SELECT * FROM score_events ORDER BY id')
+    
+    def iter_standings(self, month):
+        """Итоговая таблица месяца, посчитанная по играм"""
+        start, end = month_bounds(month)
+        rows = self.stream_rows('''
+            SELECT g.user_id, u.username, u.first_name, u.player_tag,
+                   COUNT(*) AS games,
+                   SUM(g.result = 'win') AS wins,
+                   SUM(g.points_earned) AS points
+            FROM all_games g
+            LEFT JOIN users u ON u.user_id = g.user_id
+            WHERE g.battle_time >= ? AND g.battle_time < ?
+            GROUP BY g.user_id
+            ORDER BY points DESC, g.user_id
+        ''', (start, end), with_archive=True)
+        
+        for place, row in enumerate(rows, 1):
+            yield {'month': month, 'place': place, **row}
+    
+    def rebuild_daily_stats(self):
+        """Пересчитать дневные агрегаты по всем играм (горячим и архивным)"""
+        conn = self.get_connection(with_archive=True)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('DELETE FROM daily_stats')
+            cursor.execute('DELETE FROM daily_active_users')
+            
+            for mode_expr in (f"'{ALL_MODES}'", 'game_mode'):
+                cursor.execute(f'''
+                    INSERT INTO daily_stats (day, game_mode, games, wins, points, active_users)
+                    SELECT substr(battle_time, 1, 10), {mode_expr},
+                           COUNT(*), SUM(result = 'win'), SUM(points_earned), COUNT(DISTINCT user_id)
+                    FROM all_games
+                    GROUP BY 1, 2
+                ''')
+                cursor.execute(f'''
+                    INSERT INTO daily_active_users (day, game_mode, user_id)
+                    SELECT DISTINCT substr(battle_time, 1, 10), {mode_expr}, user_id
+                    FROM main.games
+                    WHERE battle_time >= ?
+                ''', (self.daily_users_cutoff(),))
+            
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def daily_users_cutoff(self):
+        """С какого дня хранить daily_active_users: бои засчитываются в течение пары дней"""
+        return (datetime.utcnow() - timedelta(days=DAILY_USERS_KEEP_DAYS)).strftime('%Y-%m-%d')
+    
+    def prune_daily_active_users(self):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM daily_active_users WHERE day < ?', (self.daily_users_cutoff(),))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+    
+    def get_daily_stats(self, days=7, game_mode=ALL_MODES):
+        """Агрегаты за последние days дней (по UTC), от старых к новым"""
+        since = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d')
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM daily_stats
+            WHERE game_mode = ? AND day >= ?
+            ORDER BY day
+        ''', (game_mode, since))
+        stats = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return stats
+    
+    def get_day_modes(self, day):
+        """Агрегаты дня по режимам игры"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM daily_stats
+            WHERE day = ? AND game_mode != ?
+            ORDER BY games DESC
+        ''', (day, ALL_MODES))
+        stats = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return stats
+    
+    def iter_decks(self, month):
+        """Колоды и результаты всех игр месяца (горячих и архивных)"""
+        start, end = month_bounds(month)
+        return self.stream_rows(
+            'SELECT deck, result FROM all_games WHERE battle_time >= ? AND battle_time < ? AND deck IS NOT NULL',
+            (start, end), batch_size=10000, with_archive=True
+        )
+    
+    def get_deck_months(self):
+        """Месяцы, за которые есть игры с колодами"""
+        conn = self.get_connection(with_archive=True)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT substr(battle_time, 1, 7) AS month FROM all_games
+            WHERE deck IS NOT NULL ORDER BY month
+        ''')
+        months = [row['month'] for row in cursor.fetchall()]
+        conn.close()
+        return months
+    
+    def replace_meta_stats(self, month, cards, decks):
+        """Заменить агрегаты месяца пересчитанными: {card_id: [games, wins]}, {deck: [games, wins]}"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM card_stats WHERE month = ?', (month,))
+        cursor.execute('DELETE FROM deck_stats WHERE month = ?', (month,))
+        cursor.executemany(
+            'INSERT INTO card_stats (month, card_id, games, wins) VALUES (?, ?, ?, ?)',
+            [(month, card_id, games, wins) for card_id, (games, wins) in cards.items()]
+        )
+        cursor.executemany(
+            'INSERT INTO deck_stats (month, deck, games, wins) VALUES (?, ?, ?, ?)',
+            [(month, deck, games, wins) for deck, (games, wins) in decks.items()]
+        )
+        conn.commit()
+        conn.close()
+    
+    def get_card_names(self):
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, name FROM cards')
+        names = {row['id']: row['name'] for row in cursor.fetchall()}
+        conn.close()
+        return names
+    
+    def count_deck_games(self, month):
+        """Сколько игр с известной колодой сыграно за месяц"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COALESCE(SUM(games), 0) FROM deck_stats WHERE month = ?', (month,))
+        total = cursor.fetchone()[0]
+        conn.close()
+        return total
+    
+    def get_card_stats(self, month, limit=10):
+        """Самые популярные карты месяца"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT card_id, games, wins FROM card_stats
+            WHERE month = ?
+            ORDER BY games DESC
+            LIMIT ?
+        ''', (month, limit))
+        stats = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return stats
+    
+    def get_deck_stats(self, month, limit=5, min_games=5):
+        """Колоды месяца с лучшим винрейтом среди сыгранных хотя бы min_games раз"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT deck, games, wins FROM deck_stats
+            WHERE month = ? AND games >= ?
+            ORDER BY CAST(wins AS REAL) / games DESC, games DESC
+            LIMIT ?
+        ''', (month, min_games, limit))
+        stats = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return stats
+    
+    def save_player_snapshot(self, player_tag, user_id, player_data):
+        """Сохранить профиль игрока и трофеи за сегодня"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        now = datetime.now()
+        clan = player_data.get('clan') or {}
+        
+        cursor.execute('''
+            INSERT INTO player_snapshots (player_tag, user_id, name, trophies, best_trophies, exp_level,
+                                          wins, losses, arena, clan_tag, clan_name, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(player_tag) DO UPDATE SET
+                user_id = excluded.user_id,
+                name = excluded.name,
+                trophies = excluded.trophies,
+                best_trophies = excluded.best_trophies,
+                exp_level = excluded.exp_level,
+                wins = excluded.wins,
+                losses = excluded.losses,
+                arena = excluded.arena,
+                clan_tag = excluded.clan_tag,
+                clan_name = excluded.clan_name,
+                fetched_at = excluded.fetched_at
+        ''', (
+            player_tag,
+            user_id,
+            player_data.get('name'),
+            player_data.get('trophies', 0),
+            player_data.get('bestTrophies', 0),
+            player_data.get('expLevel', 0),
+            player_data.get('wins', 0),
+            player_data.get('losses', 0),
+            (player_data.get('arena') or {}).get('name'),
+            clan.get('tag'),
+            clan.get('name'),
+            now.strftime('%Y-%m-%d %H:%M:%S')
+        ))
+        
+        cursor.execute('''
+            INSERT INTO trophy_history (player_tag, day, trophies)
+            VALUES (?, ?, ?)
+            ON CONFLICT(player_tag, day) DO UPDATE SET trophies = excluded.trophies
+        ''', (player_tag, now.strftime('%Y-%m-%d'), player_data.get('trophies', 0)))
+        
+        conn.commit()
+        conn.close()
+    
+    def get_player_snapshot(self, player_tag):
+        """Последний сохраненный профиль игрока"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM player_snapshots WHERE player_tag = ?', (player_tag,))
+        snapshot = cursor.fetchone()
+        conn.close()
+        return dict(snapshot) if snapshot else None
+    
+    def get_stale_snapshots(self, max_age_minutes, limit=50):
+        """Зарегистрированные игроки без профиля или с устаревшим профилем, самые старые первыми"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        threshold = (datetime.now() - timedelta(minutes=max_age_minutes)).strftime('%Y-%m-%d %H:%M:%S')
+        
+        cursor.execute('''
+            SELECT u.user_id, u.player_tag
+            FROM users u
+            LEFT JOIN player_snapshots s ON s.player_tag = u.player_tag
+            WHERE u.player_tag NOT LIKE '#TEST%'
+              AND (s.fetched_at IS NULL OR s.fetched_at < ?)
+            ORDER BY s.fetched_at IS NOT NULL, s.fetched_at
+            LIMIT ?
+        ''', (threshold, limit))
+        
+        players = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return players
+    
+    def get_rating_queue(self, period):
+        """Бои из очереди рейтинга за периоды до period, по порядку периодов (с отметкой фарма)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT q.*, COALESCE(b.flagged, 0) AS flagged
+            FROM rating_queue q
+            LEFT JOIN battles b ON b.fingerprint = q.fingerprint
+            WHERE q.period < ?
+            ORDER BY q.period
+        ''', (period,))
+        queue = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return queue
+    
+    def get_ratings(self, tags):
+        """Текущие рейтинги по тегам (кого нет — еще не играл рейтинговых боев)"""
+        conn = self.get_connection()
+        tags = list(tags)
+        ratings = []
+        
+        # Порциями, чтобы не упереться в лимит параметров SQLite
+        for start in range(0, len(tags), 500):
+            chunk = tags[start:start + 500]
+            rows = conn.execute(
+                f"SELECT * FROM player_ratings WHERE player_tag IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            ratings += [dict(row) for row in rows]
+        conn.close()
+        return ratings
+    
+    def save_ratings(self, ratings, fingerprints):
+        """Записать обновленные рейтинги и снять обработанные бои с очереди одной транзакцией"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO player_ratings (player_tag, rating, rd, volatility, games, period)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ratings)
+            cursor.executemany('DELETE FROM rating_queue WHERE fingerprint = ?', ((f,) for f in fingerprints))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def iter_rating_results(self, period_hours, period):
+        """
+        Все бои 1 на 1 до начала периода period по порядку (горячие и архивные игры), без фарма
+        Yields: (period, player_tag, opponent_tag, score)
+        """
+        cutoff = datetime.utcfromtimestamp(period * period_hours * 3600).strftime('%Y-%m-%d %H:%M:%S')
+        
+        # Результат берем у одной стороны боя: у засчитавшего его игрока с меньшим user_id
+        rows = self.stream_rows('''
+            SELECT CAST((julianday(b.battle_time) - 2440587.5) * 24 / ? AS INTEGER) AS period,
+                   b.pair_key, g.opponent_tag, g.result
+            FROM battles b
+            JOIN battle_claims c ON c.fingerprint = b.fingerprint
+            JOIN all_games g ON g.id = c.game_id
+            WHERE b.flagged = 0 AND b.battle_time < ?
+              AND c.user_id = (SELECT MIN(user_id) FROM battle_claims WHERE fingerprint = b.fingerprint)
+            ORDER BY b.battle_time
+        ''', (period_hours, cutoff), with_archive=True)
+        
+        for row in rows:
+            players = rating_pair(row['pair_key'], row['opponent_tag'])
+            if players and row['result'] in RESULT_SCORES:
+                yield row['period'], *players, RESULT_SCORES[row['result']]
+    
+    def replace_ratings(self, ratings, period):
+        """Заменить все рейтинги пересчитанными; бои периодов до period уже учтены в них"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('DELETE FROM player_ratings')
+            cursor.executemany('''
+                INSERT INTO player_ratings (player_tag, rating, rd, volatility, games, period)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', ratings)
+            cursor.execute('DELETE FROM rating_queue WHERE period < ?', (period,))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    
+    def get_rating_leaderboard(self, limit=10, min_games=10):
+        """Зарегистрированные игроки по рейтингу (не меньше min_games рейтинговых боев)"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.user_id, u.username, u.first_name, u.player_tag, r.rating, r.rd, r.games
+            FROM player_ratings r
+            JOIN users u ON u.player_tag = r.player_tag
+            WHERE r.games >= ?
+            ORDER BY r.rating DESC
+            LIMIT ?
+        ''', (min_games, limit))
+        leaderboard = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return leaderboard
+    
+    def get_player_rating(self, player_tag, min_games=10):
+        """Рейтинг игрока и его место среди зарегистрированных (place = None, пока мало боев)"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM player_ratings WHERE player_tag = ?', (player_tag,))
+        rating = cursor.fetchone()
+        if not rating:
+            conn.close()
+            return None
+        
+        rating = dict(rating)
+        rating['place'] = None
+        if rating['games'] >= min_games:
+            cursor.execute('''
+                SELECT COUNT(*) FROM player_ratings r
+                JOIN users u ON u.player_tag = r.player_tag
+                WHERE r.games >= ? AND r.rating > ?
+            ''', (min_games, rating['rating']))
+            rating['place'] = cursor.fetchone()[0] + 1
+        conn.close()
+        return rating
+    
+    def get_ingest_targets(self):
+        """Зарегистрированные игроки с кланом из профиля и состоянием автосбора"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT u.user_id, u.player_tag, s.clan_tag,
+                   i.last_seen, i.decks_used, i.last_battle_time
+            FROM users u
+            LEFT JOIN player_snapshots s ON s.player_tag = u.player_tag
+            LEFT JOIN ingest_state i ON i.player_tag = u.player_tag
+            WHERE u.player_tag NOT LIKE '#TEST%'
+        ''')
+        targets = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return targets
+    
+    def save_ingest_state(self, states):
+        """Сохранить состояние автосбора: [{player_tag, last_seen, decks_used, last_battle_time}]"""
+        conn = self.get_connection()
+        conn.executemany('''
+            INSERT INTO ingest_state (player_tag, last_seen, decks_used, last_battle_time, polled_at)
+            VALUES (:player_tag, :last_seen, :decks_used, :last_battle_time, CURRENT_TIMESTAMP)
+            ON CONFLICT(player_tag) DO UPDATE SET
+                last_seen = excluded.last_seen,
+                decks_used = excluded.decks_used,
+                last_battle_time = excluded.last_battle_time,
+                polled_at = excluded.polled_at
+        ''', states)
+        conn.commit()
+        conn.close()
+    
+    def get_trophy_history(self, player_tag, days=30):
+        """Трофеи по дням за последние days дней"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        
+        cursor.execute('''
+            SELECT day, trophies FROM trophy_history
+            WHERE player_tag = ? AND day >= ?
+            ORDER BY day
+        ''', (player_tag, since))
+        
+        history = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return history
+    
+    def create_match(self, first, second):
+        """Записать подобранный матч, Returns: id матча"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO matches (user1_id, user2_id, tag1, tag2, trophies1, trophies2)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (first.user_id, second.user_id, first.player_tag, second.player_tag, first.trophies, second.trophies))
+        
+        match_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return match_id
+    
+    def get_active_match(self, user_id):
+        """Последний неподтвержденный матч пользователя"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT * FROM matches WHERE user1_id = ? AND status = 'pending'
+            UNION ALL
+            SELECT * FROM matches WHERE user2_id = ? AND status = 'pending'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (user_id, user_id))
+        
+        match = cursor.fetchone()
+        conn.close()
+        return dict(match) if match else None
+    
+    def finish_match(self, match_id, status, winner_id=None, fingerprint=None):
+        """
+        Закрыть матч: verified или expired.
+        Returns: False, если матч уже закрыт (например, параллельным /matchverify соперника)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE matches SET status = ?, winner_id = ?, battle_fingerprint = ?
+            WHERE id = ? AND status = 'pending'
+        ''', (status, winner_id, fingerprint, match_id))
+        closed = cursor.rowcount == 1
+        
+        conn.commit()
+        conn.close()
+        return closed
+    
+    # === Турниры ===
+    
+    def create_tournament(self, name, fmt, created_by, chat_id=None, multiplier=1, game_mode=None):
+        """Создать турнир, Returns: id"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO tournaments (name, format, created_by, chat_id, multiplier, game_mode)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, fmt, created_by, chat_id, multiplier, game_mode))
+        tournament_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return tournament_id
+    
+    def get_tournament(self, tournament_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM tournaments WHERE id = ?', (tournament_id,))
+        tournament = cursor.fetchone()
+        conn.close()
+        return dict(tournament) if tournament else None
+    
+    def get_chat_tournament(self, chat_id):
+        """Последний незавершенный турнир группового чата"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM tournaments
+            WHERE chat_id = ? AND status != 'finished'
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (chat_id,))
+        tournament = cursor.fetchone()
+        conn.close()
+        return dict(tournament) if tournament else None
+    
+    def update_tournament(self, tournament_id, **fields):
+        """Обновить поля турнира (status, rounds, current_round)"""
+        conn = self.get_connection()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        conn.execute(f'UPDATE tournaments SET {assignments} WHERE id = ?', (*fields.values(), tournament_id))
+        conn.commit()
+        conn.close()
+    
+    def add_entrant(self, tournament_id, user_id, player_tag):
+        """Записать участника, Returns: False если уже записан"""
+        conn = self.get_connection()
+        try:
+            conn.execute(
+                'INSERT INTO tournament_entrants (tournament_id, user_id, player_tag) VALUES (?, ?, ?)',
+                (tournament_id, user_id, player_tag)
+            )
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        finally:
+            conn.close()
+    
+    def get_entrants(self, tournament_id):
+        """Все участники турнира"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM tournament_entrants WHERE tournament_id = ?', (tournament_id,))
+        entrants = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return entrants
+    
+    def get_entrant(self, tournament_id, user_id):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT * FROM tournament_entrants WHERE tournament_id = ? AND user_id = ?',
+            (tournament_id, user_id)
+        )
+        entrant = cursor.fetchone()
+        conn.close()
+        return dict(entrant) if entrant else None
+    
+    def set_seeds(self, tournament_id, seeds):
+        """Посев: seeds — список (user_id, seed, slot)"""
+        conn = self.get_connection()
+        conn.executemany(
+            'UPDATE tournament_entrants SET seed = ?, slot = ? WHERE tournament_id = ? AND user_id = ?',
+            [(seed, slot, tournament_id, user_id) for user_id, seed, slot in seeds]
+        )
+        conn.commit()
+        conn.close()
+    
+    def get_played_pairs(self, tournament_id):
+        """Уже сыгранные пары (для швейцарки без повторных встреч)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT user1_id, user2_id FROM tournament_pairings WHERE tournament_id = ? AND user2_id IS NOT NULL',
+            (tournament_id,)
+        )
+        pairs = {frozenset(row) for row in cursor.fetchall()}
+        conn.close()
+        return pairs
+    
+    def count_pending_pairings(self, tournament_id, round_number):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM tournament_pairings WHERE tournament_id = ? AND round = ? AND status = 'pending'",
+            (tournament_id, round_number)
+        )
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def save_round(self, tournament_id, round_number, pairings, bye_points):
+        """
+        Записать пары раунда одной транзакцией.
+        pairings — список (bracket, user1_id, user2_id или None для bye).
+        Бухгольц обновляется инкрементально: новые соперники добавляют друг другу свои очки
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        scores = dict(cursor.execute(
+            'SELECT user_id, score FROM tournament_entrants WHERE tournament_id = ?', (tournament_id,)
+        ).fetchall())
+        
+        cursor.executemany('''
+            INSERT INTO tournament_pairings (tournament_id, round, bracket, user1_id, user2_id, winner_id, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (tournament_id, round_number, bracket, user1, user2,
+             user1 if user2 is None else None, 'done' if user2 is None else 'pending')
+            for bracket, user1, user2 in pairings
+        ])
+        
+        buchholz = []
+        byes = []
+        for bracket, user1, user2 in pairings:
+            if user2 is None:
+                byes.append((bye_points, tournament_id, user1))
+            else:
+                buchholz.append((scores[user2], tournament_id, user1))
+                buchholz.append((scores[user1], tournament_id, user2))
+        
+        cursor.executemany(
+            'UPDATE tournament_entrants SET buchholz = buchholz + ? WHERE tournament_id = ? AND user_id = ?',
+            buchholz
+        )
+        
+        for points, tid, user_id in byes:
+            self.add_entrant_score(cursor, tid, user_id, points)
+        cursor.executemany(
+            'UPDATE tournament_entrants SET byes = byes + 1 WHERE tournament_id = ? AND user_id = ?',
+            [(tid, user_id) for _, tid, user_id in byes]
+        )
+        
+        cursor.execute('UPDATE tournaments SET current_round = ? WHERE id = ?', (round_number, tournament_id))
+        
+        conn.commit()
+        conn.close()
+    
+    def add_entrant_score(self, cursor, tournament_id, user_id, points):
+        """Начислить очки участнику и добавить их в Бухгольц всех его соперников"""
+        if not points:
+            return
+        
+        cursor.execute(
+            'UPDATE tournament_entrants SET score = score + ? WHERE tournament_id = ? AND user_id = ?',
+            (points, tournament_id, user_id)
+        )
+        cursor.execute('''
+            UPDATE tournament_entrants SET buchholz = buchholz + ?
+            WHERE tournament_id = ? AND user_id IN (
+                SELECT user2_id FROM tournament_pairings WHERE tournament_id = ? AND user1_id = ? AND user2_id IS NOT NULL
+                UNION ALL
+                SELECT user1_id FROM tournament_pairings WHERE tournament_id = ? AND user2_id = ?
+            )
+        ''', (points, tournament_id, tournament_id, user_id, tournament_id, user_id))
+    
+    def get_round_pairings(self, tournament_id, round_number):
+        """Все пары раунда"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT * FROM tournament_pairings WHERE tournament_id = ? AND round = ? ORDER BY id',
+            (tournament_id, round_number)
+        )
+        pairings = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return pairings
+    
+    def get_pending_pairing(self, tournament_id, user_id):
+        """Несыгранная пара пользователя в текущем раунде"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM tournament_pairings WHERE tournament_id = ? AND user1_id = ? AND status = 'pending'
+            UNION ALL
+            SELECT * FROM tournament_pairings WHERE tournament_id = ? AND user2_id = ? AND status = 'pending'
+        ''', (tournament_id, user_id, tournament_id, user_id))
+        pairing = cursor.fetchone()
+        conn.close()
+        return dict(pairing) if pairing else None
+    
+    def record_pairing_result(self, tournament_id, pairing, winner_id, fingerprint, win_points, draw_points, max_losses):
+        """Записать результат пары: очки, победы/поражения, выбывание, Бухгольц"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE tournament_pairings SET winner_id = ?, status = 'done', battle_fingerprint = ?
+            WHERE id = ? AND status = 'pending'
+        ''', (winner_id, fingerprint, pairing['id']))
+        
+        # Пару уже закрыл соперник
+        if cursor.rowcount == 0:
+            conn.close()
+            return False
+        
+        players = (pairing['user1_id'], pairing['user2_id'])
+        
+        if winner_id is None:
+            for user_id in players:
+                cursor.execute(
+                    'UPDATE tournament_entrants SET draws = draws + 1 WHERE tournament_id = ? AND user_id = ?',
+                    (tournament_id, user_id)
+                )
+                self.add_entrant_score(cursor, tournament_id, user_id, draw_points)
+        else:
+            loser_id = players[1] if winner_id == players[0] else players[0]
+            cursor.execute(
+                'UPDATE tournament_entrants SET wins = wins + 1 WHERE tournament_id = ? AND user_id = ?',
+                (tournament_id, winner_id)
+            )
+            cursor.execute('''
+                UPDATE tournament_entrants
+                SET losses = losses + 1,
+                    eliminated_round = CASE WHEN ? > 0 AND losses + 1 >= ? THEN ? ELSE eliminated_round END
+                WHERE tournament_id = ? AND user_id = ?
+            ''', (max_losses, max_losses, pairing['round'], tournament_id, loser_id))
+            self.add_entrant_score(cursor, tournament_id, winner_id, win_points)
+        
+        conn.commit()
+        conn.close()
+        return True
+    
+    def get_tournament_standings(self, tournament_id, limit=20):
+        """Таблица турнира по очкам и Бухгольцу"""
+        conn = self.get_read_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT e.*, u.first_name, u.username
+            FROM tournament_entrants e
+            LEFT JOIN users u ON u.user_id = e.user_id
+            WHERE e.tournament_id = ?
+            ORDER BY e.score DESC, e.buchholz DESC, e.seed
+            LIMIT ?
+        ''', (tournament_id, limit))
+        standings = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return standings
@@ -0,0 +1,136 @@
+"""
+Потоковая выгрузка данных турнира в CSV, JSON Lines или Parquet.
+
+Строки читаются из SQLite пачками и сразу пишутся в файл, поэтому
+расход памяти не зависит от размера таблицы.
+
+Запуск:
+    python export.py games --format csv --output games.csv
+    python export.py standings --month 2026-09 --format jsonl
+"""
+import argparse
+import csv
+import json
+import sys
+
+import config
+from database import Database
+from meta import unpack_deck
+
+DATASETS = ('games', 'users', 'monthly_rewards', 'standings', 'score_events')
+FORMATS = ('csv', 'jsonl', 'parquet')
+
+def iter_dataset(db, dataset, month=None):
+    """Генератор строк выбранного набора данных"""
+    if dataset == 'games':
+        return (decode_game(row) for row in db.iter_games(month))
+    if dataset == 'users':
+        return db.iter_users()
+    if dataset == 'monthly_rewards':
+        return db.iter_monthly_rewards(month)
+    if dataset == 'score_events':
+        return db.iter_score_events(month)
+    if dataset == 'standings':
+        if not month:
+            raise ValueError('Для standings нужен месяц в формате YYYY-MM')
+        return db.iter_standings(month)
+    raise ValueError(f'Неизвестный набор данных: {dataset}')
+
+def decode_game(row):
+    """Колода игры из упакованных 32 байт — в список id карт"""
+    if row.get('deck') is not None:
+        row['deck'] = unpack_deck(row['deck'])
+    return row
+
+def write_csv(rows, f):
+    writer = None
+    count = 0
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            writer.writeheader()
+        # Списки (колода) — id через пробел
+        writer.writerow({
+            key: ' '.join(map(str, value)) if isinstance(value, list) else value
+            for key, value in row.items()
+        })
+        count += 1
+    return count
+
+def write_jsonl(rows, f):
+    count = 0
+    for row in rows:
+        f.write(json.dumps(row, ensure_ascii=False, default=str))
+        f.write('\n')
+        count += 1
+    return count
+
+def write_parquet(rows, path, batch_size=10000):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError('Для Parquet установи pyarrow: pip install pyarrow')
+    
+    writer = None
+    batch = []
+    count = 0
+    
+    def flush():
+        nonlocal writer
+        if writer is None:
+            table = pa.Table.from_pylist(batch)
+            writer = pq.ParquetWriter(path, table.schema)
+        else:
+            table = pa.Table.from_pylist(batch, schema=writer.schema)
+        writer.write_table(table)
+        batch.clear()
+    
+    try:
+        for row in rows:
+            batch.append(row)
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    return count
+
+def export(db, dataset, fmt, output, month=None):
+    """
+    Выгрузить набор данных в файл (или stdout, если output == '-').
+    Returns: количество выгруженных строк
+    """
+    rows = iter_dataset(db, dataset, month)
+    
+    if fmt == 'parquet':
+        if output == '-':
+            raise ValueError('Parquet нельзя писать в stdout')
+        return write_parquet(rows, output)
+    
+    writer = write_csv if fmt == 'csv' else write_jsonl
+    
+    if output == '-':
+        return writer(rows, sys.stdout)
+    
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        return writer(rows, f)
+
+def main():
+    parser = argparse.ArgumentParser(description='Выгрузка данных турнира')
+    parser.add_argument('dataset', choices=DATASETS)
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--output', default='-', help='Путь к файлу, по умолчанию stdout')
+    parser.add_argument('--month', help='Месяц в формате YYYY-MM')
+    args = parser.parse_args()
+    
+    db = Database(config.DATABASE_PATH, config.ARCHIVE_DATABASE_PATH)
+    count = export(db, args.dataset, args.format, args.output, args.month)
+    print(f"✅ Выгружено строк: {count}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
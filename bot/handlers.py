@@ -1,14 +1,29 @@
+import asyncio
+import logging
+import os
+import tempfile
 from aiogram import Router, F
-from aiogram.types import CallbackQuery, Message
-from aiogram.filters import Command
-from datetime import datetime
+from aiogram.types import CallbackQuery, Message, FSInputFile
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
 @router.callback_query(F.data == "my_rank")
 async def show_rank(callback: CallbackQuery):
     """Показать позицию в рейтинге"""
-    from bot import db  # Импортируем из основного файла
+    from services import db
     
     user = db.get_user(callback.from_user.id)
     
@@ -16,18 +31,13 @@ async def show_rank(callback: CallbackQuery):
         await callback.answer("Зарегистрируйся сначала!", show_alert=True)
         return
     
-    leaderboard = db.get_leaderboard(limit=1000)
-    
-    user_position = None
-    for idx, player in enumerate(leaderboard, 1):
-        if player['user_id'] == callback.from_user.id:
-            user_position = idx
-            break
+    rank = db.get_user_rank(callback.from_user.id)
     
-    if user_position:
+    if rank:
         await callback.answer(
-            f"🏆 Твоя позиция: {user_position} место\n"
-            f"⭐ Очки: {user['current_month_points']}",
+            f"🏆 Твоя позиция: {rank['position']} место из {rank['players']}\n"
+            f"⭐ Очки: {rank['points']}\n"
+            f"📈 Ты выше {rank['percentile']:.0f}% игроков",
             show_alert=True
         )
     else:
@@ -59,7 +69,15 @@ async def cmd_help(message: Message):
 /stats - Твоя статистика
 /leaderboard - Топ игроков
 /profile - Подробный профиль
-/top - Топ-25 игроков
+/top - Топ-25 игроков (/top YYYY-MM — итоги месяца)
+/find - Найти соперника
+/matchverify - Проверить бой с соперником
+/tjoin - Записаться на турнир
+/tresult - Результат боя в турнире
+/tstandings - Таблица турнира
+/tfinish - Завершить турнир на очки (админы)
+/meta - Популярные карты и колоды
+/rating - Рейтинг силы (Glicko-2)
 /rules - Правила турнира
 /help - Эта справка
 
@@ -87,40 +105,43 @@ async def cmd_help(message: Message):
 """
     await message.answer(help_text, parse_mode="HTML")
 
-@router.message(Command("profile"))
-async def cmd_profile(message: Message):
-    """Подробный профиль игрока"""
-    from bot import db, cr_api  # Импортируем из основного файла
-    
-    user = db.get_user(message.from_user.id)
-    
-    if not user:
-        await message.answer("❌ Сначала зарегистрируйся: /register")
-        return
-    
-    msg = await message.answer("⏳ Загружаю профиль...")
+def format_trophy_trend(trophies, history):
+    """Динамика трофеев: изменение за 7 и 30 дней и мини-график"""
+    if len(history) < 2:
+        return "📈 Динамика: пока мало данных"
     
-    # Получаем данные из Clash Royale API
-    player_data = cr_api.get_player(user['player_tag'])
+    week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+    week_base = next((h['trophies'] for h in history if h['day'] >= week_ago), trophies)
+    month_base = history[0]['trophies']
     
-    if not player_data:
-        await msg.edit_text("❌ Не удалось загрузить профиль из Clash Royale")
-        return
+    # Мини-график за последние 14 дней
+    values = [h['trophies'] for h in history[-14:]]
+    low, high = min(values), max(values)
+    bars = '▁▂▃▄▅▆▇█'
+    spark = ''.join(bars[(v - low) * (len(bars) - 1) // (high - low)] if high > low else bars[0] for v in values)
     
-    games = db.get_user_games(message.from_user.id, limit=100)
+    return (
+        f"📈 За 7 дней: {trophies - week_base:+d}\n"
+        f"📈 За 30 дней: {trophies - month_base:+d}\n"
+        f"{spark}"
+    )
+
+def format_profile(user, snapshot, games, history):
+    """Текст профиля из сохраненного снимка"""
     wins = sum(1 for g in games if g['result'] == 'win')
     losses = sum(1 for g in games if g['result'] == 'loss')
     draws = sum(1 for g in games if g['result'] == 'draw')
     
-    profile_text = f"""
+    return f"""
 👤 <b>Профиль игрока</b>
 
 🎮 <b>Clash Royale:</b>
-Имя: {player_data.get('name', 'Unknown')}
+Имя: {snapshot['name'] or 'Unknown'}
 Тег: <code>{user['player_tag']}</code>
-🏆 Трофеи: {player_data.get('trophies', 0)}
-🏅 Лучший результат: {player_data.get('bestTrophies', 0)}
-🎖 Уровень: {player_data.get('expLevel', 0)}
+🏆 Трофеи: {snapshot['trophies']}
+🏅 Лучший результат: {snapshot['best_trophies']}
+🎖 Уровень: {snapshot['exp_level']}
+{format_trophy_trend(snapshot['trophies'], history)}
 
 📊 <b>Статистика в турнире:</b>
 Всего игр: {len(games)}
@@ -134,22 +155,102 @@ async def cmd_profile(message: Message):
 🏅 Всего: {user['total_points']}
 
 📅 Зарегистрирован: {user['registered_at'][:10] if user.get('registered_at') else 'Неизвестно'}
+🕒 Профиль обновлен: {snapshot['fetched_at'][:16]}
 """
+
+async def refresh_profile(msg, user, games):
+    """Фоновое обновление профиля из API с перерисовкой сообщения"""
+    from services import db, cr_api
+    
+    player_tag = user['player_tag']
+    player_data = await asyncio.to_thread(cr_api.get_player, player_tag)
+    
+    if not player_data:
+        return
     
-    await msg.edit_text(profile_text, parse_mode="HTML")
+    db.save_player_snapshot(player_tag, user['user_id'], player_data)
+    snapshot = db.get_player_snapshot(player_tag)
+    history = db.get_trophy_history(player_tag)
+    
+    try:
+        await msg.edit_text(format_profile(user, snapshot, games, history), parse_mode="HTML")
+    except TelegramBadRequest:
+        # Профиль не изменился или сообщение удалено
+        pass
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    """Подробный профиль игрока (/profile refresh — обновить из Clash Royale)"""
+    from services import db, cr_api
+    from config import SNAPSHOT_MAX_AGE_MINUTES
+    
+    user = db.get_user(message.from_user.id)
+    
+    if not user:
+        await message.answer("❌ Сначала зарегистрируйся: /register")
+        return
+    
+    player_tag = user['player_tag']
+    snapshot = db.get_player_snapshot(player_tag)
+    games = db.get_user_games(message.from_user.id, limit=100)
+    
+    if not snapshot:
+        # Профиля еще нет — единственный случай, когда ждем API
+        msg = await message.answer("⏳ Загружаю профиль...")
+        player_data = await asyncio.to_thread(cr_api.get_player, player_tag)
+        
+        if not player_data:
+            await msg.edit_text("❌ Не удалось загрузить профиль из Clash Royale")
+            return
+        
+        db.save_player_snapshot(player_tag, message.from_user.id, player_data)
+        snapshot = db.get_player_snapshot(player_tag)
+        await msg.edit_text(format_profile(user, snapshot, games, db.get_trophy_history(player_tag)), parse_mode="HTML")
+        return
+    
+    msg = await message.answer(format_profile(user, snapshot, games, db.get_trophy_history(player_tag)), parse_mode="HTML")
+    
+    # Устаревший профиль отдаем сразу и обновляем в фоне
+    stale_since = (datetime.now() - timedelta(minutes=SNAPSHOT_MAX_AGE_MINUTES)).strftime('%Y-%m-%d %H:%M:%S')
+    if command.args == 'refresh' or snapshot['fetched_at'] < stale_since:
+        run_in_background(refresh_profile(msg, user, games))
 
 @router.message(Command("top"))
-async def cmd_top(message: Message):
-    """Расширенная таблица лидеров"""
-    from bot import db
+async def cmd_top(message: Message, command: CommandObject):
+    """Расширенная таблица лидеров: текущий месяц или /top YYYY-MM"""
+    from services import db
+    
+    # В групповом чате с турниром показываем таблицу турнира этого чата
+    chat_id = group_chat_id(message)
+    if chat_id and not command.args and db.get_chat_tournament(chat_id):
+        await cmd_tournament_standings(message, command)
+        return
+    
+    current_month = datetime.now().strftime('%Y-%m')
+    month = command.args.strip() if command.args else current_month
     
-    leaderboard = db.get_leaderboard(limit=25)
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        await message.answer("Использование: /top [YYYY-MM]")
+        return
+    
+    if month == current_month:
+        leaderboard = [
+            {**player, 'points': player['current_month_points']}
+            for player in db.get_leaderboard(limit=25)
+        ]
+        title = "🏆 <b>Топ-25 игроков месяца</b>"
+    else:
+        # Прошедшие месяцы — из замороженной итоговой таблицы
+        leaderboard = db.get_standings(month, limit=25)
+        title = f"🏆 <b>Итоги {month}</b>"
     
     if not leaderboard:
-        await message.answer("📊 Таблица лидеров пока пуста")
+        await message.answer("📊 Таблица лидеров пока пуста" if month == current_month else f"📊 Нет итогов за {month}")
         return
     
-    text = "🏆 <b>Топ-25 игроков месяца</b>\n\n"
+    text = f"{title}\n\n"
     
     medals = {1: '🥇', 2: '🥈', 3: '🥉'}
     
@@ -161,7 +262,84 @@ async def cmd_top(message: Message):
         if len(name) > 15:
             name = name[:12] + "..."
         
-        text += f"{medal} {name} — ⭐ {player['current_month_points']}\n"
+        text += f"{medal} {name} — ⭐ {player['points']}\n"
+    
+    # Игрок ниже топа — показываем его место и соседей по рейтингу
+    if month == current_month and all(player['user_id'] != message.from_user.id for player in leaderboard):
+        window = db.get_rank_window(message.from_user.id)
+        if window:
+            text += "\n…\n"
+            for player in window:
+                name = player['first_name'] or player['username'] or 'Аноним'
+                if len(name) > 15:
+                    name = name[:12] + "..."
+                line = f"{player['position']}. {name} — ⭐ {player['current_month_points']}"
+                text += f"<b>{line}</b>\n" if player['user_id'] == message.from_user.id else f"{line}\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("meta"))
+async def cmd_meta(message: Message, command: CommandObject):
+    """Мета месяца: популярные карты и колоды с лучшим винрейтом"""
+    from services import db
+    from meta import build_meta
+    
+    month = command.args.strip() if command.args else None
+    if month:
+        try:
+            datetime.strptime(month, '%Y-%m')
+        except ValueError:
+            await message.answer("Использование: /meta [YYYY-MM]")
+            return
+    
+    meta = build_meta(db, month)
+    
+    if not meta['total']:
+        await message.answer(f"🃏 За {meta['month']} пока нет игр с известными колодами")
+        return
+    
+    text = f"🃏 <b>Мета {meta['month']}</b>\n📊 Игр с колодами: {meta['total']}\n\n<b>Популярные карты:</b>\n"
+    
+    for idx, card in enumerate(meta['cards'], 1):
+        text += f"{idx}. {card['name']} — {card['usage']:.1f}% игр, винрейт {card['winrate']:.1f}%\n"
+    
+    if meta['decks']:
+        text += "\n<b>Лучшие колоды:</b>\n"
+        for deck in meta['decks']:
+            text += f"\n🏆 {deck['winrate']:.1f}% ({deck['games']} игр)\n{', '.join(deck['cards'])}\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("rating"))
+async def cmd_rating(message: Message):
+    """Рейтинг силы Glicko-2: топ и свой рейтинг"""
+    from services import db
+    import config
+    
+    leaderboard = db.get_rating_leaderboard(limit=10, min_games=config.RATING_MIN_GAMES)
+    
+    text = "🎯 <b>Рейтинг силы</b>\n<i>Glicko-2 по боям 1 на 1, обновляется раз в период</i>\n\n"
+    
+    if leaderboard:
+        for idx, player in enumerate(leaderboard, 1):
+            name = player['first_name'] or player['username'] or 'Аноним'
+            if len(name) > 15:
+                name = name[:12] + "..."
+            text += f"{idx}. {name} — {player['rating']:.0f} ±{2 * player['rd']:.0f}\n"
+    else:
+        text += f"Пока нет игроков с {config.RATING_MIN_GAMES}+ рейтинговыми боями\n"
+    
+    user = db.get_user(message.from_user.id)
+    rating = db.get_player_rating(user['player_tag'], config.RATING_MIN_GAMES) if user else None
+    
+    if rating:
+        text += f"\n📈 Твой рейтинг: {rating['rating']:.0f} ±{2 * rating['rd']:.0f} ({rating['games']} боев)"
+        if rating['place']:
+            text += f", {rating['place']} место"
+        else:
+            text += f"\nМесто в таблице — после {config.RATING_MIN_GAMES} боев"
+    elif user:
+        text += "\n📈 Твой рейтинг появится после первого завершенного периода с боями 1 на 1"
     
     await message.answer(text, parse_mode="HTML")
 
@@ -212,7 +390,7 @@ async def cmd_rules(message: Message):
 @router.message(Command("rewards"))
 async def cmd_rewards(message: Message):
     """История наград пользователя"""
-    from bot import db
+    from services import db
     
     user = db.get_user(message.from_user.id)
     
@@ -221,12 +399,17 @@ async def cmd_rewards(message: Message):
         return
     
     rewards = db.get_user_rewards(message.from_user.id)
+    standings = db.get_user_standings(message.from_user.id)
     
     if not rewards:
-        await message.answer(
+        text = (
             "🎁 У тебя пока нет полученных наград.\n\n"
             "Попади в топ-10 в конце месяца чтобы получить награды!"
         )
+        if standings:
+            text += "\n\n📅 <b>Твои места:</b>\n"
+            text += "".join(f"{row['month']}: {row['place']} место, ⭐ {row['points']}\n" for row in standings)
+        await message.answer(text, parse_mode="HTML")
         return
     
     text = "🏆 <b>Твои награды:</b>\n\n"
@@ -242,12 +425,18 @@ async def cmd_rewards(message: Message):
         text += f"🪙 Gold: {reward_data['gold']}\n"
         text += f"━━━━━━━━━━━━━━━\n\n"
     
+    rewarded = {reward['month'] for reward in rewards}
+    other_months = [row for row in standings if row['month'] not in rewarded]
+    if other_months:
+        text += "📅 <b>Другие месяцы:</b>\n"
+        text += "".join(f"{row['month']}: {row['place']} место, ⭐ {row['points']}\n" for row in other_months)
+    
     await message.answer(text, parse_mode="HTML")
 
 @router.message(Command("mystats"))
 async def cmd_mystats(message: Message):
     """Детальная статистика"""
-    from bot import db
+    from services import db
     
     user = db.get_user(message.from_user.id)
     
@@ -309,3 +498,527 @@ async def cmd_mystats(message: Message):
         stats_text += f"• {mode}: {data['games']} игр (WR: {winrate:.1f}%)\n"
     
     await message.answer(stats_text, parse_mode="HTML")
+
+# Лимит Telegram на отправку файлов ботом
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject):
+    """Выгрузка данных (только для админов)"""
+    from services import db
+    from config import ADMIN_IDS
+    from export import DATASETS, FORMATS, export
+    
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    args = (command.args or '').split()
+    
+    if not args or args[0] not in DATASETS:
+        await message.answer(
+            "📦 <b>Выгрузка данных</b>\n\n"
+            "Формат: /export &lt;набор&gt; [csv|jsonl|parquet] [YYYY-MM]\n\n"
+            f"Наборы: {', '.join(DATASETS)}\n"
+            "Для standings месяц обязателен",
+            parse_mode="HTML"
+        )
+        return
+    
+    dataset = args[0]
+    fmt = next((a for a in args[1:] if a in FORMATS), 'csv')
+    month = next((a for a in args[1:] if a not in FORMATS), None)
+    
+    msg = await message.answer("⏳ Выгружаю данные...")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{dataset}_{month or 'all'}.{fmt}")
+        
+        try:
+            # Выгрузка идет в отдельном потоке, чтобы не блокировать бота
+            count = await asyncio.to_thread(export, db, dataset, fmt, path, month)
+        except (ValueError, RuntimeError) as e:
+            await msg.edit_text(f"❌ {e}")
+            return
+        
+        # Пустую выгрузку не отправляем: Parquet-файл не создается, пустой файл Telegram не примет
+        if not count:
+            await msg.edit_text(f"📭 {dataset}: нет данных" + (f" за {month}" if month else ""))
+            return
+        
+        if os.path.getsize(path) > MAX_UPLOAD_SIZE:
+            await msg.edit_text(
+                f"❌ Файл больше 50 МБ ({count} строк).\n"
+                f"Используй на сервере: python export.py {dataset} --format {fmt}"
+            )
+            return
+        
+        await message.answer_document(FSInputFile(path), caption=f"✅ {dataset}: {count} строк")
+        await msg.delete()
+
+@router.message(Command("adjust"))
+async def cmd_adjust(message: Message, command: CommandObject):
+    """Ручная правка очков через журнал очков (только для админов)"""
+    from services import db
+    from config import ADMIN_IDS
+    from ledger import EVENT_ADJUST
+    
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    args = (command.args or '').split(maxsplit=2)
+    
+    try:
+        target, points = args[0], int(args[1])
+    except (IndexError, ValueError):
+        await message.answer(
+            "Использование: /adjust &lt;#TAG|user_id&gt; &lt;±очки&gt; [причина]\n"
+            "Например: /adjust #ABC123 -20 фарм с твинком",
+            parse_mode="HTML"
+        )
+        return
+    
+    user = db.get_user(int(target)) if target.isdigit() else db.get_user_by_tag('#' + target.lstrip('#').upper())
+    if not user:
+        await message.answer("❌ Игрок не найден")
+        return
+    
+    reason = args[2] if len(args) > 2 else None
+    event_id = db.add_score_event(user['user_id'], EVENT_ADJUST, points, reason, message.from_user.id)
+    user = db.get_user(user['user_id'])
+    
+    await message.answer(
+        f"✅ Правка #{event_id}: {points:+d} очков для {user['first_name'] or user['player_tag']}\n"
+        f"⭐ Очки в этом месяце: {user['current_month_points']}\n"
+        f"🏅 Всего очков: {user['total_points']}"
+    )
+
+@router.message(Command("suspicious"))
+async def cmd_suspicious(message: Message):
+    """Подозрительные бои: одна пара игроков слишком часто за день (только для админов)"""
+    from services import db
+    from config import ADMIN_IDS
+    
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    battles = db.get_flagged_battles(limit=20)
+    
+    if not battles:
+        await message.answer("✅ Подозрительных боев нет")
+        return
+    
+    text = "🚩 <b>Подозрительные бои</b>\n\n"
+    
+    for battle in battles:
+        text += f"🕒 {str(battle['battle_time'])[:16]}\n"
+        text += f"⚔️ {battle['pair_key'].replace('|', ' vs ')}\n"
+        text += f"👤 Засчитали: {battle['claimed_by'] or '-'}\n\n"
+    
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("find"))
+async def cmd_find(message: Message):
+    """Поиск соперника по трофеям"""
+    from services import db, matchmaking
+    
+    user = db.get_user(message.from_user.id)
+    
+    if not user:
+        await message.answer("❌ Сначала зарегистрируйся: /register")
+        return
+    
+    if db.get_active_match(user['user_id']):
+        await message.answer(
+            "⚔️ У тебя уже есть соперник!\n\n"
+            "Сыграй бой и нажми /matchverify или отмени матч: /cancelfind"
+        )
+        return
+    
+    if user['user_id'] in matchmaking.matchmaker:
+        await message.answer("⏳ Поиск уже идет... Отменить: /cancelfind")
+        return
+    
+    try:
+        match_id = await matchmaking.join(user, message.bot)
+    except LookupError:
+        await message.answer("❌ Не удалось загрузить трофеи из Clash Royale. Попробуй позже.")
+        return
+    except OverflowError:
+        await message.answer("😔 Очередь поиска переполнена. Попробуй через минуту.")
+        return
+    
+    if match_id is None:
+        await message.answer(
+            "🔍 Ищу соперника с похожим количеством трофеев...\n\n"
+            "Я напишу, как только найду. Отменить: /cancelfind"
+        )
+
+@router.message(Command("cancelfind"))
+async def cmd_cancel_find(message: Message):
+    """Отмена поиска или активного матча"""
+    from services import db, matchmaking
+    
+    if matchmaking.leave(message.from_user.id):
+        await message.answer("❌ Поиск отменен")
+        return
+    
+    match = db.get_active_match(message.from_user.id)
+    if match:
+        db.finish_match(match['id'], 'expired')
+        await message.answer("❌ Матч отменен")
+        return
+    
+    await message.answer("Ты сейчас не ищешь соперника. Начать: /find")
+
+@router.message(Command("matchverify"))
+async def cmd_match_verify(message: Message):
+    """Проверка боя с найденным соперником по battlelog обоих игроков"""
+    from services import db, cr_api, game_writes
+    
+    match = db.get_active_match(message.from_user.id)
+    
+    if not match:
+        await message.answer("❌ Нет активного матча. Найди соперника: /find")
+        return
+    
+    msg = await message.answer("⏳ Ищу ваш бой в истории обоих игроков...")
+    
+    since = datetime.strptime(match['created_at'], '%Y-%m-%d %H:%M:%S')
+    sides = [(match['user1_id'], match['tag1'], match['tag2']), (match['user2_id'], match['tag2'], match['tag1'])]
+    
+    # Бой должен найтись в battlelog обоих игроков и совпасть по отпечатку
+    found = []
+    for user_id, player_tag, opponent_tag in sides:
+        battle_data = await asyncio.to_thread(cr_api.find_battle_against, player_tag, opponent_tag, since)
+        found.append((user_id, battle_data))
+    
+    if not all(battle_data for _, battle_data in found):
+        await msg.edit_text("❌ Бой между вами пока не найден. Сыграйте и попробуй через минуту.")
+        return
+    
+    if found[0][1]['fingerprint'] != found[1][1]['fingerprint']:
+        await msg.edit_text("❌ Записи боя у игроков не совпадают. Сыграйте новый бой.")
+        return
+    
+    winner_id = next((user_id for user_id, battle_data in found if battle_data['result'] == 'win'), None)
+    
+    # Матч закрывает тот, кто успел первым: /matchverify соперника мог пройти параллельно
+    if not db.finish_match(match['id'], 'verified', winner_id, found[0][1]['fingerprint']):
+        await msg.edit_text("⚠️ Этот матч уже засчитан!")
+        return
+    
+    added = [
+        await game_writes.add_game(user_id, battle_data, cr_api.calculate_points(battle_data))
+        for user_id, battle_data in found
+    ]
+    
+    my_battle = next(battle_data for user_id, battle_data in found if user_id == message.from_user.id)
+    await msg.edit_text(
+        f"✅ Матч подтвержден!\n\n"
+        f"👑 Короны: {my_battle['crowns']} - {my_battle['opponent_crowns']}\n"
+        + ("⭐ Очки начислены обоим игрокам" if all(added) else "⚠️ Бой уже был засчитан через /verify, очки не начислены повторно")
+    )
+
+def group_chat_id(message: Message):
+    """id группового чата или None для личных сообщений"""
+    return message.chat.id if message.chat.type in ('group', 'supergroup') else None
+
+def parse_tournament_id(message: Message, command: CommandObject):
+    """
+    Первый аргумент команды — id турнира.
+    В групповом чате без аргумента берется текущий турнир этого чата
+    """
+    from services import db
+    
+    args = (command.args or '').split()
+    if args and args[0].isdigit():
+        return int(args[0]), args[1:]
+    
+    chat_id = group_chat_id(message)
+    tournament = db.get_chat_tournament(chat_id) if chat_id else None
+    return (tournament['id'] if tournament else None), args
+
+async def is_tournament_admin(message: Message):
+    """Админ бота или администратор группы, в которой проводится турнир"""
+    from config import ADMIN_IDS
+    
+    if message.from_user.id in ADMIN_IDS:
+        return True
+    
+    if not group_chat_id(message):
+        return False
+    
+    member = await message.bot.get_chat_member(message.chat.id, message.from_user.id)
+    return member.status in ('creator', 'administrator')
+
+@router.message(Command("tcreate"))
+async def cmd_tournament_create(message: Message, command: CommandObject):
+    """
+    Создание турнира (админы бота или группы):
+    /tcreate <single|double|swiss|points> [x1.5] [mode=PvP] <название>
+    В группе турнир привязывается к чату
+    """
+    from services import tournaments
+    from tournament import FORMATS
+    
+    if not await is_tournament_admin(message):
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    args = (command.args or '').split()
+    multiplier = 1.0
+    game_mode = None
+    
+    # Необязательные параметры после формата: множитель очков и режим игры
+    while len(args) > 1 and (args[1].startswith('mode=') or args[1][:1] == 'x'):
+        option = args.pop(1)
+        if option.startswith('mode='):
+            game_mode = option[5:]
+            continue
+        try:
+            multiplier = float(option[1:])
+        except ValueError:
+            args.insert(1, option)
+            break
+    
+    if len(args) < 2:
+        await message.answer(
+            f"Использование: /tcreate &lt;{'|'.join(FORMATS)}&gt; [x1.5] [mode=PvP] &lt;название&gt;",
+            parse_mode="HTML"
+        )
+        return
+    
+    fmt, name = args[0].lower(), ' '.join(args[1:])
+    
+    try:
+        tournament_id = tournaments.create(
+            name, fmt, message.from_user.id, group_chat_id(message), multiplier, game_mode
+        )
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    details = f"⭐ Множитель очков: x{multiplier:g}\n" if multiplier != 1 else ""
+    if game_mode:
+        details += f"🎮 Режим: {game_mode}\n"
+    
+    await message.answer(
+        f"🏟 Турнир <b>{name}</b> создан ({FORMATS[fmt]})\n{details}\n"
+        f"Запись: /tjoin {tournament_id}\n"
+        f"Старт: /tstart {tournament_id}",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("tjoin"))
+async def cmd_tournament_join(message: Message, command: CommandObject):
+    """Запись на турнир"""
+    from services import db, tournaments
+    
+    tournament_id, _ = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tjoin &lt;id турнира&gt;", parse_mode="HTML")
+        return
+    
+    user = db.get_user(message.from_user.id)
+    if not user:
+        await message.answer("❌ Сначала зарегистрируйся: /register")
+        return
+    
+    try:
+        tournaments.join(tournament_id, user)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    await message.answer(f"✅ Ты записан на турнир #{tournament_id}. Жди жеребьевку!")
+
+@router.message(Command("tstart"))
+async def cmd_tournament_start(message: Message, command: CommandObject):
+    """Посев и первый раунд (только для админов): /tstart <id> [раундов]"""
+    from services import tournaments
+    
+    if not await is_tournament_admin(message):
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    tournament_id, args = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tstart &lt;id турнира&gt; [число раундов]", parse_mode="HTML")
+        return
+    
+    rounds = int(args[0]) if args and args[0].isdigit() else None
+    
+    try:
+        pairings = await asyncio.to_thread(tournaments.start, tournament_id, rounds)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    if not pairings:
+        await message.answer(
+            f"🚀 Турнир #{tournament_id} начался! Очки начисляются за каждую игру через /verify\n\n"
+            f"Таблица: /tstandings {tournament_id}"
+        )
+        return
+    
+    run_in_background(notify_round(message.bot, tournament_id, 1))
+    await message.answer(f"🚀 Турнир #{tournament_id} начался! Пар в 1 раунде: {pairings}")
+
+@router.message(Command("tnext"))
+async def cmd_tournament_next(message: Message, command: CommandObject):
+    """Следующий раунд (только для админов): /tnext <id>"""
+    from services import db, tournaments
+    
+    if not await is_tournament_admin(message):
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    tournament_id, _ = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tnext &lt;id турнира&gt;", parse_mode="HTML")
+        return
+    
+    try:
+        pairings = await asyncio.to_thread(tournaments.advance, tournament_id)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    if not pairings:
+        await message.answer(f"🏁 Турнир #{tournament_id} завершен! Итоги: /tstandings {tournament_id}")
+        return
+    
+    round_number = db.get_tournament(tournament_id)['current_round']
+    run_in_background(notify_round(message.bot, tournament_id, round_number))
+    await message.answer(f"▶️ Раунд {round_number} турнира #{tournament_id}. Пар: {pairings}")
+
+@router.message(Command("tfinish"))
+async def cmd_tournament_finish(message: Message, command: CommandObject):
+    """Завершение турнира на очки: /tfinish <id>"""
+    from services import tournaments
+    
+    if not await is_tournament_admin(message):
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+    
+    tournament_id, _ = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tfinish &lt;id турнира&gt;", parse_mode="HTML")
+        return
+    
+    try:
+        tournaments.finish(tournament_id)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    await message.answer(f"🏁 Турнир #{tournament_id} завершен! Итоги: /tstandings {tournament_id}")
+
+async def notify_round(bot, tournament_id, round_number):
+    """Разослать участникам их пары нового раунда"""
+    from services import db
+    
+    entrants = {e['user_id']: e for e in db.get_entrants(tournament_id)}
+    
+    for pairing in db.get_round_pairings(tournament_id, round_number):
+        sides = [(pairing['user1_id'], pairing['user2_id']), (pairing['user2_id'], pairing['user1_id'])]
+        for user_id, opponent_id in sides:
+            if user_id is None:
+                continue
+            if opponent_id is None:
+                text = f"🎟 Раунд {round_number} турнира #{tournament_id}: у тебя bye, очко начислено автоматически"
+            else:
+                text = (
+                    f"⚔️ Раунд {round_number} турнира #{tournament_id}\n\n"
+                    f"🎮 Соперник: <code>{entrants[opponent_id]['player_tag']}</code>\n\n"
+                    f"Сыграйте дружеский бой и нажми /tresult {tournament_id}"
+                )
+            try:
+                await bot.send_message(user_id, text, parse_mode="HTML")
+            except Exception as e:
+                logger.warning(f"Failed to notify {user_id} about tournament {tournament_id}: {e}")
+            # Не упираемся в лимит Telegram на рассылку
+            await asyncio.sleep(0.05)
+
+@router.message(Command("tresult"))
+async def cmd_tournament_result(message: Message, command: CommandObject):
+    """Проверка боя текущей пары турнира по battlelog"""
+    from services import db, tournaments
+    
+    tournament_id, _ = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tresult &lt;id турнира&gt;", parse_mode="HTML")
+        return
+    
+    user = db.get_user(message.from_user.id)
+    if not user:
+        await message.answer("❌ Сначала зарегистрируйся: /register")
+        return
+    
+    msg = await message.answer("⏳ Ищу бой с соперником в истории...")
+    
+    try:
+        battle_data, winner_id = await asyncio.to_thread(tournaments.report_result, tournament_id, user)
+    except ValueError as e:
+        await msg.edit_text(f"❌ {e}")
+        return
+    
+    if winner_id is None:
+        outcome = "🤝 Ничья"
+    elif winner_id == user['user_id']:
+        outcome = "🏆 Победа"
+    else:
+        outcome = "💔 Поражение"
+    
+    await msg.edit_text(
+        f"✅ Результат записан!\n\n"
+        f"{outcome}\n"
+        f"👑 Короны: {battle_data['crowns']} - {battle_data['opponent_crowns']}\n\n"
+        f"Таблица: /tstandings {tournament_id}"
+    )
+
+@router.message(Command("tstandings"))
+async def cmd_tournament_standings(message: Message, command: CommandObject):
+    """Таблица турнира"""
+    from services import db
+    from tournament import FORMATS, MAX_LOSSES
+    
+    tournament_id, _ = parse_tournament_id(message, command)
+    if tournament_id is None:
+        await message.answer("Использование: /tstandings &lt;id турнира&gt;", parse_mode="HTML")
+        return
+    
+    tournament = db.get_tournament(tournament_id)
+    if not tournament:
+        await message.answer("❌ Турнир не найден")
+        return
+    
+    standings = db.get_tournament_standings(tournament_id, 20)
+    status = {'registration': 'запись', 'running': f"раунд {tournament['current_round']}", 'finished': 'завершен'}
+    
+    text = (
+        f"🏟 <b>{tournament['name']}</b>\n"
+        f"{FORMATS[tournament['format']]}, {status.get(tournament['status'], tournament['status'])}\n\n"
+    )
+    
+    if not standings:
+        text += "Пока нет участников"
+    
+    max_losses = MAX_LOSSES[tournament['format']]
+    for idx, entrant in enumerate(standings, 1):
+        if tournament['format'] == 'points':
+            text += (
+                f"{idx}. <code>{entrant['player_tag']}</code> — ⭐ {entrant['score']:g} "
+                f"({entrant['wins'] + entrant['draws'] + entrant['losses']} игр, {entrant['wins']} побед)\n"
+            )
+            continue
+        out = " ❌" if max_losses and entrant['losses'] >= max_losses else ""
+        text += (
+            f"{idx}. <code>{entrant['player_tag']}</code> — {entrant['score']:g} "
+            f"({entrant['wins']}-{entrant['draws']}-{entrant['losses']}, Бх {entrant['buchholz']:g}){out}\n"
+        )
+    
+    await message.answer(text, parse_mode="HTML")
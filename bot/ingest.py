@@ -0,0 +1,114 @@
+from collections import defaultdict
+
+from api_scheduler import BULK
+
+class ClanIngestor:
+    """
+    Автосбор боев зарегистрированных игроков без /verify.
+
+    Игроки группируются по кланам из сохраненных профилей. На клан тратится
+    два запроса (участники и клановая война); battlelog запрашивается только
+    у тех, у кого с прошлого опроса изменился lastSeen или число колод в войне.
+    Игроки без клана (или покинувшие его) опрашиваются по battlelog напрямую.
+    """
+    
+    def __init__(self, db, cr_api):
+        self.db = db
+        self.cr_api = cr_api
+    
+    def poll(self):
+        """
+        Один цикл опроса
+        Returns: dict со счетчиками запросов к API и записанных игр
+        """
+        stats = {'clans': 0, 'battle_logs': 0, 'skipped': 0, 'games': 0}
+        clans = defaultdict(list)
+        to_fetch = []
+        
+        for player in self.db.get_ingest_targets():
+            if player['clan_tag']:
+                clans[player['clan_tag']].append(player)
+            else:
+                to_fetch.append(player)
+        
+        for clan_tag, players in clans.items():
+            active, skipped = self.find_active(clan_tag, players)
+            to_fetch += active
+            stats['clans'] += 1
+            stats['skipped'] += skipped
+        
+        games = []
+        states = []
+        
+        for player in to_fetch:
+            battles = self.cr_api.get_battle_log(player['player_tag'], BULK)
+            stats['battle_logs'] += 1
+            
+            # Ошибка API: состояние не сохраняем, игрок попадет в следующий опрос
+            if battles is None:
+                continue
+            
+            games += self.new_games(player, battles)
+            newest = max((battle['battleTime'] for battle in battles), default=None)
+            states.append({
+                'player_tag': player['player_tag'],
+                'last_seen': player['last_seen'],
+                'decks_used': player['decks_used'],
+                # Пустая строка — игрок уже учтен, но боев у него пока нет
+                'last_battle_time': max(newest or '', player['last_battle_time'] or '')
+            })
+        
+        if games:
+            stats['games'] = sum(self.db.add_games(games))
+        if states:
+            self.db.save_ingest_state(states)
+        
+        return stats
+    
+    def find_active(self, clan_tag, players):
+        """
+        Отобрать игроков клана, которые играли с прошлого опроса
+        Returns: (игроки для запроса battlelog, сколько пропущено)
+        """
+        members = self.cr_api.get_clan_members(clan_tag, BULK)
+        if members is None:
+            return players, 0
+        
+        river = self.cr_api.get_current_river_race(clan_tag, BULK) or {}
+        decks_used = {p.get('tag'): p.get('decksUsed') for p in river.get('clan', {}).get('participants', [])}
+        members = {member.get('tag'): member for member in members}
+        
+        active = []
+        for player in players:
+            member = members.get(player['player_tag'])
+            
+            # Вышел из клана — опрашиваем напрямую, клан обновится вместе с профилем
+            if member is None:
+                active.append(player)
+                continue
+            
+            last_seen = member.get('lastSeen')
+            decks = decks_used.get(player['player_tag'])
+            
+            if (player['last_battle_time'] is None
+                    or last_seen != player['last_seen']
+                    or (decks is not None and decks != player['decks_used'])):
+                active.append({**player, 'last_seen': last_seen, 'decks_used': decks})
+        
+        return active, len(players) - len(active)
+    
+    def new_games(self, player, battles):
+        """Бои новее последнего учтенного; при первом опросе игрока только запоминаем точку отсчета"""
+        if player['last_battle_time'] is None:
+            return []
+        
+        games = []
+        for battle in battles:
+            if battle['battleTime'] <= player['last_battle_time']:
+                continue
+            
+            battle_data = self.cr_api.parse_battle(battle)
+            if battle_data:
+                games.append((player['user_id'], battle_data, self.cr_api.calculate_points(battle_data)))
+        
+        return games
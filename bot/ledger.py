@@ -0,0 +1,54 @@
+"""
+Журнал очков: источник правды для очков игроков.
+
+Каждое изменение очков — строка в score_events (только добавление):
+    game     — засчитанный бой (game_id)
+    adjust   — ручная правка администратора (/adjust)
+    opening  — начальный остаток при переходе на журнал: разница между
+               очками в users и суммой очков засчитанных игр
+
+Из журнала строятся проекции, которые читаются за O(1):
+    users.total_points, users.current_month_points — итоги игрока
+    monthly_points                                 — очки игрока за каждый месяц
+Запись события и обновление проекций идут в одной транзакции, в
+projection_state хранится id последнего примененного события. Если проекции
+разошлись с журналом (восстановление из копии, ручная правка БД), их можно
+догнать с этой отметки или пересобрать целиком:
+    python ledger.py check
+    python ledger.py catchup
+    python ledger.py rebuild
+"""
+import argparse
+
+EVENT_GAME = 'game'
+EVENT_ADJUST = 'adjust'
+EVENT_OPENING = 'opening'
+
+# Имя проекции в projection_state
+SCORES_PROJECTION = 'scores'
+
+def main():
+    import config
+    from database import Database
+    
+    parser = argparse.ArgumentParser(description='Журнал очков и проекции')
+    parser.add_argument('command', choices=('check', 'catchup', 'rebuild'))
+    args = parser.parse_args()
+    
+    db = Database(config.DATABASE_PATH, config.ARCHIVE_DATABASE_PATH)
+    
+    if args.command == 'check':
+        mismatches = db.get_score_mismatches()
+        for row in mismatches:
+            print(
+                f"user {row['user_id']}: total {row['total_points']} (журнал {row['ledger_total']}), "
+                f"месяц {row['current_month_points']} (журнал {row['ledger_month']})"
+            )
+        print(f"{'❌' if mismatches else '✅'} Расхождений: {len(mismatches)}")
+    elif args.command == 'catchup':
+        print(f"✅ Применено событий: {db.catch_up_scores()}")
+    else:
+        print(f"✅ Проекции пересобраны, событий в журнале: {db.rebuild_score_projections()}")
+
+if __name__ == '__main__':
+    main()
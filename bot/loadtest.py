@@ -0,0 +1,258 @@
+"""
+Нагрузочный тест диспетчера без сети.
+
+Генерирует синтетические Telegram Update (/start, /verify, /stats, /top,
+callback-кнопки) для тысяч виртуальных пользователей и прогоняет их через
+dp.feed_update. Исходящие запросы к Telegram перехватывает фейковая сессия,
+Clash Royale API подменяется заглушкой.
+
+Запуск:
+    python loadtest.py --users 2000 --updates 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# Фейковый токен нужен только для валидации формата, в сеть ничего не уходит
+os.environ.setdefault('BOT_TOKEN', '123456:LOADTEST')
+
+import config
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetMe, SendMessage
+from aiogram.types import Message, Update, User
+
+from api_scheduler import INTERACTIVE
+from royale_api import ClashRoyaleAPI
+from throttling import throttled
+
+BOT_USER = {'id': 42, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+
+# Доли команд в потоке апдейтов
+DEFAULT_MIX = {
+    '/start': 0.25,
+    '/verify': 0.2,
+    '/stats': 0.2,
+    '/top': 0.15,
+    'cb:stats': 0.1,
+    'cb:leaderboard': 0.1
+}
+
+class RecordingSession(BaseSession):
+    """Сессия, которая записывает исходящие вызовы вместо отправки в Telegram"""
+    
+    def __init__(self, latency_ms=0):
+        super().__init__()
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.message_id = 0
+    
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        
+        if isinstance(method, GetMe):
+            return User.model_validate(BOT_USER, context={'bot': bot})
+        
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.message_id += 1
+            return Message.model_validate({
+                'message_id': getattr(method, 'message_id', None) or self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': method.chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': method.text
+            }, context={'bot': bot})
+        
+        return True
+    
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+    
+    async def close(self):
+        pass
+
+class FakeClashRoyaleAPI(ClashRoyaleAPI):
+    """Заглушка Clash Royale API со случайными, но правдоподобными ответами"""
+    
+    def __init__(self, latency_ms=0):
+        super().__init__('LOADTEST')
+        self.latency = latency_ms / 1000
+    
+    def get_player(self, player_tag, priority=INTERACTIVE):
+        if self.latency:
+            time.sleep(self.latency)
+        return {
+            'tag': player_tag,
+            'name': f'Player {player_tag}',
+            'trophies': random.randint(3000, 9000),
+            'bestTrophies': 9000,
+            'expLevel': 13
+        }
+    
+    def get_battle_log(self, player_tag, priority=INTERACTIVE):
+        if self.latency:
+            time.sleep(self.latency)
+        crowns, opponent_crowns = random.randint(0, 3), random.randint(0, 3)
+        return [{
+            'type': random.choice(['PvP', 'challenge', 'tournament']),
+            'battleTime': datetime.utcnow().strftime('%Y%m%dT%H%M%S.000Z'),
+            'arena': {'name': 'Legendary Arena'},
+            'team': [{'tag': player_tag, 'crowns': crowns, 'trophyChange': 30, 'cards': []}],
+            'opponent': [{'tag': f'#OPP{random.randint(1, 10 ** 6)}', 'crowns': opponent_crowns}]
+        }]
+
+def build_update(bot, update_id, user_id, kind):
+    """Собрать синтетический Update для команды или callback-кнопки"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    chat = {'id': user_id, 'type': 'private'}
+    now = int(time.time())
+    
+    if kind.startswith('cb:'):
+        raw = {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': kind[3:],
+                'message': {'message_id': update_id, 'date': now, 'chat': chat, 'from': BOT_USER, 'text': 'menu'}
+            }
+        }
+    else:
+        raw = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': now,
+                'chat': chat,
+                'from': user,
+                'text': kind,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(kind)}]
+            }
+        }
+    
+    return Update.model_validate(raw, context={'bot': bot})
+
+def percentile(sorted_values, pct):
+    """Перцентиль по отсортированному списку (метод ближайшего ранга)"""
+    if not sorted_values:
+        return 0.0
+    idx = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[idx]
+
+def seed_users(db, user_ids, registered_share):
+    """Зарегистрировать часть виртуальных пользователей в тестовой БД"""
+    registered = 0
+    for user_id in user_ids:
+        if random.random() < registered_share:
+            db.register_user(user_id, f'user{user_id}', f'User{user_id}', f'#LT{user_id}')
+            registered += 1
+    return registered
+
+async def run(args):
+    random.seed(args.seed)
+    
+    # Все файлы бота — во временном каталоге, он удаляется после прогона
+    # (профили медленных апдейтов остаются, только если PROFILE_DIR задан явно)
+    db_dir = tempfile.mkdtemp(prefix='loadtest_')
+    config.DATABASE_PATH = os.path.join(db_dir, 'tournament.db')
+    config.ARCHIVE_DATABASE_PATH = os.path.join(db_dir, 'tournament_archive.db')
+    if 'PROFILE_DIR' not in os.environ:
+        config.PROFILE_DIR = os.path.join(db_dir, 'profiles')
+    
+    try:
+        await run_updates(args)
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+async def run_updates(args):
+    # Импортируем после подмены путей, чтобы не трогать боевые tournament.db и tournament_archive.db;
+    # заглушку API ставим в services до импорта bot, чтобы ее получили все обработчики
+    import services
+    fake_api = FakeClashRoyaleAPI(args.api_latency)
+    services.cr_api = services.matchmaking.cr_api = services.tournaments.cr_api = fake_api
+    import bot as app
+    
+    logging.getLogger().setLevel(args.log_level)
+    
+    session = RecordingSession(args.tg_latency)
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    app.setup_dispatcher(bot)
+    
+    user_ids = [10_000_000 + i for i in range(args.users)]
+    registered = seed_users(app.db, user_ids, args.registered)
+    
+    kinds = list(DEFAULT_MIX)
+    weights = [DEFAULT_MIX[k] for k in kinds]
+    updates = [
+        (kind, build_update(bot, n, random.choice(user_ids), kind))
+        for n, kind in enumerate(random.choices(kinds, weights, k=args.updates), 1)
+    ]
+    
+    latencies = defaultdict(list)
+    errors = Counter()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    
+    async def feed(kind, update):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await app.dp.feed_update(bot, update)
+            except Exception:
+                errors[kind] += 1
+            # Ответы лимита (повтор последнего ответа) считаем отдельно, они на порядки быстрее
+            if throttled.get():
+                kind = f'{kind} (лимит)'
+            latencies[kind].append((time.perf_counter() - started) * 1000)
+    
+    print(f"👥 Пользователей: {args.users} (зарегистрировано: {registered})")
+    print(f"📨 Апдейтов: {args.updates}, параллельность: {args.concurrency}")
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(kind, update) for kind, update in updates))
+    elapsed = time.perf_counter() - started
+    
+    print(f"\n⏱ Время: {elapsed:.2f} с, пропускная способность: {args.updates / elapsed:.0f} upd/s\n")
+    print(f"{'команда':<16}{'кол-во':>8}{'ошибок':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (мс)")
+    
+    for kind in (name for kind in kinds for name in (kind, f'{kind} (лимит)')):
+        values = sorted(latencies[kind])
+        if not values:
+            continue
+        print(
+            f"{kind:<16}{len(values):>8}{errors[kind]:>8}"
+            f"{percentile(values, 50):>10.2f}{percentile(values, 90):>10.2f}"
+            f"{percentile(values, 99):>10.2f}{values[-1]:>10.2f}"
+        )
+    
+    print("\n📤 Исходящие вызовы Telegram API:")
+    for name, count in session.calls.most_common():
+        print(f"  {name}: {count}")
+    
+    await bot.session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест диспетчера бота без сети')
+    parser.add_argument('--users', type=int, default=2000, help='Число виртуальных пользователей')
+    parser.add_argument('--updates', type=int, default=20000, help='Число апдейтов')
+    parser.add_argument('--concurrency', type=int, default=200, help='Одновременно обрабатываемых апдейтов')
+    parser.add_argument('--registered', type=float, default=0.8, help='Доля зарегистрированных пользователей')
+    parser.add_argument('--tg-latency', type=float, default=0, help='Имитация задержки Telegram API, мс')
+    parser.add_argument('--api-latency', type=float, default=0, help='Имитация задержки Clash Royale API, мс')
+    parser.add_argument('--log-level', default='WARNING', help='Уровень логирования бота во время теста')
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
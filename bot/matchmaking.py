@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+
+logger = logging.getLogger(__name__)
+
+class Searcher:
+    """Игрок в очереди поиска соперника"""
+    __slots__ = ('user_id', 'player_tag', 'trophies', 'joined')
+    
+    def __init__(self, user_id, player_tag, trophies):
+        self.user_id = user_id
+        self.player_tag = player_tag
+        self.trophies = trophies
+        self.joined = time.monotonic()
+
+class Matchmaker:
+    """
+    Очередь поиска соперника, разбитая на корзины по трофеям.
+    Внутри корзины игроки лежат в отсортированном списке, ближайший по
+    трофеям ищется бинарным поиском. Окно поиска растет со временем ожидания.
+    """
+    
+    def __init__(self, bucket_size=100, base_window=100, widen_per_second=10,
+                 max_window=1000, max_queue=10000, timeout=300):
+        self.bucket_size = bucket_size
+        self.base_window = base_window
+        self.widen_per_second = widen_per_second
+        self.max_window = max_window
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # номер корзины -> отсортированный список (trophies, user_id)
+        self.buckets = {}
+        # user_id -> Searcher, в порядке входа в очередь
+        self.searchers = {}
+    
+    def __len__(self):
+        return len(self.searchers)
+    
+    def __contains__(self, user_id):
+        return user_id in self.searchers
+    
+    def add(self, searcher):
+        """
+        Поставить игрока в очередь или сразу найти ему соперника
+        Returns: Searcher соперника или None
+        """
+        if searcher.user_id in self.searchers:
+            return None
+        if len(self.searchers) >= self.max_queue:
+            raise OverflowError('Matchmaking queue is full')
+        
+        opponent = self.find_opponent(searcher, self.base_window)
+        if opponent:
+            self.remove(opponent.user_id)
+            return opponent
+        
+        self.searchers[searcher.user_id] = searcher
+        insort(self.buckets.setdefault(searcher.trophies // self.bucket_size, []), (searcher.trophies, searcher.user_id))
+        return None
+    
+    def remove(self, user_id):
+        """Убрать игрока из очереди"""
+        searcher = self.searchers.pop(user_id, None)
+        if not searcher:
+            return None
+        
+        idx = searcher.trophies // self.bucket_size
+        bucket = self.buckets[idx]
+        del bucket[bisect_left(bucket, (searcher.trophies, user_id))]
+        if not bucket:
+            del self.buckets[idx]
+        return searcher
+    
+    def find_opponent(self, searcher, window):
+        """Ближайший по трофеям игрок в пределах окна (O(log n) на корзину)"""
+        best = None
+        best_diff = window + 1
+        low = (searcher.trophies - window) // self.bucket_size
+        high = (searcher.trophies + window) // self.bucket_size
+        
+        for idx in range(low, high + 1):
+            bucket = self.buckets.get(idx)
+            if not bucket:
+                continue
+            
+            pos = bisect_left(bucket, (searcher.trophies, searcher.user_id))
+            for candidate in (pos - 2, pos - 1, pos, pos + 1):
+                if not 0 <= candidate < len(bucket):
+                    continue
+                trophies, user_id = bucket[candidate]
+                diff = abs(trophies - searcher.trophies)
+                if user_id != searcher.user_id and diff < best_diff:
+                    best, best_diff = user_id, diff
+        
+        return self.searchers.get(best) if best is not None else None
+    
+    def window(self, searcher, now):
+        waited = now - searcher.joined
+        return min(self.max_window, self.base_window + int(waited * self.widen_per_second))
+    
+    def tick(self):
+        """
+        Повторный поиск для ожидающих игроков (самые давние первыми) с расширенным окном
+        Returns: (список пар, список игроков с истекшим ожиданием)
+        """
+        now = time.monotonic()
+        pairs = []
+        expired = []
+        
+        for user_id in list(self.searchers):
+            searcher = self.searchers.get(user_id)
+            if searcher is None:
+                continue
+            
+            if now - searcher.joined > self.timeout:
+                expired.append(self.remove(user_id))
+                continue
+            
+            opponent = self.find_opponent(searcher, self.window(searcher, now))
+            if opponent:
+                self.remove(user_id)
+                self.remove(opponent.user_id)
+                pairs.append((searcher, opponent))
+        
+        return pairs, expired
+
+class MatchmakingService:
+    """Очередь поиска соперника внутри процесса бота с уведомлениями и записью матчей"""
+    
+    def __init__(self, db, cr_api, matchmaker=None, tick_interval=1.0):
+        self.db = db
+        self.cr_api = cr_api
+        self.matchmaker = matchmaker or Matchmaker()
+        self.tick_interval = tick_interval
+        self.bot = None
+    
+    async def join(self, user, bot):
+        """
+        Поставить пользователя в очередь
+        Returns: id матча, если соперник нашелся сразу, иначе None
+        """
+        self.bot = bot
+        searcher = Searcher(user['user_id'], user['player_tag'], await self.get_trophies(user))
+        opponent = self.matchmaker.add(searcher)
+        
+        if opponent:
+            return await self.create_match(opponent, searcher)
+        return None
+    
+    def leave(self, user_id):
+        return self.matchmaker.remove(user_id) is not None
+    
+    async def get_trophies(self, user):
+        """Трофеи из сохраненного профиля, иначе из API"""
+        snapshot = self.db.get_player_snapshot(user['player_tag'])
+        if snapshot:
+            return snapshot['trophies']
+        
+        player_data = await asyncio.to_thread(self.cr_api.get_player, user['player_tag'])
+        if not player_data:
+            raise LookupError('Player not found')
+        
+        self.db.save_player_snapshot(user['player_tag'], user['user_id'], player_data)
+        return player_data.get('trophies', 0)
+    
+    async def create_match(self, first, second):
+        """Записать матч и уведомить обоих игроков"""
+        match_id = self.db.create_match(first, second)
+        
+        for player, opponent in ((first, second), (second, first)):
+            try:
+                await self.bot.send_message(
+                    player.user_id,
+                    f"⚔️ Соперник найден!\n\n"
+                    f"🎮 Тег соперника: <code>{opponent.player_tag}</code>\n"
+                    f"🏆 Трофеи: {opponent.trophies}\n\n"
+                    f"Добавь соперника в друзья, сыграй дружеский бой и нажми /matchverify",
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                logger.error(f"Failed to notify {player.user_id} about match {match_id}: {e}")
+        
+        logger.info(f"Match {match_id}: {first.user_id} vs {second.user_id}")
+        return match_id
+    
+    async def run(self, bot):
+        """Периодический поиск пар для ожидающих игроков"""
+        self.bot = bot
+        
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            
+            pairs, expired = self.matchmaker.tick()
+            
+            for first, second in pairs:
+                await self.create_match(first, second)
+            
+            for searcher in expired:
+                try:
+                    await bot.send_message(searcher.user_id, "😔 Соперник не найден. Попробуй еще раз: /find")
+                except Exception as e:
+                    logger.error(f"Failed to notify {searcher.user_id}: {e}")
@@ -0,0 +1,168 @@
+"""
+Мета: компактное хранение колод и статистика по картам и колодам.
+
+Колода хранится в games.deck как отсортированный массив id карт
+фиксированной ширины (8 × uint32 = 32 байта), поэтому одинаковые колоды
+дают одинаковые байты и колоду можно использовать как ключ.
+
+Для /meta ведутся помесячные агрегаты card_stats и deck_stats, которые
+add_game обновляет на лету. Полный пересчет агрегатов по всем играм
+(например, после загрузки старых данных) делается векторно через numpy,
+если он установлен:
+    python meta.py rebuild
+    python meta.py rebuild --month 2026-09
+"""
+import argparse
+from array import array
+from collections import defaultdict
+from datetime import datetime
+
+DECK_SIZE = 8
+
+# Сколько колод агрегировать за один проход при пересчете
+REBUILD_CHUNK = 100000
+
+def pack_deck(card_ids):
+    """Список id карт -> 32 байта (отсортированный uint32[8]) или None, если колода неполная"""
+    ids = sorted(card_id for card_id in card_ids if card_id)
+    if len(ids) != DECK_SIZE:
+        return None
+    return array('I', ids).tobytes()
+
+def unpack_deck(blob):
+    """32 байта -> список id карт"""
+    ids = array('I')
+    ids.frombytes(blob)
+    return ids.tolist()
+
+def aggregate_decks(decks, wins):
+    """
+    Игры и победы по картам и по колодам.
+    decks: список упакованных колод, wins: список 0/1 той же длины
+    Returns: ({card_id: [games, wins]}, {deck: [games, wins]})
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return aggregate_decks_python(decks, wins)
+    
+    if not decks:
+        return {}, {}
+    
+    matrix = np.frombuffer(b''.join(decks), dtype=np.uint32).reshape(-1, DECK_SIZE)
+    won = np.asarray(wins, dtype=np.int64)
+    
+    # Карты: одна строка на колоду, победа колоды засчитывается каждой ее карте
+    card_ids, card_index = np.unique(matrix, return_inverse=True)
+    card_index = card_index.reshape(-1)
+    card_games = np.bincount(card_index, minlength=len(card_ids))
+    card_wins = np.bincount(card_index, weights=np.repeat(won, DECK_SIZE), minlength=len(card_ids))
+    
+    # Колоды: уникальные строки матрицы
+    unique_decks, deck_index, deck_games = np.unique(matrix, axis=0, return_inverse=True, return_counts=True)
+    deck_wins = np.bincount(deck_index.reshape(-1), weights=won, minlength=len(unique_decks))
+    
+    cards = {int(c): [int(g), int(w)] for c, g, w in zip(card_ids, card_games, card_wins)}
+    deck_totals = {
+        row.astype(np.uint32).tobytes(): [int(g), int(w)]
+        for row, g, w in zip(unique_decks, deck_games, deck_wins)
+    }
+    return cards, deck_totals
+
+def aggregate_decks_python(decks, wins):
+    """То же, что aggregate_decks, без numpy"""
+    cards = defaultdict(lambda: [0, 0])
+    deck_totals = defaultdict(lambda: [0, 0])
+    
+    for deck, won in zip(decks, wins):
+        totals = deck_totals[deck]
+        totals[0] += 1
+        totals[1] += won
+        for card_id in unpack_deck(deck):
+            cards[card_id][0] += 1
+            cards[card_id][1] += won
+    
+    return dict(cards), dict(deck_totals)
+
+def merge_totals(target, source):
+    for key, (games, wins) in source.items():
+        totals = target.setdefault(key, [0, 0])
+        totals[0] += games
+        totals[1] += wins
+
+def rebuild_month(db, month):
+    """
+    Пересчитать card_stats и deck_stats месяца по всем играм (горячим и архивным)
+    Returns: количество учтенных колод
+    """
+    cards, deck_totals = {}, {}
+    decks, wins = [], []
+    count = 0
+    
+    def flush():
+        chunk_cards, chunk_decks = aggregate_decks(decks, wins)
+        merge_totals(cards, chunk_cards)
+        merge_totals(deck_totals, chunk_decks)
+        decks.clear()
+        wins.clear()
+    
+    for row in db.iter_decks(month):
+        decks.append(row['deck'])
+        wins.append(1 if row['result'] == 'win' else 0)
+        count += 1
+        if len(decks) >= REBUILD_CHUNK:
+            flush()
+    if decks:
+        flush()
+    
+    db.replace_meta_stats(month, cards, deck_totals)
+    return count
+
+def build_meta(db, month=None, limit=10, min_deck_games=5):
+    """
+    Отчет по мете месяца из агрегатов: популярные карты и лучшие колоды
+    Returns: dict с total, cards и decks
+    """
+    month = month or datetime.now().strftime('%Y-%m')
+    total = db.count_deck_games(month)
+    names = db.get_card_names()
+    
+    cards = [
+        {
+            'card_id': row['card_id'],
+            'name': names.get(row['card_id'], str(row['card_id'])),
+            'usage': row['games'] / total * 100 if total else 0,
+            'winrate': row['wins'] / row['games'] * 100 if row['games'] else 0
+        }
+        for row in db.get_card_stats(month, limit)
+    ]
+    
+    decks = [
+        {
+            'cards': [names.get(card_id, str(card_id)) for card_id in unpack_deck(row['deck'])],
+            'games': row['games'],
+            'winrate': row['wins'] / row['games'] * 100
+        }
+        for row in db.get_deck_stats(month, limit, min_deck_games)
+    ]
+    
+    return {'month': month, 'total': total, 'cards': cards, 'decks': decks}
+
+def main():
+    import config
+    from database import Database
+    
+    parser = argparse.ArgumentParser(description='Пересчет статистики колод')
+    parser.add_argument('command', choices=('rebuild',))
+    parser.add_argument('--month', help='Месяц в формате YYYY-MM, по умолчанию все месяцы')
+    args = parser.parse_args()
+    
+    db = Database(config.DATABASE_PATH, config.ARCHIVE_DATABASE_PATH)
+    months = [args.month] if args.month else db.get_deck_months()
+    
+    for month in months:
+        count = rebuild_month(db, month)
+        print(f"✅ {month}: учтено колод {count}")
+
+if __name__ == '__main__':
+    main()
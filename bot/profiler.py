@@ -0,0 +1,137 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+class StackSampler:
+    """Фоновый поток, который снимает стек потока event loop, пока есть апдейты в обработке"""
+    
+    def __init__(self, interval_ms=5, max_samples=20000, max_depth=64):
+        self.interval = interval_ms / 1000
+        self.max_depth = max_depth
+        self.thread_id = threading.get_ident()
+        self.samples = deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            
+            # Без апдейтов в обработке ничего не снимаем
+            if not self.active:
+                continue
+            
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            
+            with self.lock:
+                self.samples.append((time.perf_counter(), tuple(reversed(stack))))
+    
+    def collect(self, since, until):
+        """Свернутые стеки за интервал: {стек: число сэмплов}"""
+        with self.lock:
+            samples = list(self.samples)
+        return Counter(stack for ts, stack in samples if since <= ts <= until)
+
+class SlowUpdateProfiler(BaseMiddleware):
+    """
+    Сохраняет стек-трейсы апдейтов, которые обрабатывались дольше порога.
+    На быстрых апдейтах стоит два вызова perf_counter.
+    """
+    
+    def __init__(self, threshold_ms, profile_dir, interval_ms=5, max_files=200):
+        self.threshold = threshold_ms / 1000
+        self.profile_dir = profile_dir
+        self.max_files = max_files
+        self.sampler = StackSampler(interval_ms)
+        self.sampler.start()
+        os.makedirs(profile_dir, exist_ok=True)
+    
+    async def __call__(self, handler, event: Update, data):
+        self.sampler.active += 1
+        started = time.perf_counter()
+        
+        try:
+            return await handler(event, data)
+        finally:
+            finished = time.perf_counter()
+            concurrent = self.sampler.active
+            self.sampler.active -= 1
+            
+            if finished - started >= self.threshold:
+                try:
+                    self.dump(event, started, finished, concurrent)
+                except OSError as e:
+                    logger.error(f"Failed to write profile: {e}")
+    
+    def describe(self, event: Update):
+        """Имя команды и id пользователя для имени файла"""
+        user = getattr(event.event, 'from_user', None)
+        user_id = user.id if user else 0
+        
+        if event.message and event.message.text and event.message.text.startswith('/'):
+            command = event.message.text.split()[0][1:].split('@')[0]
+        elif event.callback_query:
+            command = f"cb_{event.callback_query.data}"
+        else:
+            command = event.event_type
+        
+        command = ''.join(c if c.isalnum() or c in '_-' else '_' for c in command)[:32]
+        return command, user_id
+    
+    def dump(self, event, started, finished, concurrent):
+        """Записать трейс медленного апдейта и удалить самые старые файлы"""
+        command, user_id = self.describe(event)
+        duration_ms = int((finished - started) * 1000)
+        stacks = self.sampler.collect(started, finished)
+        
+        filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{command}_{user_id}_{duration_ms}ms.txt"
+        path = os.path.join(self.profile_dir, filename)
+        
+        # Собственное время функций — верхний кадр каждого сэмпла
+        own = Counter()
+        for stack, count in stacks.items():
+            if stack:
+                own[stack[-1]] += count
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# update {event.update_id}: /{command} user {user_id}\n")
+            f.write(f"# duration: {duration_ms} ms, samples: {sum(stacks.values())}, "
+                    f"concurrent updates: {concurrent}\n")
+            f.write("# top frames:\n")
+            for frame, count in own.most_common(20):
+                f.write(f"#   {count:>5}  {frame}\n")
+            f.write("# collapsed stacks (flamegraph.pl):\n")
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        
+        logger.warning(f"Slow update /{command} from {user_id}: {duration_ms} ms, profile: {path}")
+        self.rotate()
+    
+    def rotate(self):
+        files = sorted(
+            (os.path.join(self.profile_dir, name) for name in os.listdir(self.profile_dir) if name.endswith('.txt')),
+            key=os.path.getmtime
+        )
+        for path in files[:max(0, len(files) - self.max_files)]:
+            os.remove(path)
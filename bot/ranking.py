@@ -0,0 +1,128 @@
+"""
+Рейтинг текущего месяца в памяти процесса (RANKING_ENGINE=1).
+
+Вместо списков строк из БД рейтинг хранится в типизированных массивах:
+    user_ids, points — по слоту игрока (int64, порядок добавления)
+    by_id            — слоты по возрастанию user_id (поиск игрока бинпоиском)
+    order            — слоты по месту: очки по убыванию, при равенстве меньший user_id
+Это около 24 байт на игрока, миллион игроков — ~24 МБ.
+
+Топ-k — срез order, место и окно "вокруг меня" — бинпоиск по order,
+начисление очков сдвигает только участок order между старым и новым местом.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+
+class RankingEngine:
+    def __init__(self):
+        # Запись в БД и обновление рейтинга идут под этой блокировкой (см. Database.commit_points),
+        # чтобы перезагрузка не потеряла и не удвоила начисление
+        self.lock = threading.RLock()
+        self.month = None
+        self.clear()
+    
+    def clear(self):
+        self.user_ids = array('q')
+        self.points = array('q')
+        self.by_id = array('I')
+        self.order = array('I')
+    
+    def load(self, month, rows):
+        """
+        Заполнить рейтинг месяца.
+        rows: (user_id, points), уже отсортированные по месту
+        """
+        with self.lock:
+            rows = list(rows)
+            self.user_ids = array('q', [row[0] for row in rows])
+            self.points = array('q', [row[1] for row in rows])
+            del rows
+            
+            self.order = array('I', range(len(self.user_ids)))
+            self.by_id = array('I', sorted(range(len(self.user_ids)), key=self.user_ids.__getitem__))
+            self.month = month
+    
+    def __len__(self):
+        return len(self.order)
+    
+    def key(self, slot):
+        return (-self.points[slot], self.user_ids[slot])
+    
+    def find_slot(self, user_id):
+        index = bisect_left(self.by_id, user_id, key=self.user_ids.__getitem__)
+        if index < len(self.by_id) and self.user_ids[self.by_id[index]] == user_id:
+            return self.by_id[index]
+        return None
+    
+    def position(self, slot):
+        """Индекс слота в order (место - 1)"""
+        return bisect_left(self.order, self.key(slot), key=self.key)
+    
+    def add_user(self, user_id, points=0):
+        with self.lock:
+            if self.find_slot(user_id) is not None:
+                return
+            
+            slot = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.points.append(points)
+            self.by_id.insert(bisect_left(self.by_id, user_id, key=self.user_ids.__getitem__), slot)
+            self.order.insert(self.position(slot), slot)
+    
+    def add_points(self, user_id, delta):
+        """Начислить (или списать) очки; игроки вне рейтинга месяца игнорируются"""
+        with self.lock:
+            slot = self.find_slot(user_id)
+            if slot is None or not delta:
+                return
+            
+            old = self.position(slot)
+            self.points[slot] += delta
+            order = self.order
+            
+            if delta > 0:
+                new = bisect_left(order, self.key(slot), 0, old, key=self.key)
+                order[new + 1:old + 1] = order[new:old]
+            else:
+                new = bisect_left(order, self.key(slot), old + 1, len(order), key=self.key) - 1
+                order[old:new] = order[old + 1:new + 1]
+            order[new] = slot
+    
+    def top(self, limit):
+        """[(user_id, points)] первых limit мест"""
+        with self.lock:
+            return [(self.user_ids[slot], self.points[slot]) for slot in self.order[:limit]]
+    
+    def rank(self, user_id):
+        """
+        Место игрока
+        Returns: dict с position, players, points и percentile (доля игроков ниже, %) или None
+        """
+        with self.lock:
+            slot = self.find_slot(user_id)
+            if slot is None:
+                return None
+            
+            position = self.position(slot) + 1
+            players = len(self.order)
+            return {
+                'position': position,
+                'players': players,
+                'points': self.points[slot],
+                'percentile': (players - position) / players * 100
+            }
+    
+    def around(self, user_id, radius=2):
+        """[(место, user_id, points)] — игрок и по radius соседей сверху и снизу"""
+        with self.lock:
+            slot = self.find_slot(user_id)
+            if slot is None:
+                return []
+            
+            start = max(0, self.position(slot) - radius)
+            window = self.order[start:start + 2 * radius + 1]
+            return [
+                (start + offset + 1, self.user_ids[other], self.points[other])
+                for offset, other in enumerate(window)
+            ]
@@ -0,0 +1,306 @@
+"""
+Рейтинг силы игроков по Glicko-2 (в дополнение к очкам, которые копятся за количество игр).
+
+Рейтинг ведется по тегам игроков, включая незарегистрированных соперников,
+и только по боям 1 на 1. Каждый новый бой при записи попадает в rating_queue
+(одна строка на бой, даже если его засчитали оба игрока), а раз в рейтинговый
+период (RATING_PERIOD_HOURS) очередь обрабатывается пачкой: все бои периода
+считаются против рейтингов соперников на начало периода, как того требует Glicko-2.
+Бои, помеченные как фарм (battles.flagged), не учитываются.
+
+Полный пересчет по всей истории (горячие и архивные игры) считает периоды
+векторно через numpy, если он установлен:
+    python rating.py rebuild
+"""
+import argparse
+import math
+import time
+from array import array
+from itertools import groupby
+
+# Шкала Glicko-2 и параметры по умолчанию
+SCALE = 173.7178
+DEFAULT_RATING = 1500
+DEFAULT_RD = 350
+DEFAULT_VOLATILITY = 0.06
+
+# Ограничение изменения волатильности и точность ее подбора
+TAU = 0.5
+EPSILON = 0.000001
+
+MAX_PHI = DEFAULT_RD / SCALE
+
+# Результат боя для игрока
+RESULT_SCORES = {'win': 1.0, 'draw': 0.5, 'loss': 0.0}
+
+def rating_pair(pair_key, opponent_tag):
+    """(тег игрока, тег соперника) для боя 1 на 1, иначе None"""
+    tags = pair_key.split('|') if pair_key else []
+    if len(tags) != 2 or opponent_tag not in tags:
+        return None
+    player_tag = tags[1] if tags[0] == opponent_tag else tags[0]
+    return player_tag, opponent_tag
+
+def current_period(period_hours):
+    """Номер текущего рейтингового периода (периоды отсчитываются от 1970-01-01 UTC)"""
+    return int(time.time() // (period_hours * 3600))
+
+class Ratings:
+    """Рейтинги игроков в массивах шкалы Glicko-2; индекс игрока — позиция в tags"""
+    
+    def __init__(self, rows=()):
+        self.tags = []
+        self.index = {}
+        self.mu = array('d')
+        self.phi = array('d')
+        self.sigma = array('d')
+        self.games = array('q')
+        self.last = array('q')
+        
+        for row in rows:
+            self.add(row['player_tag'], row['rating'], row['rd'], row['volatility'], row['games'], row['period'])
+    
+    def add(self, tag, rating=DEFAULT_RATING, rd=DEFAULT_RD, volatility=DEFAULT_VOLATILITY, games=0, period=-1):
+        self.index[tag] = len(self.tags)
+        self.tags.append(tag)
+        self.mu.append((rating - DEFAULT_RATING) / SCALE)
+        self.phi.append(rd / SCALE)
+        self.sigma.append(volatility)
+        self.games.append(games)
+        self.last.append(period)
+        return self.index[tag]
+    
+    def get_index(self, tag):
+        """Индекс игрока, новичок получает рейтинг по умолчанию"""
+        index = self.index.get(tag)
+        return self.add(tag) if index is None else index
+    
+    def rows(self, indexes=None):
+        """Строки для player_ratings: (player_tag, rating, rd, volatility, games, period)"""
+        return [
+            (
+                self.tags[i],
+                self.mu[i] * SCALE + DEFAULT_RATING,
+                self.phi[i] * SCALE,
+                self.sigma[i],
+                self.games[i],
+                self.last[i]
+            )
+            for i in (range(len(self.tags)) if indexes is None else indexes)
+        ]
+
+def rate_period(ratings, first, second, score, period, tau=TAU):
+    """
+    Один рейтинговый период Glicko-2 (ratings изменяется на месте).
+    first, second — индексы игроков каждого боя, score — результат для first (1 / 0.5 / 0)
+    Returns: индексы игроков, сыгравших в периоде
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return rate_period_python(ratings, first, second, score, period, tau)
+    
+    if not len(first):
+        return []
+    
+    mu = np.frombuffer(ratings.mu)
+    phi = np.frombuffer(ratings.phi)
+    sigma = np.frombuffer(ratings.sigma)
+    games = np.frombuffer(ratings.games, dtype=np.int64)
+    last = np.frombuffer(ratings.last, dtype=np.int64)
+    
+    # Каждый бой учитывается для обоих игроков
+    first = np.asarray(first, dtype=np.int64)
+    second = np.asarray(second, dtype=np.int64)
+    score = np.asarray(score, dtype=np.float64)
+    me = np.concatenate([first, second])
+    them = np.concatenate([second, first])
+    s = np.concatenate([score, 1 - score])
+    
+    players, slot = np.unique(me, return_inverse=True)
+    slot = slot.reshape(-1)
+    
+    # Неуверенность растет за периоды без игр; соперники тоже играли в этом периоде
+    idle = np.maximum(period - last[players] - 1, 0)
+    phi[players] = np.minimum(np.sqrt(phi[players] ** 2 + idle * sigma[players] ** 2), MAX_PHI)
+    
+    g = 1 / np.sqrt(1 + 3 * phi[them] ** 2 / math.pi ** 2)
+    e = 1 / (1 + np.exp(-g * (mu[me] - mu[them])))
+    v = 1 / np.bincount(slot, weights=g * g * e * (1 - e), minlength=len(players))
+    improvement = np.bincount(slot, weights=g * (s - e), minlength=len(players))
+    
+    new_sigma = volatility_numpy(np, phi[players], sigma[players], v, v * improvement, tau)
+    phi_star = np.sqrt(phi[players] ** 2 + new_sigma ** 2)
+    new_phi = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+    
+    mu[players] += new_phi ** 2 * improvement
+    phi[players] = new_phi
+    sigma[players] = new_sigma
+    games[players] += np.bincount(slot, minlength=len(players))
+    last[players] = np.maximum(last[players], period)
+    return players.tolist()
+
+def volatility_numpy(np, phi, sigma, v, delta, tau):
+    """Новая волатильность (шаг 5 Glicko-2, метод Иллинойса) сразу для всех игроков периода"""
+    a = np.log(sigma ** 2)
+    phi2 = phi ** 2
+    delta2 = delta ** 2
+    
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta2 - phi2 - v - ex) / (2 * (phi2 + v + ex) ** 2) - (x - a) / tau ** 2
+    
+    big = delta2 > phi2 + v
+    A = a.copy()
+    B = np.where(big, np.log(np.where(big, delta2 - phi2 - v, 1)), a - tau)
+    
+    low = ~big & (f(B) < 0)
+    while low.any():
+        B[low] -= tau
+        low &= f(B) < 0
+    
+    fA, fB = f(A), f(B)
+    active = np.abs(B - A) > EPSILON
+    while active.any():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            C = np.where(active, A + (A - B) * fA / (fB - fA), B)
+        fC = f(C)
+        swap = active & (fC * fB <= 0)
+        A = np.where(swap, B, A)
+        fA = np.where(swap, fB, np.where(active, fA / 2, fA))
+        B = np.where(active, C, B)
+        fB = np.where(active, fC, fB)
+        active &= np.abs(B - A) > EPSILON
+    
+    return np.exp(A / 2)
+
+def volatility(phi, sigma, v, delta, tau):
+    """То же, что volatility_numpy, для одного игрока"""
+    a = math.log(sigma ** 2)
+    
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+    
+    A = a
+    if delta ** 2 > phi ** 2 + v:
+        B = math.log(delta ** 2 - phi ** 2 - v)
+    else:
+        B = a - tau
+        while f(B) < 0:
+            B -= tau
+    
+    fA, fB = f(A), f(B)
+    while abs(B - A) > EPSILON:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2
+        B, fB = C, fC
+    
+    return math.exp(A / 2)
+
+def rate_period_python(ratings, first, second, score, period, tau=TAU):
+    """То же, что rate_period, без numpy"""
+    mu, phi, sigma = ratings.mu, ratings.phi, ratings.sigma
+    opponents = {}
+    
+    for i, j, s in zip(first, second, score):
+        opponents.setdefault(i, []).append((j, s))
+        opponents.setdefault(j, []).append((i, 1 - s))
+    
+    for i in opponents:
+        idle = max(period - ratings.last[i] - 1, 0)
+        phi[i] = min(math.sqrt(phi[i] ** 2 + idle * sigma[i] ** 2), MAX_PHI)
+    
+    # Все игроки периода считаются против рейтингов соперников на его начало
+    updates = []
+    for i, results in opponents.items():
+        variance = 0
+        improvement = 0
+        for j, s in results:
+            g = 1 / math.sqrt(1 + 3 * phi[j] ** 2 / math.pi ** 2)
+            e = 1 / (1 + math.exp(-g * (mu[i] - mu[j])))
+            variance += g * g * e * (1 - e)
+            improvement += g * (s - e)
+        
+        v = 1 / variance
+        new_sigma = volatility(phi[i], sigma[i], v, v * improvement, tau)
+        new_phi = 1 / math.sqrt(1 / (phi[i] ** 2 + new_sigma ** 2) + 1 / v)
+        updates.append((i, mu[i] + new_phi ** 2 * improvement, new_phi, new_sigma, len(results)))
+    
+    for i, new_mu, new_phi, new_sigma, played in updates:
+        mu[i], phi[i], sigma[i] = new_mu, new_phi, new_sigma
+        ratings.games[i] += played
+        ratings.last[i] = max(ratings.last[i], period)
+    
+    return list(opponents)
+
+def rate_results(ratings, results):
+    """
+    Прогнать бои по периодам по порядку.
+    results: строки (period, player_tag, opponent_tag, score), отсортированные по period
+    Returns: индексы игроков, чей рейтинг изменился
+    """
+    touched = set()
+    
+    for period, group in groupby(results, key=lambda row: row[0]):
+        first, second, score = array('q'), array('q'), array('d')
+        for _, player_tag, opponent_tag, result in group:
+            first.append(ratings.get_index(player_tag))
+            second.append(ratings.get_index(opponent_tag))
+            score.append(result)
+        touched.update(rate_period(ratings, first, second, score, period))
+    
+    return touched
+
+def process_queue(db, period_hours):
+    """
+    Обработать накопленные бои завершившихся периодов
+    Returns: количество учтенных боев
+    """
+    queued = db.get_rating_queue(current_period(period_hours))
+    if not queued:
+        return 0
+    
+    # Помеченные как фарм бои снимаются с очереди без учета
+    results = [row for row in queued if not row['flagged']]
+    tags = {row['player_tag'] for row in results} | {row['opponent_tag'] for row in results}
+    ratings = Ratings(db.get_ratings(tags))
+    touched = rate_results(
+        ratings,
+        [(row['period'], row['player_tag'], row['opponent_tag'], row['score']) for row in results]
+    )
+    
+    db.save_ratings(ratings.rows(touched), [row['fingerprint'] for row in queued])
+    return len(results)
+
+def rebuild(db, period_hours):
+    """
+    Пересчитать рейтинги по всем боям завершившихся периодов с нуля
+    Returns: (количество боев, количество игроков)
+    """
+    period = current_period(period_hours)
+    ratings = Ratings()
+    
+    rate_results(ratings, db.iter_rating_results(period_hours, period))
+    db.replace_ratings(ratings.rows(), period)
+    return sum(ratings.games) // 2, len(ratings.tags)
+
+def main():
+    import config
+    from database import Database
+    
+    parser = argparse.ArgumentParser(description='Пересчет рейтинга Glicko-2')
+    parser.add_argument('command', choices=('rebuild',))
+    parser.parse_args()
+    
+    db = Database(config.DATABASE_PATH, config.ARCHIVE_DATABASE_PATH)
+    started = time.time()
+    games, players = rebuild(db, config.RATING_PERIOD_HOURS)
+    print(f"✅ Учтено боев: {games}, игроков: {players} за {time.time() - started:.1f} с")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""
+Уровни месячных наград (config.REWARD_TIERS).
+
+Уровни проверяются по порядку, игрок получает первый подходящий:
+    {'max_place': 10, ...}  — места с 1 по 10
+    {'top_percent': 5, ...} — лучшие 5% игроков итоговой таблицы (минимум одно место)
+Остальные поля уровня (gems, gold, title) — сама награда.
+"""
+import math
+
+TIER_KEYS = ('max_place', 'top_percent')
+
+def tier_places(tier, players):
+    """Сколько первых мест покрывает уровень"""
+    if 'max_place' in tier:
+        return tier['max_place']
+    return max(1, math.ceil(players * tier['top_percent'] / 100))
+
+def max_rewarded_place(tiers, players):
+    """Последнее место, за которое положена награда"""
+    return min(players, max((tier_places(tier, players) for tier in tiers), default=0))
+
+def reward_for_place(tiers, place, players):
+    """Награда за место или None"""
+    for tier in tiers:
+        if place <= tier_places(tier, players):
+            return {key: value for key, value in tier.items() if key not in TIER_KEYS}
+    return None
@@ -1,17 +1,67 @@
+import hashlib
 import requests
 from datetime import datetime, timedelta
 import config
+from api_scheduler import INTERACTIVE, ApiTokenPool
+
+def battle_tags(battle):
+    """Отсортированные теги всех участников боя"""
+    players = battle.get('team', []) + battle.get('opponent', [])
+    return sorted(p.get('tag', '') for p in players)
+
+def battle_fingerprint(battle):
+    """
+    Детерминированный отпечаток боя: время + отсортированные теги участников.
+    Одинаков для обоих игроков, поэтому один бой нельзя засчитать дважды
+    """
+    key = f"{battle.get('battleTime')}|{','.join(battle_tags(battle))}"
+    return hashlib.sha1(key.encode()).hexdigest()
 
 class ClashRoyaleAPI:
-    def __init__(self, api_token):
-        self.api_token = api_token
+    def __init__(self, api_tokens, scheduler=None, token_rate=None, token_burst=None):
+        if isinstance(api_tokens, str):
+            api_tokens = [api_tokens]
         self.base_url = 'https://api.clashroyale.com/v1'
-        self.headers = {
-            'Authorization': f'Bearer {api_token}',
+        # Пул токенов (api_scheduler): каждый запрос идет с наименее загруженным ключом
+        self.tokens = ApiTokenPool(
+            api_tokens,
+            token_rate or config.API_RATE_LIMIT,
+            token_burst or config.API_BURST
+        )
+        # Общая очередь с приоритетами (api_scheduler), None — без ограничений
+        self.scheduler = scheduler
+    
+    def get(self, url, priority=INTERACTIVE):
+        """GET через очередь запросов с учетом приоритета"""
+        if self.scheduler is None:
+            return self.request(url)
+        
+        with self.scheduler.slot(priority):
+            return self.request(url)
+    
+    def request(self, url):
+        """GET с токеном из пула; ответ 403/429 выводит токен из ротации"""
+        entry = self.tokens.acquire()
+        headers = {
+            'Authorization': f"Bearer {entry['token']}",
             'Accept': 'application/json'
         }
+        
+        try:
+            response = requests.get(url, headers=headers, timeout=10)
+        except requests.exceptions.RequestException:
+            self.tokens.release(entry)
+            raise
+        
+        self.tokens.release(entry, response.status_code, response.headers.get('Retry-After'))
+        
+        # Общий бюджет очереди следует за числом исправных токенов
+        # (не меньше одного, чтобы очередь заметила, когда токены вернутся)
+        if self.scheduler is not None:
+            self.scheduler.set_rate(max(self.tokens.capacity(), self.tokens.rate))
+        return response
     
-    def get_player(self, player_tag):
+    def get_player(self, player_tag, priority=INTERACTIVE):
         """Получить информацию об игроке"""
         # Убираем # из тега если есть
         player_tag = player_tag.replace('#', '')
@@ -20,14 +70,14 @@ class ClashRoyaleAPI:
         url = f'{self.base_url}/players/{player_tag}'
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.get(url, priority)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error fetching player: {e}")
             return None
     
-    def get_battle_log(self, player_tag):
+    def get_battle_log(self, player_tag, priority=INTERACTIVE):
         """Получить историю боев игрока"""
         player_tag = player_tag.replace('#', '')
         player_tag = '%23' + player_tag
@@ -35,36 +85,51 @@ class ClashRoyaleAPI:
         url = f'{self.base_url}/players/{player_tag}/battlelog'
         
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.get(url, priority)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             print(f"Error fetching battle log: {e}")
             return None
     
-    def verify_battle(self, player_tag, expected_mode=None, time_window_minutes=30):
-        """
-        Проверить последнюю игру игрока
-        Returns: dict с информацией о бое или None
-        """
-        battles = self.get_battle_log(player_tag)
+    def get_clan_members(self, clan_tag, priority=INTERACTIVE):
+        """Участники клана (tag, name, lastSeen, ...) одним запросом"""
+        clan_tag = '%23' + clan_tag.replace('#', '')
         
-        if not battles or len(battles) == 0:
-            return None
+        url = f'{self.base_url}/clans/{clan_tag}/members'
         
-        # Берем последний бой
-        last_battle = battles[0]
+        try:
+            response = self.get(url, priority)
+            response.raise_for_status()
+            return response.json().get('items', [])
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching clan members: {e}")
+            return None
+    
+    def get_current_river_race(self, clan_tag, priority=INTERACTIVE):
+        """Текущая клановая война: участники с числом сыгранных колод"""
+        clan_tag = '%23' + clan_tag.replace('#', '')
         
-        # Проверяем время боя (должен быть в пределах time_window_minutes)
-        battle_time = datetime.strptime(last_battle['battleTime'], '%Y%m%dT%H%M%S.%fZ')
-        now = datetime.utcnow()
+        url = f'{self.base_url}/clans/{clan_tag}/currentriverrace'
         
-        if now - battle_time > timedelta(minutes=time_window_minutes):
-            return {'error': 'Battle too old', 'time_diff': (now - battle_time).seconds // 60}
+        try:
+            response = self.get(url, priority)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching river race: {e}")
+            return None
+    
+    def parse_battle(self, battle):
+        """
+        Разобрать бой из battlelog с точки зрения игрока (team[0])
+        Returns: dict с информацией о бое или None
+        """
+        battle_time = datetime.strptime(battle['battleTime'], '%Y%m%dT%H%M%S.%fZ')
         
         # Определяем результат и короны
-        team = last_battle.get('team', [])
-        opponent = last_battle.get('opponent', [])
+        team = battle.get('team', [])
+        opponent = battle.get('opponent', [])
         
         if not team or not opponent:
             return None
@@ -82,16 +147,45 @@ class ClashRoyaleAPI:
         else:
             result = 'draw'
         
-        battle_data = {
+        return {
             'battle_time': battle_time,
-            'game_mode': last_battle.get('type', 'unknown'),
+            'game_mode': battle.get('type', 'unknown'),
             'result': result,
             'crowns': player_crowns,
             'opponent_crowns': opponent_crowns,
             'trophies_change': player_data.get('trophyChange', 0),
-            'arena': last_battle.get('arena', {}).get('name', 'Unknown'),
-            'deck': [card.get('name') for card in player_data.get('cards', [])]
+            'arena': battle.get('arena', {}).get('name', 'Unknown'),
+            'deck': [card.get('name') for card in player_data.get('cards', [])],
+            'deck_ids': [card.get('id') for card in player_data.get('cards', [])],
+            'fingerprint': battle_fingerprint(battle),
+            'pair_key': '|'.join(battle_tags(battle)),
+            'opponent_tag': opponent_data.get('tag')
         }
+    
+    def verify_battle(self, player_tag, expected_mode=None, time_window_minutes=30):
+        """
+        Проверить последнюю игру игрока
+        Returns: dict с информацией о бое или None
+        """
+        battles = self.get_battle_log(player_tag)
+        
+        if not battles or len(battles) == 0:
+            return None
+        
+        # Берем последний бой
+        last_battle = battles[0]
+        
+        # Проверяем время боя (должен быть в пределах time_window_minutes)
+        battle_time = datetime.strptime(last_battle['battleTime'], '%Y%m%dT%H%M%S.%fZ')
+        now = datetime.utcnow()
+        
+        if now - battle_time > timedelta(minutes=time_window_minutes):
+            return {'error': 'Battle too old', 'time_diff': (now - battle_time).seconds // 60}
+        
+        battle_data = self.parse_battle(last_battle)
+        
+        if not battle_data:
+            return None
         
         # Проверка режима если указан
         if expected_mode and battle_data['game_mode'] != expected_mode:
@@ -99,6 +193,24 @@ class ClashRoyaleAPI:
         
         return battle_data
     
+    def find_battle_against(self, player_tag, opponent_tag, since):
+        """
+        Найти в battlelog игрока бой против конкретного соперника после since (UTC)
+        Returns: dict с информацией о бое или None
+        """
+        battles = self.get_battle_log(player_tag) or []
+        
+        for battle in battles:
+            opponent_tags = {p.get('tag') for p in battle.get('opponent', [])}
+            if opponent_tag not in opponent_tags:
+                continue
+            
+            battle_data = self.parse_battle(battle)
+            if battle_data and battle_data['battle_time'] >= since:
+                return battle_data
+        
+        return None
+    
     def calculate_points(self, battle_data):
         """Подсчет очков за бой"""
         points = 0
@@ -1,23 +1,36 @@
 import asyncio
+import json
 import logging
 from datetime import datetime, timedelta
+from api_scheduler import REFRESH
 from database import Database
+from ingest import ClanIngestor
+from rating import process_queue
 import config
 
 logger = logging.getLogger(__name__)
 
 class Scheduler:
-    def __init__(self, db: Database, bot):
+    def __init__(self, db: Database, bot, cr_api=None):
         self.db = db
         self.bot = bot
+        self.cr_api = cr_api
     
     async def start(self):
         """Запуск всех фоновых задач"""
         tasks = [
             self.monthly_reset_task(),
             self.monthly_rewards_task(),
-            self.daily_stats_task()
+            self.monthly_archive_task(),
+            self.daily_stats_task(),
+            self.rating_task()
         ]
+        if self.cr_api:
+            tasks.append(self.snapshot_refresh_task())
+        if self.cr_api and config.AUTO_INGEST:
+            tasks.append(self.ingest_task())
+        if self.db.replica_max_age:
+            tasks.append(self.replica_refresh_task())
         await asyncio.gather(*tasks)
     
     async def monthly_reset_task(self):
@@ -34,78 +47,190 @@ class Scheduler:
             
             await asyncio.sleep(60)  # Проверка каждую минуту
     
-    async def monthly_rewards_task(self):
-        """Выдача наград в конце месяца"""
+    async def monthly_archive_task(self):
+        """Перенос игр прошлого месяца в архив"""
         while True:
             now = datetime.now()
             
-            # Последний день месяца в 23:00
-            if now.month == 12:
-                next_month = datetime(now.year + 1, 1, 1)
-            else:
-                next_month = datetime(now.year, now.month + 1, 1)
-            
-            last_day = (next_month - timedelta(days=1)).day
+            # Первый день месяца в 01:00, после сброса очков
+            if now.day == 1 and now.hour == 1 and now.minute < 5:
+                logger.info("🗄 Archiving finished months")
+                moved = await asyncio.to_thread(self.db.archive_games)
+                logger.info(f"✅ Archived {moved} games")
+                await asyncio.sleep(300)
             
-            if now.day == last_day and now.hour == 23 and now.minute < 5:
-                logger.info("🎁 Distributing monthly rewards")
+            await asyncio.sleep(60)
+    
+    async def monthly_rewards_task(self):
+        """
+        Выдача наград за прошедший месяц.
+        Награды замораживаются по итоговой таблице один раз (после сброса очков),
+        дальше каждую минуту дорассылаются неотправленные уведомления, поэтому
+        после перезапуска задача продолжает с того места, где остановилась
+        """
+        while True:
+            try:
                 await self.distribute_rewards()
-                await asyncio.sleep(300)
+            except Exception as e:
+                logger.error(f"Reward distribution failed: {e}")
             
             await asyncio.sleep(60)
     
     async def distribute_rewards(self):
-        """Распределение наград игрокам"""
-        leaderboard = self.db.get_leaderboard(limit=100)
-        current_month = datetime.now().strftime('%Y-%m')
+        """Заморозить награды прошлого месяца и разослать неотправленные уведомления"""
+        month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
         
-        for idx, player in enumerate(leaderboard, 1):
-            reward = None
-            
-            if idx == 1:
-                reward = config.REWARDS[1]
-            elif idx == 2:
-                reward = config.REWARDS[2]
-            elif idx == 3:
-                reward = config.REWARDS[3]
-            elif idx <= 10:
-                reward = config.REWARDS['top10']
-            
-            if reward:
-                # Сохраняем награду в БД
-                self.db.save_reward(
-                    player['user_id'],
-                    current_month,
-                    idx,
-                    player['current_month_points'],
-                    reward
-                )
-                
-                # Отправляем уведомление
-                try:
-                    await self.bot.send_message(
-                        player['user_id'],
-                        f"🎉 Поздравляем!\n\n"
-                        f"Ты занял {idx} место в турнире!\n"
-                        f"🏆 {reward['title']}\n\n"
-                        f"Награды:\n"
-                        f"💎 {reward['gems']} Gems\n"
-                        f"🪙 {reward['gold']} Gold\n\n"
-                        f"⭐ Твои очки: {player['current_month_points']}"
-                    )
-                    logger.info(f"Reward sent to user {player['user_id']}")
-                except Exception as e:
-                    logger.error(f"Failed to send reward to {player['user_id']}: {e}")
+        frozen = await asyncio.to_thread(self.db.freeze_reward_payouts, month, config.REWARD_TIERS)
+        if frozen:
+            logger.info(f"🎁 Rewards for {month} frozen: {frozen} payouts")
+        
+        # За проход каждая выплата пробуется один раз, упавшие — на следующей минуте
+        attempted = set()
+        
+        while True:
+            payouts = await asyncio.to_thread(self.db.get_due_payouts, config.REWARD_MAX_ATTEMPTS)
+            payouts = [payout for payout in payouts if (payout['month'], payout['user_id']) not in attempted]
+            if not payouts:
+                break
+            
+            for payout in payouts:
+                attempted.add((payout['month'], payout['user_id']))
+                await self.send_reward(payout)
+                await asyncio.sleep(config.REWARD_SEND_DELAY)
+            
+            logger.info(f"🎁 Reward payouts {payouts[0]['month']}: {self.db.get_payout_summary(payouts[0]['month'])}")
+    
+    async def send_reward(self, payout):
+        """Уведомить игрока о награде (не больше одного раза)"""
+        if not self.db.claim_payout(payout['month'], payout['user_id']):
+            return
+        
+        reward = json.loads(payout['reward_data'])
+        
+        try:
+            await self.bot.send_message(
+                payout['user_id'],
+                f"🎉 Поздравляем!\n\n"
+                f"Ты занял {payout['place']} место в турнире за {payout['month']}!\n"
+                f"🏆 {reward['title']}\n\n"
+                f"Награды:\n"
+                f"💎 {reward['gems']} Gems\n"
+                f"🪙 {reward['gold']} Gold\n\n"
+                f"⭐ Твои очки: {payout['points']}"
+            )
+            logger.info(f"Reward sent to user {payout['user_id']}")
+        except Exception as e:
+            logger.error(f"Failed to send reward to {payout['user_id']}: {e}")
+            self.db.fail_payout(payout['month'], payout['user_id'], str(e))
     
     async def daily_stats_task(self):
-        """Ежедневная статистика (опционально)"""
+        """Ежедневная статистика в канал"""
         while True:
             now = datetime.now()
             
             # Каждый день в полдень
             if now.hour == 12 and now.minute < 5:
                 logger.info("📊 Generating daily stats")
-                # Здесь можно добавить отправку статистики в канал
+                await self.post_daily_stats()
+                self.db.prune_daily_active_users()
                 await asyncio.sleep(300)
             
             await asyncio.sleep(60)
+    
+    async def post_daily_stats(self):
+        """Сводка за вчера с динамикой за неделю (читает только дневные агрегаты)"""
+        if not config.STATS_CHANNEL_ID:
+            return
+        
+        # Дневные агрегаты ведутся по дате боя в UTC (см. Database.track_daily)
+        yesterday = (datetime.utcnow() - timedelta(days=1)).strftime('%Y-%m-%d')
+        week = [day for day in self.db.get_daily_stats(days=8) if day['day'] <= yesterday]
+        stats = next((day for day in week if day['day'] == yesterday), None)
+        
+        if not stats:
+            text = f"📊 <b>Статистика за {yesterday} (UTC)</b>\n\nЗа день не сыграно ни одной игры"
+        else:
+            previous = [day for day in week if day['day'] != yesterday]
+            avg_games = sum(day['games'] for day in previous) / 7
+            winrate = stats['wins'] / stats['games'] * 100
+            
+            text = (
+                f"📊 <b>Статистика за {yesterday} (UTC)</b>\n\n"
+                f"🎮 Игр: {stats['games']} ({self.format_trend(stats['games'], avg_games)} к среднему за неделю)\n"
+                f"👥 Игроков: {stats['active_users']}\n"
+                f"🏆 Побед: {stats['wins']} ({winrate:.1f}%)\n"
+                f"⭐ Очков начислено: {stats['points']}\n"
+            )
+            
+            modes = self.db.get_day_modes(yesterday)
+            if modes:
+                text += "\n<b>Режимы:</b>\n"
+                for mode in modes[:5]:
+                    text += f"• {mode['game_mode']}: {mode['games']} игр, {mode['active_users']} игроков\n"
+        
+        try:
+            await self.bot.send_message(config.STATS_CHANNEL_ID, text, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Failed to post daily stats: {e}")
+    
+    def format_trend(self, value, average):
+        if not average:
+            return "—"
+        change = (value - average) / average * 100
+        return f"{'📈' if change >= 0 else '📉'} {change:+.0f}%"
+    
+    async def snapshot_refresh_task(self):
+        """Фоновое обновление профилей игроков (низкий приоритет)"""
+        while True:
+            players = self.db.get_stale_snapshots(config.SNAPSHOT_MAX_AGE_MINUTES, config.SNAPSHOT_REFRESH_BATCH)
+            
+            for player in players:
+                player_data = await asyncio.to_thread(self.cr_api.get_player, player['player_tag'], REFRESH)
+                if player_data:
+                    self.db.save_player_snapshot(player['player_tag'], player['user_id'], player_data)
+                
+                # Пауза между запросами, чтобы не отъедать лимит API у команд
+                await asyncio.sleep(config.SNAPSHOT_REFRESH_DELAY)
+            
+            if players:
+                logger.info(f"🔄 Refreshed {len(players)} player snapshots")
+            
+            await asyncio.sleep(config.SNAPSHOT_REFRESH_INTERVAL)
+    
+    async def replica_refresh_task(self):
+        """Обновление реплики БД для чтения"""
+        while True:
+            try:
+                await asyncio.to_thread(self.db.refresh_replica)
+            except Exception as e:
+                logger.error(f"Failed to refresh read replica: {e}")
+            
+            await asyncio.sleep(config.READ_REPLICA_REFRESH_INTERVAL)
+    
+    async def ingest_task(self):
+        """Автосбор боев через клановые запросы"""
+        ingestor = ClanIngestor(self.db, self.cr_api)
+        
+        while True:
+            try:
+                stats = await asyncio.to_thread(ingestor.poll)
+                logger.info(
+                    f"📥 Ingest: {stats['clans']} clans, {stats['battle_logs']} battle logs, "
+                    f"{stats['skipped']} inactive skipped, {stats['games']} new games"
+                )
+            except Exception as e:
+                logger.error(f"Ingest failed: {e}")
+            
+            await asyncio.sleep(config.INGEST_INTERVAL)
+    
+    async def rating_task(self):
+        """Пересчет рейтинга Glicko-2 по боям завершившихся периодов"""
+        while True:
+            try:
+                rated = await asyncio.to_thread(process_queue, self.db, config.RATING_PERIOD_HOURS)
+                if rated:
+                    logger.info(f"🎯 Ratings updated from {rated} battles")
+            except Exception as e:
+                logger.error(f"Rating update failed: {e}")
+            
+            await asyncio.sleep(60)
@@ -0,0 +1,34 @@
+"""
+Общие объекты процесса: БД, очередь запросов к Clash Royale API, подбор соперников,
+турниры и очередь записи игр.
+
+bot.py запускается как __main__, поэтому обработчики не могут брать эти объекты
+через `from bot import ...`: такой импорт заново выполнит bot.py вторым модулем
+со своими копиями (второй подбор без фонового цикла, второй бюджет API).
+И bot.py, и handlers.py импортируют их отсюда.
+"""
+import config
+from api_scheduler import ApiRequestScheduler
+from database import Database
+from matchmaking import MatchmakingService
+from royale_api import ClashRoyaleAPI
+from tournament import TournamentEngine
+from write_queue import GameWriteQueue
+
+db = Database(
+    config.DATABASE_PATH,
+    config.ARCHIVE_DATABASE_PATH,
+    config.READ_REPLICA_MAX_AGE,
+    config.RANKING_ENGINE
+)
+api_scheduler = ApiRequestScheduler(
+    config.API_RATE_LIMIT * len(config.CLASH_ROYALE_API_TOKENS),
+    config.API_BURST * len(config.CLASH_ROYALE_API_TOKENS),
+    {priority: limit * len(config.CLASH_ROYALE_API_TOKENS) for priority, limit in config.API_CONCURRENCY.items()},
+    config.API_QUEUE_TIMEOUT,
+    config.API_INTERACTIVE_RESERVE
+)
+cr_api = ClashRoyaleAPI(config.CLASH_ROYALE_API_TOKENS, api_scheduler)
+matchmaking = MatchmakingService(db, cr_api)
+tournaments = TournamentEngine(db, cr_api)
+game_writes = GameWriteQueue(db)
@@ -0,0 +1,105 @@
+"""
+Запуск бота так же, как в проде (`python bot.py`, модуль __main__).
+
+Проверяет, что обработчики и фоновые задачи из main() работают с одними
+и теми же объектами: игрок из /find попадает в очередь, которую обслуживает
+цикл подбора, запущенный в main(), и этот цикл снимает его по таймауту.
+Сеть не нужна: опрос Telegram подменяется прогоном апдейтов через диспетчер,
+исходящие запросы записывает фейковая сессия из loadtest.py.
+"""
+import asyncio
+import os
+import runpy
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BOT_DIR = Path(__file__).resolve().parents[1]
+
+USER_ID = 10_000_001
+
+def test_main_shares_singletons_with_handlers(tmp_path):
+    env = dict(os.environ, BOT_TOKEN='123456:TEST', RANKING_ENGINE='1', PYTHONPATH=str(BOT_DIR))
+    result = subprocess.run(
+        [sys.executable, __file__],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'OK' in result.stdout
+
+def run_bot():
+    """Выполнить bot.py как __main__ с подмененным опросом Telegram"""
+    from aiogram import Dispatcher
+    from aiogram.methods import AnswerCallbackQuery, SendMessage
+    
+    import services
+    from loadtest import RecordingSession, build_update
+    
+    # Быстрый цикл подбора, чтобы проверить снятие по таймауту за доли секунды
+    services.matchmaking.tick_interval = 0.01
+    services.matchmaking.matchmaker.timeout = 0.1
+    
+    class TextSession(RecordingSession):
+        def __init__(self):
+            super().__init__()
+            self.sent = []
+        
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, SendMessage):
+                self.sent.append((method.chat_id, method.text))
+            if isinstance(method, AnswerCallbackQuery):
+                self.sent.append((None, method.text))
+            return await super().make_request(bot, method, timeout)
+    
+    checks = []
+    
+    async def fake_polling(dp, bot, **kwargs):
+        session = TextSession()
+        bot.session = session
+        
+        services.db.register_user(USER_ID, 'user', 'User', '#FIND1')
+        services.db.save_player_snapshot('#FIND1', USER_ID, {'name': 'User', 'trophies': 5000})
+        
+        await dp.feed_update(bot, build_update(bot, 1, USER_ID, '/find'))
+        checks.append(('queued', USER_ID in services.matchmaking.matchmaker))
+        
+        deadline = time.monotonic() + 5
+        while USER_ID in services.matchmaking.matchmaker and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        
+        checks.append(('expired', USER_ID not in services.matchmaking.matchmaker))
+        checks.append(('notified', any(
+            chat_id == USER_ID and 'Соперник не найден' in text for chat_id, text in session.sent
+        )))
+        checks.append(('loop bot', services.matchmaking.bot is bot))
+        checks.append(('single import', 'bot' not in sys.modules))
+        
+        # Очки, записанные очередью из bot.py (как в /verify), видны в рейтинге кнопки "мое место"
+        battle = {
+            'battle_time': datetime.utcnow().isoformat(), 'game_mode': 'Ladder',
+            'result': 'win', 'crowns': 1, 'opponent_crowns': 0
+        }
+        await dp.feed_update(bot, build_update(bot, 2, USER_ID, 'cb:my_rank'))
+        await sys.modules['__main__'].game_writes.add_game(USER_ID, battle, 10)
+        session.sent.clear()
+        await dp.feed_update(bot, build_update(bot, 3, USER_ID, 'cb:my_rank'))
+        checks.append(('ranking', any(
+            chat_id is None and 'Очки: 10' in (text or '') for chat_id, text in session.sent
+        )))
+    
+    Dispatcher.start_polling = fake_polling
+    sys.argv = [str(BOT_DIR / 'bot.py')]
+    main_globals = runpy.run_path(str(BOT_DIR / 'bot.py'), run_name='__main__')
+    
+    # Один бюджет запросов к API на весь процесс: 429/403 одного ключа видят все обработчики
+    checks.append(('one api', main_globals['cr_api'] is services.cr_api))
+    checks.append(('one scheduler', services.cr_api.scheduler is services.api_scheduler))
+    
+    failed = [name for name, ok in checks if not ok]
+    assert len(checks) == 8 and not failed, failed
+    print('OK')
+
+if __name__ == '__main__':
+    run_bot()
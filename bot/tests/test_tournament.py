@@ -0,0 +1,78 @@
+"""Пары сетки на выбывание: bye в нижней сетке не должен доставаться одному игроку повторно"""
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tournament import MAX_LOSSES, assign_slots, elimination_pairings, first_round_pairings
+
+def entrant(user_id, slot, wins=0, losses=0, byes=0):
+    return {'user_id': user_id, 'seed': user_id, 'slot': slot, 'wins': wins, 'losses': losses, 'byes': byes}
+
+def test_odd_losers_bracket_skips_player_with_bye():
+    entrants = [
+        entrant(1, 0, wins=2, losses=0),
+        entrant(2, 1, wins=2, losses=1),
+        entrant(3, 2, wins=1, losses=1),
+        # Самое низкое место, но bye уже был
+        entrant(4, 3, wins=0, losses=1, byes=1)
+    ]
+    
+    pairings = elimination_pairings(entrants, MAX_LOSSES['double'])
+    
+    assert ('L', 2, 4) in pairings
+    assert ('L', 3, None) in pairings
+
+def test_odd_losers_bracket_all_had_byes_falls_back_to_last():
+    entrants = [
+        entrant(1, 0, wins=2, losses=0),
+        entrant(2, 1, wins=2, losses=1, byes=1),
+        entrant(3, 2, wins=1, losses=1, byes=1),
+        entrant(4, 3, wins=0, losses=1, byes=1)
+    ]
+    
+    pairings = elimination_pairings(entrants, MAX_LOSSES['double'])
+    
+    assert ('L', 2, 3) in pairings
+    assert ('L', 4, None) in pairings
+
+def simulate(size, rng):
+    """Double elimination со случайными исходами; Returns: [(участник, были ли в его сетке игроки без bye)]"""
+    entrants = {
+        user_id: entrant(user_id, slot)
+        for user_id, _, slot in assign_slots([{'user_id': i} for i in range(1, size + 1)])
+    }
+    pairings = first_round_pairings(list(entrants.values()))
+    repeated = []
+    rounds = 0
+    
+    while pairings:
+        rounds += 1
+        assert rounds < 4 * size
+        
+        for bracket, first, second in pairings:
+            if second is not None:
+                winner, loser = (first, second) if rng.random() < 0.5 else (second, first)
+                entrants[winner]['wins'] += 1
+                entrants[loser]['losses'] += 1
+                continue
+            
+            if entrants[first]['byes'] and bracket == 'L':
+                others = [
+                    user_id for other_bracket, a, b in pairings if other_bracket == bracket
+                    for user_id in (a, b) if user_id not in (None, first)
+                ]
+                repeated.append((first, any(not entrants[u]['byes'] for u in others)))
+            entrants[first]['byes'] += 1
+        
+        pairings = elimination_pairings(list(entrants.values()), MAX_LOSSES['double'])
+    
+    return repeated
+
+def test_double_elimination_byes_rotate():
+    rng = random.Random(1)
+    for size in range(3, 17):
+        for _ in range(50):
+            for user_id, others_without_bye in simulate(size, rng):
+                assert not others_without_bye, (size, user_id)
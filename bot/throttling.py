@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import Message
+
+# Куда складывать ответ, который сейчас отправляет обработчик дорогой команды
+_captured_reply = ContextVar('captured_reply', default=None)
+
+# Правило, по которому ограничен текущий апдейт (None — апдейт обработан), для loadtest.py
+throttled = ContextVar('throttled', default=None)
+
+class TokenBucket:
+    """Корзина токенов: burst запросов сразу, дальше по одному раз в period / burst секунд"""
+    __slots__ = ('tokens', 'updated')
+    
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    def consume(self, burst, period):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * burst / period)
+        self.updated = now
+        
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def wait_time(self, burst, period):
+        """Секунд до появления следующего токена"""
+        return max(0, (1 - self.tokens) * period / burst)
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение частоты дорогих команд на пользователя.
+    Если токенов нет, пользователь получает последний посчитанный ответ
+    вместо повторных запросов к API и БД.
+    Правило может относиться к команде ('verify') или к состоянию FSM
+    ('Registration:waiting_for_tag') — тогда ограничиваются сообщения в этом состоянии.
+    """
+    
+    def __init__(self, rules, max_entries=100000):
+        # rules: {'verify': (burst, period_seconds), 'Registration:waiting_for_tag': (...), ...}
+        self.rules = rules
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.replies = OrderedDict()
+    
+    async def __call__(self, handler, event: Message, data):
+        command = self.get_command(event) or data.get('raw_state')
+        if command not in self.rules or not event.from_user:
+            return await handler(event, data)
+        
+        burst, period = self.rules[command]
+        key = (event.from_user.id, command)
+        
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(burst)
+        self.remember(self.buckets, key, bucket)
+        
+        if bucket.consume(burst, period):
+            reply = {}
+            token = _captured_reply.set(reply)
+            try:
+                return await handler(event, data)
+            finally:
+                _captured_reply.reset(token)
+                if reply:
+                    self.remember(self.replies, key, reply)
+        
+        throttled.set(command)
+        cached = self.replies.get(key)
+        if cached:
+            await event.answer(
+                cached['text'] + "\n\n♻️ Повтор последнего ответа, подожди немного",
+                parse_mode=cached['parse_mode'],
+                reply_markup=cached['reply_markup']
+            )
+        else:
+            await event.answer(f"⏳ Слишком часто! Попробуй через {bucket.wait_time(burst, period):.0f} сек.")
+    
+    def get_command(self, event: Message):
+        if not event.text or not event.text.startswith('/'):
+            return None
+        return event.text.split()[0][1:].split('@')[0].lower()
+    
+    def remember(self, storage, key, value):
+        """Положить значение в LRU-словарь с ограничением размера"""
+        storage[key] = value
+        storage.move_to_end(key)
+        while len(storage) > self.max_entries:
+            storage.popitem(last=False)
+
+class ReplyCaptureMiddleware(BaseRequestMiddleware):
+    """Запоминает последний текст, отправленный обработчиком дорогой команды"""
+    
+    async def __call__(self, make_request, bot, method):
+        reply = _captured_reply.get()
+        
+        if reply is not None and isinstance(method, (SendMessage, EditMessageText)) and method.text:
+            reply['text'] = method.text
+            reply['parse_mode'] = method.parse_mode
+            reply['reply_markup'] = method.reply_markup
+        
+        return await make_request(bot, method)
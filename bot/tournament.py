@@ -0,0 +1,292 @@
+import math
+from datetime import datetime
+
+FORMATS = {
+    'single': 'Single Elimination',
+    'double': 'Double Elimination',
+    'swiss': 'Swiss',
+    'points': 'Points League'
+}
+
+# Очки за победу (и за bye) и за ничью
+WIN_POINTS = 1
+DRAW_POINTS = 0.5
+
+# Сколько поражений выбивает из турнира (0 — не выбывают)
+MAX_LOSSES = {'single': 1, 'double': 2, 'swiss': 0, 'points': 0}
+
+# Сколько ближайших по таблице соперников перебирать при поиске пары без повторной встречи
+SWISS_LOOKAHEAD = 16
+
+def bracket_order(size):
+    """
+    Порядок посевов в сетке на size мест (size — степень двойки):
+    1 и 2 сеяные встречаются только в финале
+    """
+    order = [1]
+    while len(order) < size:
+        total = len(order) * 2 + 1
+        order = [seed for first in order for seed in (first, total - first)]
+    return order
+
+def assign_slots(entrants):
+    """
+    Посев по трофеям: entrants отсортированы от сильного к слабому.
+    Returns: список (user_id, seed, slot), слоты с посевом > числа участников — пустые (bye)
+    """
+    size = 1 << max(1, math.ceil(math.log2(max(len(entrants), 2))))
+    slot_of_seed = {seed: slot for slot, seed in enumerate(bracket_order(size))}
+    return [(entrant['user_id'], seed, slot_of_seed[seed]) for seed, entrant in enumerate(entrants, 1)]
+
+def first_round_pairings(entrants):
+    """Первый раунд сетки: слоты (0, 1), (2, 3), ... пустой слот дает bye"""
+    by_slot = {e['slot']: e['user_id'] for e in entrants}
+    size = 1 << max(1, math.ceil(math.log2(max(len(entrants), 2))))
+    pairings = []
+    
+    for slot in range(0, size, 2):
+        first, second = by_slot.get(slot), by_slot.get(slot + 1)
+        if first is None and second is None:
+            continue
+        if first is None:
+            first, second = second, None
+        pairings.append(('W', first, second))
+    
+    return pairings
+
+def pair_in_order(players, bracket):
+    """
+    Пары соседей по порядку (players — участники от высшего места к низшему).
+    При нечетном числе bye получает участник с самым низким местом без bye, как в swiss_pairings
+    """
+    players = list(players)
+    bye = None
+    if len(players) % 2:
+        idx = next((i for i in range(len(players) - 1, -1, -1) if not players[i]['byes']), len(players) - 1)
+        bye = players.pop(idx)
+    
+    pairings = [(bracket, players[i]['user_id'], players[i + 1]['user_id']) for i in range(0, len(players), 2)]
+    if bye:
+        pairings.append((bracket, bye['user_id'], None))
+    return pairings
+
+def elimination_pairings(entrants, max_losses):
+    """
+    Следующий раунд сетки на выбывание.
+    Верхняя сетка (0 поражений) играет по слотам, нижняя (1 поражение, только double)
+    — по раунду вылета из верхней и слоту. Returns: список пар или [] если турнир окончен
+    """
+    alive = sorted((e for e in entrants if e['losses'] < max_losses), key=lambda e: e['slot'])
+    if len(alive) <= 1:
+        return []
+    
+    winners = [e for e in alive if e['losses'] == 0]
+    losers = sorted((e for e in alive if e['losses'] > 0), key=lambda e: (-e['wins'], e['slot']))
+    
+    # Суперфинал: победитель верхней сетки против победителя нижней
+    if len(winners) + len(losers) == 2:
+        players = winners + losers
+        return [('GF', players[0]['user_id'], players[1]['user_id'])]
+    
+    pairings = []
+    if len(winners) > 1:
+        pairings += pair_in_order(winners, 'W')
+    if len(losers) > 1:
+        pairings += pair_in_order(losers, 'L')
+    return pairings
+
+def swiss_pairings(entrants, played):
+    """
+    Пары швейцарской системы: сортировка по очкам и Бухгольцу, соседи по таблице
+    играют друг с другом, повторные встречи обходятся в пределах SWISS_LOOKAHEAD.
+    Нечетный участник с самым низким местом без bye получает bye. O(n log n)
+    """
+    order = sorted(entrants, key=lambda e: (-e['score'], -e['buchholz'], e['seed']))
+    pairings = []
+    
+    if len(order) % 2:
+        idx = next((i for i in range(len(order) - 1, -1, -1) if not order[i]['byes']), len(order) - 1)
+        pairings.append(('S', order.pop(idx)['user_id'], None))
+    
+    players = [e['user_id'] for e in order]
+    used = set()
+    
+    for i, player in enumerate(players):
+        if player in used:
+            continue
+        used.add(player)
+        
+        partner = None
+        fallback = None
+        checked = 0
+        for candidate in players[i + 1:]:
+            if candidate in used:
+                continue
+            if fallback is None:
+                fallback = candidate
+            if frozenset((player, candidate)) not in played:
+                partner = candidate
+                break
+            checked += 1
+            if checked >= SWISS_LOOKAHEAD:
+                break
+        
+        partner = partner or fallback
+        used.add(partner)
+        pairings.append(('S', player, partner))
+    
+    return pairings
+
+class TournamentEngine:
+    """Управление турнирами: запись, посев, раунды, результаты по battlelog"""
+    
+    def __init__(self, db, cr_api):
+        self.db = db
+        self.cr_api = cr_api
+    
+    def get_tournament(self, tournament_id, status=None):
+        tournament = self.db.get_tournament(tournament_id)
+        if not tournament:
+            raise ValueError('Турнир не найден')
+        if status and tournament['status'] != status:
+            raise ValueError({
+                'registration': 'Турнир уже начался',
+                'running': 'Турнир не идет'
+            }.get(status, 'Неверный статус турнира'))
+        return tournament
+    
+    def create(self, name, fmt, created_by, chat_id=None, multiplier=1, game_mode=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Формат должен быть одним из: {', '.join(FORMATS)}")
+        if multiplier <= 0:
+            raise ValueError('Множитель очков должен быть больше нуля')
+        return self.db.create_tournament(name, fmt, created_by, chat_id, multiplier, game_mode)
+    
+    def join(self, tournament_id, user):
+        tournament = self.get_tournament(tournament_id)
+        
+        # В турнир на очки можно вступить и после старта: засчитываются игры с момента вступления
+        if tournament['status'] != 'registration' and not (
+            tournament['format'] == 'points' and tournament['status'] == 'running'
+        ):
+            raise ValueError('Запись на турнир закрыта')
+        
+        if not self.db.add_entrant(tournament_id, user['user_id'], user['player_tag']):
+            raise ValueError('Ты уже участвуешь в этом турнире')
+    
+    def finish(self, tournament_id):
+        """Завершить турнир на очки: таблица замораживается, очки больше не начисляются"""
+        tournament = self.get_tournament(tournament_id, 'running')
+        if tournament['format'] != 'points':
+            raise ValueError('Турнир с сеткой завершается сам после последнего раунда: /tnext')
+        self.db.update_tournament(tournament_id, status='finished')
+    
+    def start(self, tournament_id, rounds=None):
+        """Посев по трофеям и первый раунд, Returns: число пар"""
+        tournament = self.get_tournament(tournament_id, 'registration')
+        
+        # Турнир на очки: без пар, очки начисляются за каждую засчитанную игру
+        if tournament['format'] == 'points':
+            self.db.update_tournament(tournament_id, status='running')
+            return 0
+        
+        entrants = self.db.get_entrants(tournament_id)
+        
+        if len(entrants) < 2:
+            raise ValueError('Нужно хотя бы 2 участника')
+        
+        # Посев по трофеям из сохраненных профилей
+        def trophies(entrant):
+            snapshot = self.db.get_player_snapshot(entrant['player_tag'])
+            return snapshot['trophies'] if snapshot else 0
+        
+        entrants.sort(key=trophies, reverse=True)
+        seeds = assign_slots(entrants)
+        self.db.set_seeds(tournament_id, seeds)
+        
+        if tournament['format'] == 'swiss':
+            total_rounds = rounds or max(1, math.ceil(math.log2(len(entrants))))
+        else:
+            total_rounds = 0
+        self.db.update_tournament(tournament_id, status='running', rounds=total_rounds)
+        
+        for entrant, (_, seed, slot) in zip(entrants, seeds):
+            entrant['seed'], entrant['slot'] = seed, slot
+        
+        if tournament['format'] == 'swiss':
+            pairings = swiss_pairings(entrants, set())
+        else:
+            pairings = first_round_pairings(entrants)
+        
+        self.db.save_round(tournament_id, 1, pairings, WIN_POINTS)
+        return len(pairings)
+    
+    def advance(self, tournament_id):
+        """
+        Следующий раунд, если все пары текущего сыграны
+        Returns: число пар нового раунда или 0, если турнир завершен
+        """
+        tournament = self.get_tournament(tournament_id, 'running')
+        if tournament['format'] == 'points':
+            raise ValueError('В турнире на очки нет раундов, завершить: /tfinish')
+        
+        pending = self.db.count_pending_pairings(tournament_id, tournament['current_round'])
+        
+        if pending:
+            raise ValueError(f'В раунде {tournament["current_round"]} еще не сыграно пар: {pending}')
+        
+        entrants = self.db.get_entrants(tournament_id)
+        
+        if tournament['format'] == 'swiss':
+            if tournament['current_round'] >= tournament['rounds']:
+                pairings = []
+            else:
+                pairings = swiss_pairings(entrants, self.db.get_played_pairs(tournament_id))
+        else:
+            pairings = elimination_pairings(entrants, MAX_LOSSES[tournament['format']])
+        
+        if not pairings:
+            self.db.update_tournament(tournament_id, status='finished')
+            return 0
+        
+        self.db.save_round(tournament_id, tournament['current_round'] + 1, pairings, WIN_POINTS)
+        return len(pairings)
+    
+    def report_result(self, tournament_id, user):
+        """
+        Найти бой пары в battlelog игрока и записать результат
+        Returns: (battle_data, winner_id)
+        """
+        tournament = self.get_tournament(tournament_id, 'running')
+        if tournament['format'] == 'points':
+            raise ValueError('В турнире на очки результаты засчитываются через /verify')
+        
+        pairing = self.db.get_pending_pairing(tournament_id, user['user_id'])
+        
+        if not pairing:
+            raise ValueError('У тебя нет несыгранной пары в этом турнире')
+        
+        opponent_id = pairing['user2_id'] if pairing['user1_id'] == user['user_id'] else pairing['user1_id']
+        opponent = self.db.get_entrant(tournament_id, opponent_id)
+        since = datetime.strptime(pairing['created_at'], '%Y-%m-%d %H:%M:%S')
+        
+        battle_data = self.cr_api.find_battle_against(user['player_tag'], opponent['player_tag'], since)
+        if not battle_data:
+            raise ValueError(f"Бой против {opponent['player_tag']} не найден в истории. Сыграй и попробуй снова")
+        
+        fmt = tournament['format']
+        if battle_data['result'] == 'draw':
+            if fmt != 'swiss':
+                raise ValueError('Ничья в сетке на выбывание не считается — переиграйте')
+            winner_id = None
+        else:
+            winner_id = user['user_id'] if battle_data['result'] == 'win' else opponent_id
+        
+        recorded = self.db.record_pairing_result(
+            tournament_id, pairing, winner_id, battle_data['fingerprint'],
+            win_points=WIN_POINTS, draw_points=DRAW_POINTS, max_losses=MAX_LOSSES[fmt]
+        )
+        if not recorded:
+            raise ValueError('Результат уже записан')
+        
+        return battle_data, winner_id
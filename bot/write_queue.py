@@ -0,0 +1,68 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GameWriteQueue:
+    """
+    Групповая запись игр: add_game из параллельных обработчиков копятся
+    несколько миллисекунд и пишутся одной транзакцией (один fsync на пачку).
+    Обработчик ждет, пока его игра закоммичена, поэтому сразу после
+    await add_game() он видит свои очки в БД.
+    """
+    
+    def __init__(self, db, max_batch=100, max_delay=0.005):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []
+        self.wakeup = None
+        self.task = None
+    
+    async def add_game(self, user_id, battle_data, points_earned):
+        """
+        Поставить игру в очередь и дождаться записи
+        Returns: False, если пользователь уже засчитал этот бой (как Database.add_game)
+        """
+        # Цикл записи запускается при первой игре в текущем event loop
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((user_id, battle_data, points_earned, future))
+        self.wakeup.set()
+        
+        return await future
+    
+    async def run(self):
+        """Цикл записи: ждет первую игру, добирает пачку и пишет ее в отдельном потоке"""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            
+            # Даем соседним обработчикам успеть положить свои игры в ту же транзакцию
+            if len(self.pending) < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            
+            while self.pending:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+                await self.flush(batch)
+    
+    async def flush(self, batch):
+        try:
+            results = await asyncio.to_thread(
+                self.db.add_games,
+                [(user_id, battle_data, points_earned) for user_id, battle_data, points_earned, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} games: {e}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (*_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
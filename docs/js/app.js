@@ -33,7 +33,9 @@ let userData = {
     wins: 0,
     losses: 0,
     position: '-',
-    registered: false
+    registered: false,
+    botUsername: null,
+    meta: []
 };
 
 // Применяем сохраненные данные
@@ -49,7 +51,9 @@ if (savedData) {
         wins: savedData.wins || 0,
         losses: savedData.losses || 0,
         position: savedData.position || '-',
-        registered: savedData.registered === true
+        registered: savedData.registered === true,
+        botUsername: savedData.bot_username || null,
+        meta: savedData.meta || []
     };
     console.log('User is registered!', userData);
 }
@@ -139,7 +143,9 @@ function syncData() {
             wins: data.wins || 0,
             losses: data.losses || 0,
             position: data.position || '-',
-            registered: true
+            registered: true,
+            botUsername: data.bot_username || null,
+            meta: data.meta || []
         };
         
         // Обновляем интерфейс
@@ -172,6 +178,7 @@ function switchTab(tabName) {
     
     if (tabName === 'leaderboard') {
         loadLeaderboard();
+        loadMeta();
     } else if (tabName === 'history') {
         loadHistory();
     }
@@ -251,6 +258,26 @@ function loadLeaderboard() {
     list.innerHTML = '<div class="hint" style="text-align: center; padding: 2rem;">Используй команду /leaderboard в боте</div>';
 }
 
+function loadMeta() {
+    const list = document.getElementById('metaList');
+    
+    if (userData.meta.length === 0) {
+        list.innerHTML = '<div class="hint" style="text-align: center; padding: 2rem;">Используй /meta в боте</div>';
+        return;
+    }
+    
+    list.innerHTML = userData.meta.map((card, idx) => `
+        <div class="leaderboard-item">
+            <div class="leaderboard-rank">${idx + 1}</div>
+            <div class="leaderboard-info">
+                <div class="leaderboard-name">${card.name}</div>
+                <div class="leaderboard-tag">${card.usage}% игр</div>
+            </div>
+            <div class="leaderboard-points">${card.winrate}%</div>
+        </div>
+    `).join('');
+}
+
 function loadHistory() {
     const list = document.getElementById('historyList');
     
@@ -289,10 +316,18 @@ function updateCountdown() {
     document.getElementById('countdown').textContent = `${days}д ${hours}ч`;
 }
 
-// === MATCH FINDING (остальное без изменений) ===
-let matchSearching = false;
-let matchFound = false;
-let currentOpponent = null;
+// === ПОИСК СОПЕРНИКА ===
+// Очередь живет на сервере бота: соперник подбирается по трофеям,
+// уведомление приходит в чат, бой проверяется по battlelog обоих игроков
+
+function openBotCommand(command, fallbackText) {
+    if (userData.botUsername) {
+        tg.openTelegramLink(`https://t.me/${userData.botUsername}?start=${command}`);
+        tg.close();
+    } else {
+        tg.showAlert(fallbackText);
+    }
+}
 
 function startMatchSearch() {
     if (!userData.registered) {
@@ -300,73 +335,15 @@ function startMatchSearch() {
         return;
     }
     
-    matchSearching = true;
-    document.getElementById('findMatchBtn').style.display = 'none';
-    document.getElementById('searchingSection').style.display = 'block';
     tg.HapticFeedback.impactOccurred('medium');
-    
-    setTimeout(() => {
-        if (matchSearching) findMatch();
-    }, Math.random() * 4000 + 3000);
+    openBotCommand('find', 'Используй /find в боте — соперник подберется по трофеям, бот напишет, когда найдет');
 }
 
 function cancelMatchSearch() {
-    matchSearching = false;
-    document.getElementById('searchingSection').style.display = 'none';
-    document.getElementById('findMatchBtn').style.display = 'block';
-    tg.HapticFeedback.impactOccurred('soft');
-}
-
-function findMatch() {
-    matchSearching = false;
-    matchFound = true;
-    currentOpponent = generateOpponent();
-    document.getElementById('searchingSection').style.display = 'none';
-    showMatchFound(currentOpponent);
-    tg.HapticFeedback.notificationOccurred('success');
-}
-
-function generateOpponent() {
-    const names = ['ProGamer', 'CrownKing', 'Arena15', 'Challenger', 'Winner', 'Champion', 'Gladiator'];
-    return {
-        name: names[Math.floor(Math.random() * names.length)],
-        trophies: Math.floor(Math.random() * 3000) + 4000,
-        tag: '#' + Math.random().toString(36).substr(2, 8).toUpperCase(),
-        avatar: names[0].charAt(0)
-    };
-}
-
-function showMatchFound(opponent) {
-    document.getElementById('yourAvatar').textContent = userData.firstName.charAt(0).toUpperCase();
-    document.getElementById('yourName').textContent = userData.firstName;
-    document.getElementById('yourTrophies').textContent = '🏆 ' + (userData.currentMonthPoints * 10 || 5000);
-    document.getElementById('opponentAvatar').textContent = opponent.name.charAt(0);
-    document.getElementById('opponentName').textContent = opponent.name;
-    document.getElementById('opponentTrophies').textContent = '🏆 ' + opponent.trophies;
-    document.getElementById('opponentNameStrong').textContent = opponent.name;
-    document.getElementById('matchFoundSection').style.display = 'block';
+    tg.showAlert('Используй /cancelfind в боте');
 }
 
 function verifyMatch() {
-    if (!currentOpponent) {
-        tg.showAlert('Ошибка: соперник не найден');
-        return;
-    }
-    const btn = document.getElementById('verifyMatchBtn');
-    btn.textContent = '⏳ Проверяем...';
-    btn.disabled = true;
     tg.HapticFeedback.impactOccurred('medium');
-    tg.showAlert('Используй /verify в боте, затем /sync для обновления');
-    setTimeout(() => resetMatchFinding(), 2000);
-}
-
-function resetMatchFinding() {
-    matchFound = false;
-    currentOpponent = null;
-    document.getElementById('matchFoundSection').style.display = 'none';
-    document.getElementById('searchingSection').style.display = 'none';
-    document.getElementById('findMatchBtn').style.display = 'block';
-    const btn = document.getElementById('verifyMatchBtn');
-    btn.textContent = '✅ Проверить игру';
-    btn.disabled = false;
+    tg.showAlert('Сыграй бой с соперником и используй /matchverify в боте, затем /sync для обновления');
 }